@@ -1,12 +1,38 @@
 import sqlite3
 import json
-from flask import Flask, request, jsonify
+import base64
+import binascii
+import hmac
+import math
+from flask import Flask, request, jsonify, g, has_request_context, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 import datetime
 from datetime import timezone # For timezone-aware UTC datetimes
 import random
 import os
+import atexit
+import click
+import functools
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from catalog import ProductCatalog, count_facets
+from catalog_snapshot import CatalogSnapshot, SnapshotError, write_snapshot
+from conversation_state import ConversationStore
+from db_pool import ConnectionPool, PoolTimeout
+from history_writer import ChatHistoryWriter
+from instrumentation import Instrumentation, metric_lines
+from intent_parser import parse_chat_intent, intent_cache_info
+from password_hasher import HasherBusy, PasswordHasher
+from rate_limiter import RateLimiter
+from response_encoding import COMPRESSIBLE_MIMETYPES, ResponseCompressor, body_etag
+from result_cache import ResultCache
+from sampling_profiler import SamplingProfiler
+from search_index import KeywordIndex, tokenize
+from session_tokens import SessionTokens
 
 # Initialize the Flask application
 app = Flask(__name__)
@@ -14,192 +40,650 @@ app = Flask(__name__)
 # allowing the frontend (on a different port) to communicate with this backend.
 CORS(app)
 
-# Database configuration
-DATABASE_NAME = 'ecommerce.db'
+# Database configuration (DATABASE_NAME may point elsewhere, e.g. at a generated benchmark database)
+DATABASE_NAME = os.environ.get('DATABASE_NAME', 'ecommerce.db')
+
+# Product lookups for /chat and /products are answered from an in-memory columnar copy
+# of the products table. Set CATALOG_BACKEND=sqlite to fall back to querying SQLite directly.
+USE_MEMORY_CATALOG = os.environ.get('CATALOG_BACKEND', 'memory').lower() != 'sqlite'
+# The catalog version being served with its ProductCatalog and the inverted index used to rank keyword
+# matches (BM25) for /chat and /products?search=. Reloads build new ones and replace this tuple, so
+# readers holding the previous one (see current_catalog) are never served a half-built catalog.
+ServedCatalog = namedtuple("ServedCatalog", ["version", "products", "index"])
+served_catalog = ServedCatalog(None, ProductCatalog(), KeywordIndex())
+# Both are built once by `flask --app app migrate` (or `build-catalog`) into a memory-mapped snapshot file
+# that workers map read-only, sharing its pages. A worker falls back to loading from SQLite when the
+# snapshot is missing or doesn't match the products table's current version. '' disables the snapshot.
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT', os.path.splitext(DATABASE_NAME)[0] + '.catalog')
+
+# Number of products returned when the client doesn't pass a 'limit', and the hard upper bound.
+DEFAULT_RESULT_LIMIT = 50
+MAX_RESULT_LIMIT = 200
+# Products per event when /chat streams its results ("stream": true), and rows per fetchmany() when
+# streaming straight from SQLite
+DEFAULT_STREAM_CHUNK_SIZE = 10
+MAX_STREAM_CHUNK_SIZE = 100
+SQLITE_FETCH_SIZE = 50
+# Price histogram of GET /products/facets (and the optional /chat facets): buckets spanning the matching
+# prices unless the client passes its own edges.
+DEFAULT_PRICE_BUCKETS = 10
+MAX_PRICE_BUCKETS = 50
+
+# Product fields returned by /products and /chat. Clients can pick a subset with 'fields', or ask for the
+# compact list view (everything but the long description); GET /products/<id> returns the full product.
+PRODUCT_FIELDS = ProductCatalog.COLUMNS
+COMPACT_PRODUCT_FIELDS = tuple(field for field in PRODUCT_FIELDS if field != "description")
+
+# JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed for clients that accept it: brotli when
+# the optional brotli package is installed, gzip otherwise. Compressed copies of recent GET bodies are reused.
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))  # Bytes
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_CACHE_SIZE = int(os.environ.get('COMPRESS_CACHE_SIZE', 256))  # Compressed bodies kept; 0 disables
+response_compressor = ResponseCompressor(
+    min_size=COMPRESS_MIN_SIZE,
+    gzip_level=COMPRESS_GZIP_LEVEL,
+    brotli_quality=COMPRESS_BROTLI_QUALITY,
+    cache_size=COMPRESS_CACHE_SIZE,
+)
+
+# Serialized /chat and /products results, keyed on the parsed intent or filters plus the catalog version.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 2048))  # Max cached results; 0 disables the cache
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 60))    # Seconds
+result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+# Every write to the products table bumps catalog_meta.version (via triggers). Each worker re-reads it
+# at most this often (seconds), reloading its in-memory catalog when another process changed the products.
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 1.0))
+catalog_state = {"version": None, "checked_at": float('-inf'), "source": None, "snapshot_mtime": None}
+catalog_lock = threading.RLock()
+
+# Per-request stage timings ("spans"), SQL statement timings and latency histograms, exported in the
+# Prometheus text format at GET /metrics. Statements slower than SLOW_SQL_MS are also logged.
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION', '1') != '0'
+SLOW_SQL_MS = float(os.environ.get('SLOW_SQL_MS', 100))
+instrumentation = Instrumentation(enabled=INSTRUMENTATION_ENABLED, slow_sql_seconds=SLOW_SQL_MS / 1000)
+span = instrumentation.span
+# On-demand sampling profiler, off unless PROFILING_TOKEN is set: a request sent with
+# 'X-Profile: <PROFILING_TOKEN>' is profiled (see GET /metrics/profiles/<id>), and
+# POST /metrics/profile samples the whole worker for a few seconds.
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+MAX_PROFILE_SECONDS = 60
+RECENT_PROFILES = 20  # Per-request profiles kept for retrieval
+recent_profiles = OrderedDict()
+profiles_lock = threading.Lock()
+
+# Connection pool / SQLite tuning (overridable through environment variables)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))               # Max open connections per worker process
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))      # Seconds to wait for a free connection
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+SQLITE_CACHED_STATEMENTS = int(os.environ.get('SQLITE_CACHED_STATEMENTS', 256))
 
 def get_db_connection():
-    """Establishes a connection to the SQLite database.
+    """Establishes a new, tuned connection to the SQLite database.
     Configures rows to be returned as dictionary-like objects for easier column access.
+    Routes should not call this directly; use `db_connection()` to borrow a pooled connection instead.
     """
-    conn = sqlite3.connect(DATABASE_NAME)
+    # check_same_thread=False: pooled connections are handed between request threads (never used concurrently)
+    # The instrumentation's connection class times every statement (plain sqlite3.Connection when disabled)
+    conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS,
+                           factory=instrumentation.connection_class)
     conn.row_factory = sqlite3.Row # Allows accessing columns by name (e.g., row['username'])
+    # WAL lets readers proceed while chat_history inserts are being written;
+    # synchronous=NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
+db_pool = ConnectionPool(get_db_connection, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+
+def db_connection():
+    """Borrows a connection from the pool for use in a `with` block:
+
+        with db_connection() as conn:
+            conn.execute(...)
+
+    The connection is returned to the pool (with any uncommitted transaction rolled back) afterwards.
+    """
+    return db_pool.connection()
+
+# Chat history inserts are queued and written in batches by a background thread.
+# New entries are rejected with a 503 once HISTORY_MAX_PENDING entries are waiting.
+HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 200))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 0.05))  # Seconds
+HISTORY_MAX_PENDING = int(os.environ.get('HISTORY_MAX_PENDING', 10000))
+MAX_HISTORY_BATCH = 500  # Max entries accepted by a single POST /chat/history/batch
+# How far ahead of the server clock a client-supplied history timestamp may be (milliseconds)
+HISTORY_MAX_CLOCK_SKEW_MS = int(os.environ.get('HISTORY_MAX_CLOCK_SKEW_MS', 24 * 60 * 60 * 1000))
+# Page size for GET /chat/history when no 'limit' is given, and its upper bound
+DEFAULT_HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+history_writer = ChatHistoryWriter(
+    db_connection,
+    batch_size=HISTORY_BATCH_SIZE,
+    flush_interval=HISTORY_FLUSH_INTERVAL,
+    max_pending=HISTORY_MAX_PENDING,
+)
+# Write out anything still queued when the worker shuts down
+atexit.register(history_writer.close)
+
+# Per-user state of the last /chat query (its intent and result ids), so follow-ups such as "cheaper ones"
+# or "only under 20k" narrow the previous results in memory instead of running a new search.
+# Users beyond CONVERSATION_MAX_USERS, or beyond CONVERSATION_MAX_TOTAL_IDS stored ids (8 bytes each),
+# are dropped least recently used first; result sets larger than CONVERSATION_MAX_RESULT_IDS keep only
+# their intent. With CONVERSATION_PERSIST=1 the state is also kept in the conversation_state table,
+# so it is shared by every worker and survives restarts.
+CONVERSATION_MAX_USERS = int(os.environ.get('CONVERSATION_MAX_USERS', 10000))  # 0 disables follow-ups
+CONVERSATION_TTL = float(os.environ.get('CONVERSATION_TTL', 30 * 60))           # Seconds
+CONVERSATION_MAX_RESULT_IDS = int(os.environ.get('CONVERSATION_MAX_RESULT_IDS', 5000))
+CONVERSATION_MAX_TOTAL_IDS = int(os.environ.get('CONVERSATION_MAX_TOTAL_IDS', 1000000))
+CONVERSATION_PERSIST = os.environ.get('CONVERSATION_PERSIST', '0') == '1'
+SQLITE_ID_BATCH = 500  # Ids per "id IN (...)" query
+conversation_store = ConversationStore(
+    max_users=CONVERSATION_MAX_USERS,
+    ttl=CONVERSATION_TTL,
+    max_result_ids=CONVERSATION_MAX_RESULT_IDS,
+    max_total_ids=CONVERSATION_MAX_TOTAL_IDS,
+    connection=db_connection if CONVERSATION_PERSIST else None,
+)
+
+# Password hashing runs in a separate process pool so login bursts don't starve /chat of CPU.
+# Changing PASSWORD_HASH_METHOD (e.g. a higher scrypt cost) rehashes each password on the user's next login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))          # Hashing processes per worker
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32)) # Queued hashes before 503s
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))       # Seconds
+password_hasher = PasswordHasher(
+    method=PASSWORD_HASH_METHOD,
+    workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    timeout=PASSWORD_HASH_TIMEOUT,
+)
+atexit.register(password_hasher.shutdown)
+# /register and /login attempts allowed per client IP and per username: a burst, then N per minute
+AUTH_RATE_PER_IP = int(os.environ.get('AUTH_RATE_PER_IP', 30))
+AUTH_BURST_PER_IP = int(os.environ.get('AUTH_BURST_PER_IP', 10))
+AUTH_RATE_PER_USERNAME = int(os.environ.get('AUTH_RATE_PER_USERNAME', 10))
+AUTH_BURST_PER_USERNAME = int(os.environ.get('AUTH_BURST_PER_USERNAME', 5))
+ip_rate_limiter = RateLimiter(per_minute=AUTH_RATE_PER_IP, burst=AUTH_BURST_PER_IP)
+username_rate_limiter = RateLimiter(per_minute=AUTH_RATE_PER_USERNAME, burst=AUTH_BURST_PER_USERNAME)
+# Number of reverse proxies in front of the app that append the client address to X-Forwarded-For.
+# 0 (the default) throttles by the connecting address, which behind a proxy is the proxy's for every
+# client. Only set it when those proxies are the sole way in, or clients could pick their own address.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# Signed session tokens, verified in memory by any worker. Signing keys live in the session_keys table
+# unless SESSION_TOKEN_KEYS="kid:secret,kid:secret" is set (the first key signs, the others only verify).
+# Workers re-read the keys and tokens revoked elsewhere at most every AUTH_SYNC_INTERVAL seconds.
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', 24 * 60 * 60))  # Seconds
+SESSION_TOKEN_KEYS = os.environ.get('SESSION_TOKEN_KEYS', '')
+AUTH_SYNC_INTERVAL = float(os.environ.get('AUTH_SYNC_INTERVAL', 5.0))
+session_tokens = SessionTokens(ttl=SESSION_TOKEN_TTL)
+auth_state = {"checked_at": None, "last_revocation_id": 0}
+auth_lock = threading.Lock()
+
 def create_tables():
     """Sets up the necessary database tables if they haven't been created yet.
     This is typically run once when the application starts.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Table for storing user credentials
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL
+            )
+        ''')
+
+        # Table for storing product information
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                category TEXT NOT NULL,
+                price REAL NOT NULL,
+                stock INTEGER NOT NULL,
+                description TEXT,
+                image_url TEXT
+            )
+        ''')
+
+        # Single-row counter bumped by triggers on every products write; cached results are keyed on it
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)")
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS products_version_after_{event.lower()} AFTER {event} ON products
+                BEGIN
+                    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+        create_product_search_index(cursor)
+
+        # HMAC keys for session tokens (the newest one signs) and revoked token ids
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS session_keys (
+                kid TEXT PRIMARY KEY,
+                secret TEXT NOT NULL,                -- Hex-encoded random key
+                created_at INTEGER NOT NULL          -- UTC epoch seconds
+            )
+        ''')
+        if cursor.execute("SELECT COUNT(*) FROM session_keys").fetchone()[0] == 0:
+            insert_session_key(cursor)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token_id TEXT UNIQUE NOT NULL,
+                expires_at INTEGER NOT NULL          -- When the token expires anyway (UTC epoch seconds)
+            )
+        ''')
+
+        # Table for storing chat messages between users and the bot
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,            -- Which user this message belongs to
+                message TEXT NOT NULL,               -- The content of the message
+                is_user_message BOOLEAN NOT NULL,    -- True if it's a user's message, False if it's a bot's response
+                timestamp INTEGER NOT NULL,          -- When the message was recorded (UTC epoch milliseconds)
+                product_ids TEXT,                    -- Comma-separated ids of products shown with a bot response
+                FOREIGN KEY (user_id) REFERENCES users (id)   -- Links to the users table
+            )
+        ''')
+
+        # Databases created before product_ids existed get the column added in place
+        history_columns = {row['name'] for row in cursor.execute("PRAGMA table_info(chat_history)")}
+        if 'product_ids' not in history_columns:
+            cursor.execute("ALTER TABLE chat_history ADD COLUMN product_ids TEXT")
+
+        # Older rows stored timestamps as assorted strings; rewrite them as epoch milliseconds
+        migrate_history_timestamps(cursor)
+
+        # Serves per-user history pages in (timestamp, id) order without sorting
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp)
+        ''')
+
+        # Each user's last /chat query, for follow-ups (written only with CONVERSATION_PERSIST=1)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_state (
+                user_id INTEGER PRIMARY KEY,
+                turn INTEGER NOT NULL,               -- When the query was made (UTC epoch milliseconds)
+                intent TEXT NOT NULL,                -- The parsed (or refined) intent as JSON
+                product_ids BLOB,                    -- Result ids in rank order as 64-bit integers, if kept
+                catalog_version INTEGER,             -- catalog_meta.version the ids were computed against
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        conn.commit()
 
-    # Table for storing user credentials
+def create_product_search_index(cursor):
+    """Creates products_fts, the full-text index of product names and descriptions that keyword
+    searches use with CATALOG_BACKEND=sqlite, and the triggers keeping it in sync with products.
+    It is tokenized like search_index.KeywordIndex, so both backends match the same products.
+    Rows already in products are indexed when the table is first created.
+    """
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone()
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 0'
         )
     ''')
-
-    # Table for storing product information
+    if not fts_exists:
+        cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")  # Index existing rows
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            price REAL NOT NULL,
-            stock INTEGER NOT NULL,
-            description TEXT,
-            image_url TEXT
-        )
+        CREATE TRIGGER IF NOT EXISTS products_fts_after_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
     ''')
-
-    # Table for storing chat messages between users and the bot
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,            -- Which user this message belongs to
-            message TEXT NOT NULL,               -- The content of the message
-            is_user_message BOOLEAN NOT NULL,    -- True if it's a user's message, False if it's a bot's response
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, -- When the message was recorded
-            FOREIGN KEY (user_id) REFERENCES users (id)   -- Links to the users table
-        )
+        CREATE TRIGGER IF NOT EXISTS products_fts_after_update AFTER UPDATE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_after_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
     ''')
-    conn.commit()
-    conn.close()
+
+def migrate_history_timestamps(cursor):
+    """Converts chat_history timestamps that aren't integer epoch milliseconds yet.
+    Rows whose timestamp can't be parsed are set to 0 (the epoch) so they sort first instead of failing startup.
+    """
+    legacy_rows = cursor.execute(
+        "SELECT id, timestamp FROM chat_history WHERE typeof(timestamp) != 'integer'"
+    ).fetchall()
+    if not legacy_rows:
+        return
+    updates = []
+    for row in legacy_rows:
+        try:
+            updates.append((parse_timestamp_ms(row['timestamp']), row['id']))
+        except (TypeError, ValueError):
+            app.logger.warning(f"Unparseable chat_history timestamp {row['timestamp']!r} (id {row['id']}); using 0.")
+            updates.append((0, row['id']))
+    cursor.executemany("UPDATE chat_history SET timestamp = ? WHERE id = ?", updates)
+    app.logger.info(f"Migrated {len(updates)} chat_history timestamps to epoch milliseconds.")
 
 def populate_products():
     """Adds a set of mock products to the database if the products table is currently empty.
     This is useful for development and demonstration purposes.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM products")
-    if cursor.fetchone()[0] == 0:
-        categories = ["Electronics", "Books", "Clothing", "Home & Kitchen", "Sports", "Toys"]
-        product_adjectives = ["Premium", "Budget", "High-Performance", "Eco-Friendly", "Compact", "Durable", "Smart"]
-        product_nouns = ["Laptop", "Smartphone", "Headphones", "Keyboard", "Mouse", "Monitor", "Charger", "Speaker", "Novel", "Textbook", "Cookbook", "T-Shirt", "Jeans", "Jacket", "Blender", "Toaster", "Coffee Maker", "Dumbbells", "Yoga Mat", "Action Figure", "Board Game"]
-
-        products_to_add = []
-        for i in range(105): # Aim for a bit over 100 products for a good variety
-            adj = random.choice(product_adjectives)
-            noun = random.choice(product_nouns)
-            name = f"{adj} {noun} Model {random.randint(100, 999)}"
-            category = random.choice(categories)
-            price = round(random.uniform(10.0, 2000.0), 2)
-            stock = random.randint(0, 200)
-            description = f"A high-quality {name} from the {category} category. Perfect for your needs. Features include: feature A, feature B, and outstanding feature C. Only {stock} left in stock!"
-            # Using picsum.photos for varied placeholder images.
-            # Seeding with name and index helps get somewhat consistent images for the same product if repopulated.
-            image_url = f"https://picsum.photos/seed/{name.replace(' ', '_')}_{i}/600/400"
-            products_to_add.append((name, category, price, stock, description, image_url))
-
-        cursor.executemany('''
-            INSERT INTO products (name, category, price, stock, description, image_url)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', products_to_add)
-        conn.commit()
-        app.logger.info(f"{len(products_to_add)} products populated.")
-    else:
-        app.logger.info("Products table already populated.")
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM products")
+        if cursor.fetchone()[0] == 0:
+            categories = ["Electronics", "Books", "Clothing", "Home & Kitchen", "Sports", "Toys"]
+            product_adjectives = ["Premium", "Budget", "High-Performance", "Eco-Friendly", "Compact", "Durable", "Smart"]
+            product_nouns = ["Laptop", "Smartphone", "Headphones", "Keyboard", "Mouse", "Monitor", "Charger", "Speaker", "Novel", "Textbook", "Cookbook", "T-Shirt", "Jeans", "Jacket", "Blender", "Toaster", "Coffee Maker", "Dumbbells", "Yoga Mat", "Action Figure", "Board Game"]
 
+            products_to_add = []
+            for i in range(105): # Aim for a bit over 100 products for a good variety
+                adj = random.choice(product_adjectives)
+                noun = random.choice(product_nouns)
+                name = f"{adj} {noun} Model {random.randint(100, 999)}"
+                category = random.choice(categories)
+                price = round(random.uniform(10.0, 2000.0), 2)
+                stock = random.randint(0, 200)
+                description = f"A high-quality {name} from the {category} category. Perfect for your needs. Features include: feature A, feature B, and outstanding feature C. Only {stock} left in stock!"
+                # Using picsum.photos for varied placeholder images.
+                # Seeding with name and index helps get somewhat consistent images for the same product if repopulated.
+                image_url = f"https://picsum.photos/seed/{name.replace(' ', '_')}_{i}/600/400"
+                products_to_add.append((name, category, price, stock, description, image_url))
 
-# --- Utility / Helper Functions ---
+            cursor.executemany('''
+                INSERT INTO products (name, category, price, stock, description, image_url)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', products_to_add)
+            conn.commit()
+            app.logger.info(f"{len(products_to_add)} products populated.")
+        else:
+            app.logger.info("Products table already populated.")
 
-def generate_session_token(user_id):
-    """Creates a basic session token.
-    NOTE: This is for demonstration only and is NOT cryptographically secure for production.
-          A proper implementation would use JWT or a similar secure token mechanism.
+def refresh_product_catalog():
+    """Reloads the in-memory product catalog and keyword index and records the catalog version they
+    reflect. They are mapped from the catalog snapshot when it was built for the current version, and
+    otherwise loaded from the products table. Must be called after bulk writes to the products table
+    so lookups (and cached results) stay in sync.
     """
-    return f"session_token_for_user_{user_id}_{datetime.datetime.now(timezone.utc).timestamp()}"
+    with catalog_lock, db_connection() as conn:
+        # Read the version first: a write landing mid-reload then just triggers another reload later
+        version = read_catalog_version(conn)
+        catalog, index = served_catalog.products, served_catalog.index
+        if USE_MEMORY_CATALOG:
+            # Built off to the side; requests keep using the current ones until they are published
+            catalog, index = ProductCatalog(), KeywordIndex()
+            catalog_state["snapshot_mtime"] = catalog_snapshot_mtime()
+            snapshot = open_catalog_snapshot(version)
+            if snapshot is not None:
+                catalog.load_snapshot(snapshot)
+                index.load_snapshot(snapshot)
+                catalog_state["source"] = "snapshot"
+            else:
+                catalog.load(conn)
+                index.build(conn)
+                catalog_state["source"] = "database"
+            app.logger.info(f"Product catalog loaded with {len(catalog)} products "
+                            f"(version {version}) from the {catalog_state['source']}.")
+        publish_catalog(version, catalog, index)
+
+def publish_catalog(version, catalog, index):
+    """Makes a fully built catalog and keyword index the ones served to new requests (caller holds
+    catalog_lock)."""
+    global served_catalog
+    served_catalog = ServedCatalog(version, catalog, index)
+    catalog_state["version"] = version
+    catalog_state["checked_at"] = time.monotonic()
+
+def catalog_snapshot_mtime():
+    """Returns the catalog snapshot file's modification time (ns), or None if there is none."""
+    try:
+        return os.stat(CATALOG_SNAPSHOT).st_mtime_ns if CATALOG_SNAPSHOT else None
+    except OSError:
+        return None
 
-def parse_chat_intent(message):
+def open_catalog_snapshot(version):
+    """Maps the catalog snapshot file, or returns None if it is missing, unreadable or was built
+    for a different catalog version than `version`."""
+    if not CATALOG_SNAPSHOT:
+        return None
+    try:
+        snapshot = CatalogSnapshot(CATALOG_SNAPSHOT)
+    except FileNotFoundError:
+        app.logger.warning(f"No catalog snapshot at {CATALOG_SNAPSHOT}; run `flask --app app build-catalog` to create one.")
+        return None
+    except (OSError, SnapshotError) as e:
+        app.logger.warning(f"Ignoring catalog snapshot: {e}")
+        return None
+    if snapshot.catalog_version != version:
+        app.logger.warning(f"Catalog snapshot {CATALOG_SNAPSHOT} is for catalog version {snapshot.catalog_version}, "
+                           f"the database is at {version}; run `flask --app app build-catalog` to rebuild it.")
+        return None
+    return snapshot
+
+def build_catalog_snapshot():
+    """Builds the product catalog and keyword index from the products table and writes them to
+    CATALOG_SNAPSHOT. Returns (catalog version, product count, snapshot size in bytes).
     """
-    Performs a very basic analysis of the user's message to extract potential
-    product categories, price constraints, and general keywords.
-    This is a simplified approach; a real-world chatbot would use more advanced NLP.
+    catalog, index = ProductCatalog(), KeywordIndex()
+    with db_connection() as conn:
+        conn.execute("BEGIN")  # A single read transaction, so the version matches the rows read
+        try:
+            version = read_catalog_version(conn)
+            catalog.load(conn)
+            index.build(conn)
+        finally:
+            conn.rollback()
+    size = write_snapshot(CATALOG_SNAPSHOT, version, [catalog, index])
+    return version, len(catalog), size
+
+def read_catalog_version(conn):
+    """Returns the products table version counter maintained by the catalog_meta triggers."""
+    return conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+
+def check_catalog_version():
+    """Re-reads the catalog version from the database at most every CATALOG_VERSION_CHECK_INTERVAL
+    seconds. If another process changed the products table (or rebuilt the catalog snapshot), the
+    in-memory catalog is reloaded. The first call in a worker process loads the catalog.
     """
-    message_lower = message.lower() # Normalize to lowercase for easier matching
-    intent = {"category": None, "min_price": None, "max_price": None, "keywords": []}
-    words = message_lower.split()
+    if time.monotonic() - catalog_state["checked_at"] < CATALOG_VERSION_CHECK_INTERVAL:
+        return
+    with catalog_lock:
+        # Another thread may have refreshed while this one waited for the lock
+        if time.monotonic() - catalog_state["checked_at"] >= CATALOG_VERSION_CHECK_INTERVAL:
+            with db_connection() as conn:
+                version = read_catalog_version(conn)
+            snapshot_changed = USE_MEMORY_CATALOG and catalog_snapshot_mtime() != catalog_state["snapshot_mtime"]
+            if version != catalog_state["version"] or snapshot_changed:
+                refresh_product_catalog()
+            else:
+                catalog_state["checked_at"] = time.monotonic()
+
+def current_catalog():
+    """Returns the ServedCatalog (version, product catalog, keyword index) to answer from, after
+    check_catalog_version(). Within a request the first call captures it and later calls return the
+    same one, so a reload published by another thread mid-request can't mix two catalogs.
+    """
+    served = g.get("served_catalog") if has_request_context() else None
+    if served is None:
+        check_catalog_version()
+        served = served_catalog
+        if has_request_context():
+            g.served_catalog = served
+    return served
+
+def current_catalog_version():
+    """Returns the version of the catalog being served (see current_catalog); cached results are keyed on it."""
+    return current_catalog().version
 
-    # Attempt to identify a product category from the message.
-    # This list could be expanded or loaded from a configuration.
-    categories_db = ["electronics", "laptop", "laptops", "mobile", "mobiles", "phone", "phones", "book", "books", "clothing", "clothes", "home", "kitchen", "sports", "toys", "headphones"]
-    for word in words:
-        if word in categories_db:
-            # Map variations to a canonical category name if needed
-            if word in ["laptop", "laptops", "mobile", "mobiles", "phone", "phones", "headphones"]:
-                intent["category"] = "Electronics" # Grouping common electronics
+def upsert_product(product):
+    """Inserts a product (dict without an 'id') or updates an existing one (with 'id'),
+    keeping the in-memory catalog and keyword index in sync. Returns the product id.
+    The write bumps the catalog version, so cached /chat and /products results are invalidated.
+    """
+    values = (product['name'], product['category'], product['price'], product['stock'],
+              product.get('description'), product.get('image_url'))
+    with catalog_lock:
+        with db_connection() as conn:
+            if product.get('id') is None:
+                cursor = conn.execute('''
+                    INSERT INTO products (name, category, price, stock, description, image_url)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', values)
+                product_id = cursor.lastrowid
             else:
-                intent["category"] = word.capitalize()
-            break # Use the first recognized category term
+                product_id = product['id']
+                conn.execute('''
+                    UPDATE products SET name = ?, category = ?, price = ?, stock = ?, description = ?, image_url = ?
+                    WHERE id = ?
+                ''', values + (product_id,))
+            conn.commit()
+            version = read_catalog_version(conn)
+            # Incrementally only if this write is the one change since the catalog was loaded
+            in_step = catalog_state["version"] is not None and version == catalog_state["version"] + 1
+            catalog, index = served_catalog.products, served_catalog.index
+            if USE_MEMORY_CATALOG and in_step:
+                catalog = ProductCatalog()
+                catalog.load(conn)
+                # The keyword index is updated rather than rebuilt, on a copy: requests may be reading it
+                index = index.copy()
+                index.add_or_update(product_id, product['name'], product.get('description'))
+                catalog_state["source"] = "database"
+        if in_step or not USE_MEMORY_CATALOG:
+            publish_catalog(version, catalog, index)
+        else:
+            # Not loaded in this worker yet, or other processes changed products too: reload it all
+            refresh_product_catalog()
+    return product_id
 
-    # Attempt to extract price constraints (e.g., "under 50k", "between 1000 and 2000").
-    # This is a very basic implementation and could be significantly improved using regex or NLP.
-    try:
-        if "under" in message_lower or "below" in message_lower:
-            for i, word_val in enumerate(words):
-                if word_val in ["under", "below"] and i + 1 < len(words):
-                    price_str = words[i+1].replace('k', '000').replace(',', '')
-                    intent["max_price"] = float(price_str)
-                    break
-        elif "over" in message_lower or "above" in message_lower:
-            for i, word_val in enumerate(words):
-                if word_val in ["over", "above"] and i + 1 < len(words):
-                    price_str = words[i+1].replace('k', '000').replace(',', '')
-                    intent["min_price"] = float(price_str)
-                    break
-        elif "between" in message_lower and "and" in message_lower:
-            # Ensure 'between' appears before 'and' and they have values after them
-            idx_between = words.index("between")
-            idx_and = words.index("and")
-            if idx_between < idx_and and idx_between + 1 < len(words) and idx_and + 1 < len(words):
-                min_p_str = words[idx_between+1].replace('k', '000').replace(',', '')
-                max_p_str = words[idx_and+1].replace('k', '000').replace(',', '')
-                intent["min_price"] = float(min_p_str)
-                intent["max_price"] = float(max_p_str)
-    except (ValueError, IndexError): # Catch if 'between' or 'and' not found, or conversion fails
-        app.logger.warning(f"Could not parse price from message: '{message}'")
-
-    # Extract potential keywords by removing common stopwords, already identified category terms,
-    # digits, and words related to price.
-    # This is a naive approach; proper NLP techniques would be more robust.
-    stopwords = [
-        "show", "me", "find", "i'm", "looking", "for", "a", "an", "the", "is", "are", "of", "in", "on", "at",
-        "under", "over", "below", "above", "between", "and", "can", "you", "please", "display", "what", "whats",
-        "any", "some", "about"
-    ]
-    price_related_words = ["price", "cost", "budget", "range", "k", "thousand", "dollar", "dollars", "rupee", "rupees"]
-    
-    # Initial filtering of words not useful for keyword search
-    base_potential_keywords = [
-        word for word in words
-        if word not in stopwords
-        and word not in categories_db # Don't include raw category terms as keywords if already identified
-        and not word.isdigit()
-        and word not in price_related_words
-    ]
-
-    # If a category was identified, further refine keywords by removing words
-    # that might be part of the category name itself (e.g., if category is "Home & Kitchen",
-    # don't include "home" or "kitchen" as separate keywords).
-    final_keywords = []
-    identified_category_lower_words = []
-    if intent.get("category"):
-        # Ensure intent["category"] is not None before calling lower()
-        identified_category_lower_words = intent["category"].lower().split()
-
-    for pk_word in base_potential_keywords:
-        # Only add if it's not part of the identified category phrase
-        if not (identified_category_lower_words and pk_word in identified_category_lower_words):
-            final_keywords.append(pk_word)
-        
-    intent["keywords"] = list(set(final_keywords)) # Use set for unique keywords
-
-    app.logger.info(f"Parsed intent: {intent} from message: '{message}'")
-    return intent
+
+# --- Utility / Helper Functions ---
+
+def now_ms():
+    """Current UTC time as integer epoch milliseconds (the format stored in chat_history.timestamp)."""
+    return int(time.time() * 1000)
+
+def parse_timestamp_ms(value):
+    """Normalizes a timestamp into integer epoch milliseconds.
+    Accepts epoch milliseconds (int or numeric string), ISO-8601 strings with or without a
+    'Z'/offset suffix (including the legacy '+00:00Z' form), and SQLite's 'YYYY-MM-DD HH:MM:SS'.
+    Naive values are treated as UTC. Raises ValueError for anything else.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if text.lstrip('-').isdigit():
+        return int(text)
+    if text.endswith('Z'):
+        text = text[:-1]
+        if not (text.endswith('+00:00') or text.endswith('-00:00')):
+            text += '+00:00'
+    parsed = datetime.datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def format_timestamp_ms(value):
+    """Formats epoch milliseconds as an ISO-8601 UTC string (e.g. '2025-06-07T10:59:44.692Z')."""
+    moment = datetime.datetime.fromtimestamp(value / 1000, timezone.utc)
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+def insert_session_key(conn):
+    """Stores a new random session token signing key; returns its key id."""
+    kid = secrets.token_hex(4)
+    conn.execute("INSERT INTO session_keys (kid, secret, created_at) VALUES (?, ?, ?)",
+                 (kid, secrets.token_hex(32), int(time.time())))
+    return kid
+
+def load_session_keys(conn):
+    """Returns ({kid: secret bytes}, signing kid) from SESSION_TOKEN_KEYS if set, else the session_keys table."""
+    if SESSION_TOKEN_KEYS:
+        pairs = [item.strip().split(':', 1) for item in SESSION_TOKEN_KEYS.split(',') if item.strip()]
+        return {kid: secret.encode() for kid, secret in pairs}, pairs[0][0]
+    rows = conn.execute("SELECT kid, secret FROM session_keys ORDER BY created_at, rowid").fetchall()
+    return {row['kid']: bytes.fromhex(row['secret']) for row in rows}, rows[-1]['kid']
+
+def rotate_session_key():
+    """Starts signing new tokens with a fresh key. Tokens signed with older keys stay valid until they
+    expire; keys retired for longer than SESSION_TOKEN_TTL can't validate anything and are deleted.
+    Other workers switch over within AUTH_SYNC_INTERVAL. Has no effect while SESSION_TOKEN_KEYS is set.
+    """
+    with db_connection() as conn:
+        kid = insert_session_key(conn)
+        rows = conn.execute("SELECT kid, created_at FROM session_keys ORDER BY created_at, rowid").fetchall()
+        cutoff = int(time.time()) - SESSION_TOKEN_TTL
+        for row, successor in zip(rows, rows[1:]):
+            if successor['created_at'] < cutoff:
+                conn.execute("DELETE FROM session_keys WHERE kid = ?", (row['kid'],))
+        conn.commit()
+    sync_auth_state(force=True)
+    return kid
+
+def sync_auth_state(force=False):
+    """Reloads the signing keys and picks up tokens revoked by other workers,
+    at most once every AUTH_SYNC_INTERVAL seconds unless forced.
+    """
+    checked_at = auth_state["checked_at"]
+    if not force and checked_at is not None and time.monotonic() - checked_at < AUTH_SYNC_INTERVAL:
+        return
+    with auth_lock:
+        with db_connection() as conn:
+            keys, signing_kid = load_session_keys(conn)
+            revoked = conn.execute(
+                "SELECT id, token_id, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id",
+                (auth_state["last_revocation_id"],),
+            ).fetchall()
+        session_tokens.set_keys(keys, signing_kid)
+        for row in revoked:
+            session_tokens.revoke(row['token_id'], row['expires_at'])
+        if revoked:
+            auth_state["last_revocation_id"] = revoked[-1]['id']
+        session_tokens.prune_revoked()
+        auth_state["checked_at"] = time.monotonic()
+
+def login_required(view):
+    """Route decorator that authenticates the 'Authorization: Bearer <token>' header.
+    The authenticated user's id is available to the route as g.user_id; requests without
+    a valid, unexpired and unrevoked token get a 401.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        sync_auth_state()
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        claims = session_tokens.verify(token.strip()) if scheme.lower() == 'bearer' and token else None
+        if claims is None:
+            response = jsonify({"status": "error", "message": "Authentication required. Please log in again."})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        g.user_id = claims.user_id
+        g.token_claims = claims
+        return view(*args, **kwargs)
+    return wrapper
 
 # --- API Endpoints ---
 
@@ -207,57 +691,116 @@ def parse_chat_intent(message):
 def register():
     """Handles new user registration.
     Expects 'username' and 'password' in JSON body.
+    Attempts are throttled per client IP and per username (429 with Retry-After).
     """
     data = request.get_json()
-    if not data or not data.get('username') or not data.get('password'):
+    if not valid_credentials(data):
         return jsonify({"status": "error", "message": "Username and password are required."}), 400
 
     username = data['username']
     password = data['password']
-    hashed_password = generate_password_hash(password)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hashed_password))
-        conn.commit()
-        user_id = cursor.lastrowid
-        return jsonify({"status": "success", "message": "User registered successfully.", "data": {"user_id": user_id, "username": username}}), 201
-    except sqlite3.IntegrityError:
-        return jsonify({"status": "error", "message": "Username already exists."}), 400
-    finally:
-        conn.close()
+    retry_after = ip_rate_limiter.hit(request.remote_addr) or username_rate_limiter.hit(username)
+    if retry_after:
+        return too_many_attempts_response(retry_after)
+    hashed_password = password_hasher.hash(password)
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hashed_password))
+            conn.commit()
+            user_id = cursor.lastrowid
+            return jsonify({"status": "success", "message": "User registered successfully.", "data": {"user_id": user_id, "username": username}}), 201
+        except sqlite3.IntegrityError:
+            return jsonify({"status": "error", "message": "Username already exists."}), 400
 
 @app.route('/login', methods=['POST'])
 def login():
     """Handles user login.
     Expects 'username' and 'password' in JSON body.
-    Verifies credentials and returns a session token on success.
+    Verifies credentials and returns a signed session token (valid for SESSION_TOKEN_TTL) on success.
+    Attempts are throttled per client IP and per username (429 with Retry-After).
     """
     data = request.get_json()
-    if not data or not data.get('username') or not data.get('password'):
+    if not valid_credentials(data):
         return jsonify({"status": "error", "message": "Username and password are required."}), 400
 
     username = data['username']
     password = data['password']
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    retry_after = ip_rate_limiter.hit(request.remote_addr) or username_rate_limiter.hit(username)
+    if retry_after:
+        return too_many_attempts_response(retry_after)
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        user = cursor.fetchone()
 
-    if user and check_password_hash(user['password_hash'], password):
-        token = generate_session_token(user['id']) # Generate a basic session token
+    if user and password_hasher.verify(user['password_hash'], password):
+        upgrade_password_hash(user['id'], user['password_hash'], password)
+        sync_auth_state()  # Sign with the current key after a rotation
+        token, expires_at = session_tokens.issue(user['id'])
         return jsonify({
             "status": "success",
             "message": "Login successful.",
-            "data": {"token": token, "user_id": user['id'], "username": user['username']}
+            "data": {
+                "token": token,
+                "expires_at": format_timestamp_ms(expires_at * 1000),
+                "user_id": user['id'],
+                "username": user['username'],
+            }
         }), 200
     else:
         return jsonify({"status": "error", "message": "Invalid username or password."}), 401
 
 
+@app.route('/logout', methods=['POST'])
+@login_required
+def logout():
+    """Revokes the session token the request was made with, in every worker."""
+    claims = g.token_claims
+    with db_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO revoked_tokens (token_id, expires_at) VALUES (?, ?)",
+                     (claims.token_id, claims.expires_at))
+        # Tokens past their expiry are rejected anyway, so their revocations can go
+        conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (int(time.time()),))
+        conn.commit()
+    session_tokens.revoke(claims.token_id, claims.expires_at)
+    conversation_store.clear(g.user_id)
+    return jsonify({"status": "success", "message": "Logged out."}), 200
+
+
+def upgrade_password_hash(user_id, password_hash, password):
+    """Rehashes a just-verified password if it was stored with an outdated method or cost.
+    Best effort: if the hashing queue is busy the upgrade is simply retried on a later login.
+    """
+    try:
+        if not password_hasher.needs_rehash(password_hash):
+            return
+        new_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return
+    with db_connection() as conn:
+        # Only replace the hash that was verified, in case the password changed meanwhile
+        conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                     (new_hash, user_id, password_hash))
+        conn.commit()
+    app.logger.info(f"Upgraded password hash for user {user_id} to {PASSWORD_HASH_METHOD}.")
+
+def valid_credentials(data):
+    """Whether a /register or /login body has a non-empty string 'username' and 'password'."""
+    return (isinstance(data, dict) and isinstance(data.get('username'), str) and isinstance(data.get('password'), str)
+            and bool(data['username']) and bool(data['password']))
+
+def too_many_attempts_response(retry_after):
+    """429 returned when a client IP or username has used up its login/registration attempts."""
+    response = jsonify({"status": "error", "message": "Too many attempts. Please try again later."})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, 429
+
+
 @app.route('/products', methods=['GET'])
 def get_products():
     """Endpoint to fetch products with optional filtering.
@@ -266,198 +809,1301 @@ def get_products():
     - 'category': Specific product category.
     - 'min_price': Minimum price.
     - 'max_price': Maximum price.
+    - 'limit': Maximum number of products to return (default DEFAULT_RESULT_LIMIT).
+    - 'fields': Comma-separated product fields to return (e.g. "id,name,price"), or
+    - 'view': "compact" for every field except the description.
+    Search results are ranked by relevance.
     """
     query_params = request.args
-    search_term = query_params.get('search', '').lower()
-    category_filter = query_params.get('category', '').lower()
-    min_price_filter = query_params.get('min_price')
-    max_price_filter = query_params.get('max_price')
+    try:
+        search_term, category_filter, min_price, max_price = parse_product_filters(query_params)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        limit = parse_result_limit(query_params.get('limit'))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit format."}), 400
+    try:
+        fields = parse_product_fields(query_params.get('fields'), query_params.get('view'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    base_query = "SELECT id, name, category, price, stock, description, image_url FROM products WHERE 1=1"
-    params = []
+    # Identical filter combinations are answered straight from the serialized result cache
+    cache_key = ("products", current_catalog_version(), category_filter, min_price, max_price, search_term, limit, fields)
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        products, _ = find_products(
+            category=category_filter or None,
+            min_price=min_price,
+            max_price=max_price,
+            terms=[search_term] if search_term else None,
+            limit=limit,
+            fields=fields,
+        )
 
-    if search_term:
-        base_query += " AND (LOWER(name) LIKE ? OR LOWER(description) LIKE ?)"
-        params.extend([f"%{search_term}%", f"%{search_term}%"])
-    if category_filter:
-        base_query += " AND LOWER(category) = ?"
-        params.append(category_filter)
-    if min_price_filter:
-        try:
-            base_query += " AND price >= ?"
-            params.append(float(min_price_filter))
-        except ValueError:
-            return jsonify({"status": "error", "message": "Invalid min_price format."}), 400
-    if max_price_filter:
+        with span("serialize"):
+            if products:
+                body = to_json({"status": "success", "message": "Products retrieved successfully.", "data": products})
+            else:
+                body = to_json({"status": "success", "message": "No products found matching your criteria.", "data": []})
+            # The ETag is computed once per cached body rather than on every request
+            cached = (body, body_etag(body.encode()))
+        result_cache.put(cache_key, cached)
+    body, etag = cached
+    return json_response(body, etag=etag)
+
+
+@app.route('/products/facets', methods=['GET'])
+def get_product_facets():
+    """Endpoint to count products rather than list them: how many match per category, per price
+    bucket, and in or out of stock. Takes the filters of /products ('search', 'category', 'min_price',
+    'max_price') plus, for the price histogram, either
+    - 'price_edges': comma-separated ascending bucket edges (e.g. "0,1000,5000,20000"), or
+    - 'price_buckets': the number of evenly spaced buckets (default DEFAULT_PRICE_BUCKETS).
+    Category counts apply every filter except 'category', so clients can show what switching
+    category would return; the other counts apply all of them.
+    """
+    query_params = request.args
+    try:
+        search_term, category_filter, min_price, max_price = parse_product_filters(query_params)
+        price_edges = parse_price_edges(query_params.get('price_edges'))
+        price_buckets = parse_price_buckets(query_params.get('price_buckets'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    facets = cached_facets(category_filter or None, min_price, max_price, [search_term] if search_term else None,
+                           price_edges, price_buckets)
+    with span("serialize"):
+        return json_response(to_json({"status": "success", "message": "Product facets retrieved successfully.",
+                                      "data": facets}))
+
+
+@app.route('/products/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    """Endpoint to fetch a single product with all of its fields (the detail view for compact list
+    results). Accepts the same 'fields' / 'view' parameters as /products.
+    """
+    try:
+        fields = parse_product_fields(request.args.get('fields'), request.args.get('view'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    current_catalog_version()  # Picks up product changes made by other workers
+    with span("query"):
+        product = find_product(product_id, fields)
+    if product is None:
+        return jsonify({"status": "error", "message": "Product not found."}), 404
+    return jsonify({"status": "success", "message": "Product retrieved successfully.", "data": product}), 200
+
+
+def to_json(value):
+    """Serializes a response body the way jsonify does outside debug mode (sorted keys, compact)."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+def json_response(body, status=200, etag=None):
+    """Wraps an already serialized JSON body in a response, skipping jsonify.
+    A precomputed `etag` saves finalize_response from hashing the body.
+    """
+    response = app.response_class(body + "\n", status=status, mimetype="application/json")
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+def parse_product_filters(query_params):
+    """Reads the /products filters from query parameters as (search term, category, min_price, max_price);
+    the search term and category are lowercased ('' when absent). Raises ValueError for malformed or
+    non-finite prices."""
+    prices = []
+    for name in ('min_price', 'max_price'):
+        value = query_params.get(name)
         try:
-            base_query += " AND price <= ?"
-            params.append(float(max_price_filter))
+            price = float(value) if value else None
         except ValueError:
-            return jsonify({"status": "error", "message": "Invalid max_price format."}), 400
+            raise ValueError(f"Invalid {name} format.") from None
+        if price is not None and not math.isfinite(price):  # 'nan' / 'inf' parse as floats
+            raise ValueError(f"Invalid {name} format.")
+        prices.append(price)
+    return query_params.get('search', '').lower(), query_params.get('category', '').lower(), prices[0], prices[1]
+
+def parse_price_edges(value):
+    """Parses price histogram edges (comma-separated string or list of numbers) into an ascending
+    tuple, or None when absent. Raises ValueError if malformed."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise ValueError("price_edges must be a comma-separated string or a list of numbers.")
+    try:
+        edges = tuple(float(edge) for edge in value)
+    except (TypeError, ValueError):
+        raise ValueError("price_edges must be a comma-separated string or a list of numbers.") from None
+    if not 2 <= len(edges) <= MAX_PRICE_BUCKETS + 1 or any(a >= b for a, b in zip(edges, edges[1:])):
+        raise ValueError(f"price_edges must be 2 to {MAX_PRICE_BUCKETS + 1} ascending numbers.")
+    return edges
+
+def parse_price_buckets(value):
+    """Parses the requested number of price histogram buckets, defaulting to DEFAULT_PRICE_BUCKETS."""
+    if value is None or value == '':
+        return DEFAULT_PRICE_BUCKETS
+    try:
+        buckets = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid price_buckets format.") from None
+    if not 1 <= buckets <= MAX_PRICE_BUCKETS:
+        raise ValueError(f"price_buckets must be between 1 and {MAX_PRICE_BUCKETS}.")
+    return buckets
+
+def parse_product_fields(fields=None, view=None):
+    """Resolves a client's 'fields' (comma-separated string or list of names) and 'view' ("full" or
+    "compact") into the tuple of product fields to return, in column order; "id" is always included.
+    Returns None when every field is wanted. Raises ValueError for unknown fields or views.
+    """
+    if view not in (None, '', 'full', 'compact'):
+        raise ValueError(f"Unknown view {view!r}; use 'full' or 'compact'.")
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError("fields must be a comma-separated string or a list of field names.")
+        requested = {field.strip() for field in fields} - {''}
+        unknown = requested - set(PRODUCT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown product fields: {', '.join(sorted(unknown))}.")
+        requested.add("id")
+        selected = tuple(field for field in PRODUCT_FIELDS if field in requested)
+    elif view == 'compact':
+        selected = COMPACT_PRODUCT_FIELDS
+    else:
+        return None
+    return None if selected == PRODUCT_FIELDS else selected
+
+def parse_result_limit(value):
+    """Converts a client-supplied 'limit' into a result count capped at MAX_RESULT_LIMIT.
+    Raises ValueError for non-integer or non-positive values.
+    """
+    if value is None or value == '':
+        return DEFAULT_RESULT_LIMIT
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_RESULT_LIMIT)
+
+def find_products(category=None, min_price=None, max_price=None, terms=None, limit=DEFAULT_RESULT_LIMIT, offset=0,
+                  fields=None, keyword_filters=None):
+    """Looks up products by category, inclusive price range and ANY of the given search terms.
+    Returns a tuple of (products, total_matches) with at most `limit` products, starting at rank `offset`.
+    Keyword matches are ranked by relevance; without search terms products come back in id order.
+    `fields` (see parse_product_fields) limits the keys of each product dict. `keyword_filters` is a
+    list of term lists (from follow-up queries such as "only blue ones"); a product must match ANY
+    term of each list, without the terms affecting the ranking.
+    """
+    with span("query"):
+        total_matches, products = iter_products(category, min_price, max_price, terms, limit, offset, fields,
+                                                keyword_filters)
+    with span("rows"):
+        products = list(products)
+    return products, total_matches
+
+def iter_products(category=None, min_price=None, max_price=None, terms=None, limit=DEFAULT_RESULT_LIMIT, offset=0,
+                  fields=None, keyword_filters=None):
+    """Streaming form of find_products: returns (total_matches, products) where `products` is an
+    iterator producing the product dicts one at a time, so callers can send them as they come.
+    """
+    if not USE_MEMORY_CATALOG:
+        return iter_products_sqlite(category, min_price, max_price, terms, limit, offset, fields, keyword_filters)
+
+    # Loads the catalog on first use and picks up changes from other workers
+    served = current_catalog()
+    catalog = served.products
+    row = catalog.row if fields is None else functools.partial(catalog.row, fields=fields)
+    positions, ranked = catalog_matches(served, category, min_price, max_price, terms, keyword_filters)
+    if ranked is None:
+        return len(positions), map(row, positions[offset:offset + limit])
+    window = ranked[offset:offset + limit]
+    return len(ranked), (row(catalog.position_of(product_id)) for product_id, _ in window)
+
+def catalog_matches(served, category, min_price, max_price, terms, keyword_filters=None):
+    """Matches the filters against the in-memory catalog of a ServedCatalog. Returns (positions, None)
+    with the row positions in id order when there are no search terms, else (None, ranked) with the
+    (product_id, score) pairs of the keyword search, best first.
+    """
+    catalog = served.products
+    positions = catalog.filter(category=category, min_price=min_price, max_price=max_price)
+    allowed = keyword_filter_ids(served.index, keyword_filters)
+    if not terms:
+        if allowed is not None:
+            ids = catalog.ids
+            positions = [p for p in positions if ids[p] in allowed]
+        return positions, None
+
+    # Restrict the ranked keyword search to the products that passed the structured filters
+    candidates = None
+    if category or min_price is not None or max_price is not None:
+        candidates = {catalog.ids[p] for p in positions}
+    if allowed is not None:
+        candidates = allowed if candidates is None else candidates & allowed
+    return None, served.index.search(terms, candidates=candidates)
+
+def keyword_filter_ids(index, keyword_filters):
+    """Returns the set of product ids that match ANY term of every list in `keyword_filters`, or None
+    if there are no filters."""
+    allowed = None
+    for any_terms in keyword_filters or ():
+        allowed = index.matches(any_terms, allowed)
+    return allowed
+
+def iter_products_sqlite(category, min_price, max_price, terms, limit, offset, fields=None, keyword_filters=None):
+    """Queries SQLite directly for matching products. Used when the in-memory catalog is disabled
+    (CATALOG_BACKEND=sqlite). Keyword searches go through the products_fts full-text index and
+    are ordered by its bm25() relevance (names weighted as in KeywordIndex), then id; the scores
+    aren't KeywordIndex's, so equally good matches may come back in a different order.
+    Rows are read from the cursor in SQLITE_FETCH_SIZE batches as the returned iterator is consumed.
+    """
+    where, params = product_filter_sql(category, min_price, max_price, terms, keyword_filters)
 
-    cursor.execute(base_query, tuple(params))
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with db_connection() as conn:
+        total_matches = conn.execute("SELECT COUNT(*) FROM products" + where, tuple(params)).fetchone()[0]
 
-    if products:
-        return jsonify({"status": "success", "message": "Products retrieved successfully.", "data": products}), 200
+    source, order = "products", " ORDER BY id"
+    if terms and total_matches:
+        # The keyword condition becomes a join that also provides the ranking (bm25() is lower for better matches)
+        where, params = product_filter_sql(category, min_price, max_price, None, keyword_filters)
+        source = ("products JOIN (SELECT rowid AS match_id, bm25(products_fts, ?, 1.0) AS score FROM products_fts"
+                  " WHERE products_fts MATCH ?) ON match_id = id")
+        params = [KeywordIndex.NAME_WEIGHT, fts_query(terms)] + params
+        order = " ORDER BY score, id"
+
+    def rows():
+        with db_connection() as conn:
+            cursor = conn.execute(
+                # Only the requested columns are read; names come from PRODUCT_FIELDS, never from the client
+                f"SELECT {', '.join(fields or PRODUCT_FIELDS)} FROM {source}" + where + order + " LIMIT ? OFFSET ?",
+                tuple(params) + (limit, offset),
+            )
+            while True:
+                batch = cursor.fetchmany(SQLITE_FETCH_SIZE)
+                if not batch:
+                    return
+                for row in batch:
+                    yield dict(row)
+
+    return total_matches, rows()
+
+def product_filter_sql(category, min_price, max_price, terms, keyword_filters=None):
+    """Builds the WHERE clause (and its parameters) selecting products by category, price range and
+    ANY of the terms as a token prefix of the name or description, via products_fts (and likewise
+    for each list of `keyword_filters`), as KeywordIndex.matches() does in memory."""
+    where = " WHERE 1=1"
+    params = []
+
+    if category:
+        where += " AND LOWER(category) = ?"
+        params.append(category.lower())
+
+    if min_price is not None:
+        where += " AND price >= ?"
+        params.append(min_price)
+
+    if max_price is not None:
+        where += " AND price <= ?"
+        params.append(max_price)
+
+    # If keywords were extracted, add conditions to search product names and descriptions.
+    # This allows for more free-form searching beyond just category and price.
+    for any_terms in ([terms] if terms else []) + list(keyword_filters or ()):
+        match = fts_query(any_terms)
+        if match is None:  # No searchable tokens (e.g. only punctuation): nothing matches, as in memory
+            where += " AND 0"
+            continue
+        where += " AND id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+        params.append(match)
+    return where, params
+
+def fts_query(any_terms):
+    """Builds the products_fts MATCH expression for ANY of the terms' tokens as a prefix ("lap" finds
+    "laptop"), or None if the terms have no tokens. Tokens are [a-z0-9]+, so quoting them is enough."""
+    tokens = dict.fromkeys(token for term in any_terms for token in tokenize(term))
+    return " OR ".join(f'"{token}"*' for token in tokens) or None
+
+def iter_products_by_id(product_ids, fields=None):
+    """Yields the products with the given ids, in that order, skipping ids that no longer exist."""
+    if USE_MEMORY_CATALOG:
+        catalog = current_catalog().products
+        for product_id in product_ids:
+            position = catalog.position_of(product_id)
+            if position is not None:
+                yield catalog.row(position, fields)
+        return
+    for start in range(0, len(product_ids), SQLITE_ID_BATCH):
+        batch = tuple(product_ids[start:start + SQLITE_ID_BATCH])
+        with db_connection() as conn:
+            rows = {row['id']: dict(row) for row in conn.execute(
+                f"SELECT {', '.join(fields or PRODUCT_FIELDS)} FROM products WHERE id IN ({', '.join('?' * len(batch))})",
+                batch,
+            )}
+        for product_id in batch:
+            if product_id in rows:
+                yield rows[product_id]
+
+def find_product(product_id, fields=None):
+    """Returns a single product dict by id (limited to `fields` if given), or None if it doesn't exist."""
+    if USE_MEMORY_CATALOG:
+        catalog = current_catalog().products
+        position = catalog.position_of(product_id)
+        return None if position is None else catalog.row(position, fields)
+    with db_connection() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(fields or PRODUCT_FIELDS)} FROM products WHERE id = ?", (product_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def find_facets(category=None, min_price=None, max_price=None, terms=None, price_edges=None,
+                price_buckets=DEFAULT_PRICE_BUCKETS, keyword_filters=None):
+    """Returns the facet counts (see ProductCatalog.facets) of the products matching the filters.
+    Structured filters are answered from the catalog's per-category sorted price arrays; keyword
+    matches come from the keyword index, as for find_products, and are counted in one pass.
+    """
+    if not USE_MEMORY_CATALOG:
+        # One scan of the matching rows (all categories, for the category counts) instead of a GROUP BY per facet
+        where, params = product_filter_sql(None, min_price, max_price, terms, keyword_filters)
+        with db_connection() as conn:
+            rows = conn.execute("SELECT category, price, stock FROM products" + where, tuple(params)).fetchall()
+        return count_facets(rows, category, price_edges, price_buckets)
+
+    served = current_catalog()  # Loads the catalog on first use
+    catalog = served.products
+    allowed = keyword_filter_ids(served.index, keyword_filters)
+    if not terms and allowed is None:
+        return catalog.facets(category, min_price, max_price, price_edges=price_edges, price_buckets=price_buckets)
+    candidates = None
+    if min_price is not None or max_price is not None:
+        candidates = {catalog.ids[p] for p in catalog.filter(min_price=min_price, max_price=max_price)}
+    if allowed is not None:
+        candidates = allowed if candidates is None else candidates & allowed
+    # Counting needs the matches but not their ranking
+    matched = served.index.matches(terms, candidates) if terms else candidates
+    positions = [catalog.position_of(product_id) for product_id in matched]
+    return catalog.facets(category, positions=positions, price_edges=price_edges, price_buckets=price_buckets)
+
+def cached_facets(category, min_price, max_price, terms, price_edges=None, price_buckets=DEFAULT_PRICE_BUCKETS,
+                  keyword_filters=None):
+    """find_facets through the result cache (keyed like cached_product_page on the catalog version)."""
+    cache_key = ("facets", current_catalog_version(), category, min_price, max_price, tuple(sorted(terms or ())),
+                 price_edges, price_buckets, tuple(tuple(sorted(any_terms)) for any_terms in keyword_filters or ()))
+    facets = result_cache.get(cache_key)
+    if facets is None:
+        with span("query"):
+            facets = find_facets(category, min_price, max_price, terms, price_edges, price_buckets, keyword_filters)
+        result_cache.put(cache_key, facets)
+    return facets
+
+
+def cached_product_page(intent, limit, offset=0, fields=None):
+    """Returns (products_json, total_matches, product_ids) for one page of an intent's results.
+    Messages that parse to the same intent share one cached, already serialized product list.
+    """
+    cache_key = ("chat", current_catalog_version()) + intent_key(intent) + (limit, offset, fields)
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        products_found, total_matches = find_products(
+            category=intent.get("category"),
+            min_price=intent.get("min_price"),
+            max_price=intent.get("max_price"),
+            terms=intent.get("keywords") or None,
+            limit=limit,
+            offset=offset,
+            fields=fields,
+            keyword_filters=intent.get("keyword_filters"),
+        )
+        with span("serialize"):
+            cached = (to_json(products_found), total_matches, tuple(product['id'] for product in products_found))
+        result_cache.put(cache_key, cached)
+    return cached
+
+def intent_key(intent):
+    """The filters of an intent as a hashable tuple (the order of keywords doesn't matter)."""
+    return (intent["category"], intent["min_price"], intent["max_price"], tuple(sorted(intent["keywords"])),
+            tuple(tuple(sorted(any_terms)) for any_terms in intent.get("keyword_filters") or ()))
+
+def is_follow_up(intent, previous_intent):
+    """Whether a message refines the previous /chat query instead of starting a new one: it says so
+    ("only blue ones", "cheaper ones") or gives nothing but a price limit, and names no other category.
+    New keywords without such a marker ("just show me jackets") start a new query."""
+    if intent["category"] and intent["category"] != previous_intent["category"]:
+        return False
+    if intent["refinement"]:
+        return True
+    return (not intent["category"] and not intent["keywords"]
+            and (intent["min_price"] is not None or intent["max_price"] is not None))
+
+def refine_intent(previous, intent):
+    """Applies a follow-up `intent` to the user's `previous` ConversationState.
+    Returns (refined intent, product_ids): the previous filters tightened by the follow-up's (its
+    keywords become a keyword filter, so they narrow the results without changing their ranking),
+    and the ids of all the refined results in rank order, or None if there are more than
+    CONVERSATION_MAX_RESULT_IDS. When the previous result ids were kept for the current catalog they
+    are narrowed in memory; otherwise the refined query is run.
+    """
+    base = previous.intent
+    min_prices = [price for price in (base["min_price"], intent["min_price"]) if price is not None]
+    max_prices = [price for price in (base["max_price"], intent["max_price"]) if price is not None]
+    refined = {
+        "category": base["category"] or intent["category"],
+        "min_price": max(min_prices) if min_prices else None,
+        "max_price": min(max_prices) if max_prices else None,
+        "keywords": list(base["keywords"]),
+        "keyword_filters": list(base.get("keyword_filters") or []) + ([intent["keywords"]] if intent["keywords"] else []),
+        "refinement": intent["refinement"] or "narrow",
+    }
+    direction = intent["refinement"] if intent["refinement"] in ("cheaper", "pricier") else None
+
+    with span("query"):
+        product_ids = None
+        if previous.product_ids is not None and previous.catalog_version == current_catalog_version():
+            product_ids = narrow_product_ids(previous.product_ids, intent["category"], intent["min_price"],
+                                             intent["max_price"], intent["keywords"] or None)
+        if product_ids is None:
+            # Splitting by price needs every result's price, however many there are
+            product_ids = match_product_ids(refined, None if direction else CONVERSATION_MAX_RESULT_IDS)
+        if direction and product_ids:
+            refined, product_ids = split_by_price(refined, product_ids, direction)
+    if product_ids is not None and len(product_ids) > CONVERSATION_MAX_RESULT_IDS:
+        product_ids = None  # Served by running the refined query instead
+    return refined, product_ids
+
+def narrow_product_ids(product_ids, category=None, min_price=None, max_price=None, terms=None):
+    """Returns the given product ids, in their order, whose products also match the filters."""
+    if not USE_MEMORY_CATALOG:
+        where, params = product_filter_sql(category, min_price, max_price, terms)
+        kept = set()
+        with db_connection() as conn:
+            for start in range(0, len(product_ids), SQLITE_ID_BATCH):
+                batch = tuple(product_ids[start:start + SQLITE_ID_BATCH])
+                kept.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM products{where} AND id IN ({', '.join('?' * len(batch))})", tuple(params) + batch
+                ))
+        return [product_id for product_id in product_ids if product_id in kept]
+
+    served = current_catalog()
+    product_ids = served.products.narrow(product_ids, category, min_price, max_price)
+    if terms:
+        matches = served.index.matches(terms, set(product_ids))
+        product_ids = [product_id for product_id in product_ids if product_id in matches]
+    return product_ids
+
+def match_product_ids(intent, max_ids=None):
+    """Returns the ids of all products matching an intent, in the order find_products ranks them,
+    or None if there are more than `max_ids`."""
+    filters = (intent["category"], intent["min_price"], intent["max_price"], intent["keywords"] or None,
+               intent.get("keyword_filters"))
+    if not USE_MEMORY_CATALOG:
+        total_matches, products = iter_products_sqlite(*filters[:4], limit=-1, offset=0, fields=("id",),
+                                                       keyword_filters=filters[4])  # A negative LIMIT is none
+        if max_ids is not None and total_matches > max_ids:
+            return None
+        return [product['id'] for product in products]
+
+    served = current_catalog()
+    positions, ranked = catalog_matches(served, *filters)
+    if max_ids is not None and len(positions if ranked is None else ranked) > max_ids:
+        return None
+    if ranked is None:
+        ids = served.products.ids
+        return [ids[p] for p in positions]
+    return [product_id for product_id, _ in ranked]
+
+def split_by_price(intent, product_ids, direction):
+    """Keeps the products priced below ("cheaper") or above ("pricier") the median of `product_ids`,
+    in their order, and records the price bound that selects them in the returned intent."""
+    if USE_MEMORY_CATALOG:
+        catalog = current_catalog().products
+        positions = {product_id: catalog.position_of(product_id) for product_id in product_ids}
+        product_ids = [product_id for product_id in product_ids if positions[product_id] is not None]
+        prices = [catalog.prices[positions[product_id]] for product_id in product_ids]
     else:
-        return jsonify({"status": "success", "message": "No products found matching your criteria.", "data": []}), 200
+        prices_by_id = {product['id']: product['price'] for product in iter_products_by_id(product_ids, ("id", "price"))}
+        product_ids = [product_id for product_id in product_ids if product_id in prices_by_id]
+        prices = [prices_by_id[product_id] for product_id in product_ids]
+    ordered = sorted(prices)
+    intent = dict(intent)
+    if not ordered:
+        return intent, []
+    if direction == "cheaper":
+        median = ordered[len(ordered) // 2]
+        lower = [price for price in ordered if price < median]
+        if not lower:  # Every product already has the lowest price
+            return intent, []
+        intent["max_price"] = lower[-1]
+        return intent, [product_id for product_id, price in zip(product_ids, prices) if price <= lower[-1]]
+    median = ordered[(len(ordered) - 1) // 2]
+    higher = [price for price in ordered if price > median]
+    if not higher:
+        return intent, []
+    intent["min_price"] = higher[0]
+    return intent, [product_id for product_id, price in zip(product_ids, prices) if price >= higher[0]]
+
+def chat_response_message(intent, total_matches, shown):
+    """The bot's reply for a query with `total_matches` results, of which the first `shown` are returned."""
+    if shown:
+        response_message = f"Found {total_matches} products matching your query."
+        if total_matches > shown:
+            response_message += f" Showing the top {shown}."
+        return response_message
+    # Provide a helpful message if no products match the query
+    response_message = "I couldn't find any products matching your description."
+    # Add more specific advice if some intent was parsed but still yielded no results
+    if intent.get("category") or intent.get("min_price") is not None or intent.get("max_price") is not None or intent.get("keywords"):
+        response_message += " You can try rephrasing your query or being more general."
+    else: # Generic advice if no specific intent was understood
+        response_message += " Please try asking about specific product categories, price ranges, or keywords."
+    return response_message
+
+def record_chat_turn(user_id, user_message, received_at, response_message, product_ids):
+    """Queues both sides of a chat turn for the history writer. They are queued together, so they are
+    written in order and in a single transaction. Returns False if the queue was full.
+    """
+    with span("persist"):
+        history_saved = history_writer.submit([
+            (user_id, user_message, True, received_at, None),
+            (user_id, response_message, False, now_ms(), encode_product_ids(product_ids)),
+        ])
+    if not history_saved:
+        app.logger.warning(f"Chat history queue full; turn for user {user_id} was not recorded.")
+    return history_saved
 
 
 @app.route('/chat', methods=['POST'])
+@login_required
 def chat_handler():
     """Main endpoint for chatbot interactions.
     Receives a user's message, attempts to parse intent (category, price, keywords),
     queries the database for matching products, and returns them.
+    With "persist": true in the body, the user's message and the bot's response are
+    recorded to chat history by the server, and the response reports "history_saved"
+    so the client can skip its own POST /chat/history calls.
+    'limit' sets the page size; when more results exist, "next_cursor" can be passed to
+    POST /chat/more to fetch the following page. 'fields' / 'view' select the product fields
+    as for GET /products.
+    With "facets": true the response also carries the category, price and stock counts of all
+    matches (as from GET /products/facets), for answers like "how many laptops in each price band".
+    With "stream": true the response is streamed instead (see stream_product_events).
+    A follow-up such as "cheaper ones" or "only under 20k" refines the user's previous query (see
+    is_follow_up) and reports "follow_up": true; "context": false treats the message on its own.
     """
     data = request.get_json()
-    # Ensure essential data (message and user_id from an authenticated session) is present
-    if not data or not data.get('message') or not data.get('user_id'):
-        return jsonify({"status": "error", "message": "Message and user_id are required."}), 400
+    if not data or not data.get('message'):
+        return jsonify({"status": "error", "message": "Message is required."}), 400
 
     user_message = data['message']
-    user_id = data['user_id'] # User ID is crucial for context and history
+    user_id = g.user_id # Always the authenticated user; a user_id in the body is ignored
+    try:
+        limit = parse_result_limit(data.get('limit'))
+        chunk_size = parse_stream_chunk_size(data.get('chunk_size'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid limit or chunk_size format."}), 400
+    try:
+        fields = parse_product_fields(data.get('fields'), data.get('view'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    persist = data.get('persist') is True
+    received_at = now_ms()
 
     # Step 1: Attempt to understand the user's intent from their message
-    intent = parse_chat_intent(user_message)
+    with span("parse"):
+        intent = parse_chat_intent(user_message)
+    # A follow-up narrows the user's previous results (held in memory) instead of searching again
+    previous = conversation_store.get(user_id) if data.get('context') is not False else None
+    follow_up = previous is not None and is_follow_up(intent, previous.intent)
+    result_ids = None  # All result ids in rank order, when the follow-up produced them
+    if follow_up:
+        intent, result_ids = refine_intent(previous, intent)
+    facets = None
+    if data.get('facets') is True:
+        facets = cached_facets(intent["category"], intent["min_price"], intent["max_price"], intent["keywords"] or None,
+                               keyword_filters=intent.get("keyword_filters"))
 
-    # Step 2: Construct and execute a database query based on the parsed intent
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = "SELECT id, name, category, price, stock, description, image_url FROM products WHERE 1=1"
-    params = []
+    if data.get('stream') is True:
+        # The reply and intent go out first; product cards follow in chunks as they are read
+        with span("query"):
+            if result_ids is not None:
+                total_matches, products = len(result_ids), iter_products_by_id(result_ids[:limit], fields)
+            else:
+                total_matches, products = iter_products(
+                    category=intent.get("category"),
+                    min_price=intent.get("min_price"),
+                    max_price=intent.get("max_price"),
+                    terms=intent.get("keywords") or None,
+                    limit=limit,
+                    fields=fields,
+                    keyword_filters=intent.get("keyword_filters"),
+                )
+        conversation_store.put(user_id, intent, result_ids, current_catalog_version())
+        response_message = chat_response_message(intent, total_matches, min(limit, total_matches))
 
-    if intent.get("category"):
-        query += " AND LOWER(category) = ?"
-        params.append(intent["category"].lower())
+        def on_end(product_ids):
+            # Recorded once every product has been sent, so the bot entry lists them all
+            return record_chat_turn(user_id, user_message, received_at, response_message, product_ids) if persist else False
 
-    if intent.get("min_price") is not None:
-        query += " AND price >= ?"
-        params.append(intent["min_price"])
+        meta = {
+            "message": response_message,
+            "total_matches": total_matches,
+            "original_query": user_message,
+            "parsed_intent": intent,
+            "follow_up": follow_up,
+            "page_size": limit,
+        }
+        if facets is not None:
+            meta["facets"] = facets
+        return stream_product_events(meta, products, intent, 0, total_matches, chunk_size, on_end)
 
-    if intent.get("max_price") is not None:
-        query += " AND price <= ?"
-        params.append(intent["max_price"])
+    # Step 2: Look up matching products (ranked by keyword relevance when keywords were found)
+    if result_ids is not None:
+        with span("rows"):
+            products = list(iter_products_by_id(result_ids[:limit], fields))
+        with span("serialize"):
+            products_json = to_json(products)
+        total_matches, product_ids = len(result_ids), tuple(product['id'] for product in products)
+    else:
+        products_json, total_matches, product_ids = cached_product_page(intent, limit, fields=fields)
+        if not follow_up and len(product_ids) == total_matches:
+            result_ids = product_ids  # Every result is on this page, so a follow-up can start from them for free
+    conversation_store.put(user_id, intent, result_ids, current_catalog_version())
 
-    # If keywords were extracted, add conditions to search product names and descriptions.
-    # This allows for more free-form searching beyond just category and price.
-    if intent.get("keywords"):
-        keyword_conditions = []
-        for kw in intent["keywords"]:
-            keyword_conditions.append("(LOWER(name) LIKE ? OR LOWER(description) LIKE ?)")
-            params.extend([f"%{kw}%", f"%{kw}%"])
-        if keyword_conditions:
-            query += " AND (" + " OR ".join(keyword_conditions) + ")"
+    # Step 3: Prepare the response based on whether products were found
+    response_message = chat_response_message(intent, total_matches, len(product_ids))
+
+    # Step 4: Optionally record both sides of the turn
+    history_saved = record_chat_turn(user_id, user_message, received_at, response_message, product_ids) if persist else False
 
+    # The per-request fields are serialized here; the cached product list is spliced in as-is
+    has_more = total_matches > len(product_ids)
+    with span("serialize"):
+        response_data = {
+            "total_matches": total_matches,
+            "original_query": user_message,
+            "parsed_intent": intent,
+            "follow_up": follow_up,
+            "history_saved": history_saved,
+            "has_more": has_more,
+            "next_cursor": encode_results_cursor(intent, len(product_ids)) if has_more else None,
+        }
+        if facets is not None:
+            response_data["facets"] = facets
+        data_json = to_json(response_data)
+        return json_response(
+            '{"data":{"products":%s,%s},"message":%s,"status":"success"}'
+            % (products_json, data_json[1:-1], to_json(response_message))
+        )
 
-    cursor.execute(query, tuple(params))
-    products_found = [dict(row) for row in cursor.fetchall()]
-    conn.close()
 
-    # Step 3: Prepare the response based on whether products were found
-    if products_found:
-        response_message = f"Found {len(products_found)} products matching your query."
-        # The frontend will typically save the user's message and this bot response to history.
-        return jsonify({
-            "status": "success",
-            "message": response_message,
-            "data": {"products": products_found, "original_query": user_message, "parsed_intent": intent}
-        }), 200
+@app.route('/chat/more', methods=['POST'])
+@login_required
+def chat_more():
+    """Fetches the next page of results for an earlier /chat query.
+    Expects {"cursor": <next_cursor from /chat or a previous /chat/more>} plus optional
+    'limit' (page size), 'fields' / 'view', and "stream": true / 'chunk_size' to stream the page
+    like /chat does. Pages of a follow-up's results come from the ids kept for the conversation.
+    Nothing is recorded to chat history.
+    """
+    data = request.get_json()
+    if not data or not data.get('cursor'):
+        return jsonify({"status": "error", "message": "cursor is required."}), 400
+    try:
+        intent, offset = decode_results_cursor(data['cursor'])
+        limit = parse_result_limit(data.get('limit'))
+        chunk_size = parse_stream_chunk_size(data.get('chunk_size'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid cursor, limit or chunk_size."}), 400
+    try:
+        fields = parse_product_fields(data.get('fields'), data.get('view'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    result_ids = None
+    state = conversation_store.get(g.user_id)
+    if (state is not None and state.product_ids is not None and intent_key(state.intent) == intent_key(intent)
+            and state.catalog_version == current_catalog_version()):
+        result_ids = state.product_ids
+
+    if data.get('stream') is True:
+        with span("query"):
+            if result_ids is not None:
+                total_matches, products = len(result_ids), iter_products_by_id(result_ids[offset:offset + limit], fields)
+            else:
+                total_matches, products = iter_products(
+                    category=intent["category"],
+                    min_price=intent["min_price"],
+                    max_price=intent["max_price"],
+                    terms=intent["keywords"] or None,
+                    limit=limit,
+                    offset=offset,
+                    fields=fields,
+                    keyword_filters=intent["keyword_filters"],
+                )
+        meta = {"total_matches": total_matches, "page_size": limit, "offset": offset}
+        return stream_product_events(meta, products, intent, offset, total_matches, chunk_size)
+
+    if result_ids is not None:
+        with span("rows"):
+            products = list(iter_products_by_id(result_ids[offset:offset + limit], fields))
+        with span("serialize"):
+            products_json = to_json(products)
+        total_matches, product_ids = len(result_ids), tuple(product['id'] for product in products)
     else:
-        # Provide a helpful message if no products match the query
-        no_product_message = "I couldn't find any products matching your description."
-        # Add more specific advice if some intent was parsed but still yielded no results
-        if intent.get("category") or intent.get("min_price") is not None or intent.get("max_price") is not None or intent.get("keywords"):
-            no_product_message += " You can try rephrasing your query or being more general."
-        else: # Generic advice if no specific intent was understood
-            no_product_message += " Please try asking about specific product categories, price ranges, or keywords."
-        return jsonify({"status": "success", "message": no_product_message, "data": {"products": [], "original_query": user_message, "parsed_intent": intent}}), 200
+        products_json, total_matches, product_ids = cached_product_page(intent, limit, offset, fields)
+    next_offset = offset + len(product_ids)
+    has_more = total_matches > next_offset
+    data_json = to_json({
+        "total_matches": total_matches,
+        "has_more": has_more,
+        "next_cursor": encode_results_cursor(intent, next_offset) if has_more else None,
+    })
+    return json_response(
+        '{"data":{"products":%s,%s},"message":%s,"status":"success"}'
+        % (products_json, data_json[1:-1], to_json(f"{len(product_ids)} more products."))
+    )
+
+
+def stream_product_events(meta, products, intent, offset, total_matches, chunk_size, on_end=None):
+    """Streams one page of results as a sequence of events:
+    - "meta": `meta` (for /chat: the bot's message, parsed intent, total_matches and any facets);
+    - "products": {"products": [...]} with up to `chunk_size` products each, in rank order;
+    - "end": {"returned", "has_more", "next_cursor", "history_saved"};
+    - "error": {"message"} instead of "end" if anything fails part-way (the error is logged), since the
+      200 status has already been sent by then.
+    Each event is one NDJSON line ({"event": ..., "data": ...}), or a server-sent event when the
+    client sends 'Accept: text/event-stream'. Products are serialized as they are read, so the
+    full page is never held in memory. `on_end(product_ids)` runs before the end event and
+    returns its history_saved value.
+    """
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    def events():
+        yield "meta", meta
+        product_ids = []
+        chunk = []
+        while True:
+            with span("rows"):
+                product = next(products, None)
+            if product is None:
+                break
+            chunk.append(product)
+            if len(chunk) == chunk_size:
+                product_ids.extend(p['id'] for p in chunk)
+                yield "products", {"products": chunk}
+                chunk = []
+        if chunk:
+            product_ids.extend(p['id'] for p in chunk)
+            yield "products", {"products": chunk}
+        next_offset = offset + len(product_ids)
+        has_more = total_matches > next_offset
+        yield "end", {
+            "returned": len(product_ids),
+            "has_more": has_more,
+            "next_cursor": encode_results_cursor(intent, next_offset) if has_more else None,
+            "history_saved": on_end(product_ids) if on_end else False,
+        }
+
+    def guarded_events():
+        # The 200 headers are already sent, so a failure can only be reported as a final event;
+        # without it the client couldn't tell a truncated stream from a complete one
+        try:
+            yield from events()
+        except Exception:
+            app.logger.exception("Error while streaming products")
+            yield "error", {"message": "An error occurred while retrieving products."}
+
+    def generate():
+        for event, payload in guarded_events():
+            with span("serialize"):
+                if sse:
+                    line = f"event: {event}\ndata: {to_json(payload)}\n\n"
+                else:
+                    line = to_json({"event": event, "data": payload}) + "\n"
+            yield line
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},  # Don't let proxies buffer the stream
+    )
+
+def parse_stream_chunk_size(value):
+    """Converts a client-supplied 'chunk_size' (products per streamed event) into a count capped at
+    MAX_STREAM_CHUNK_SIZE. Raises ValueError for non-integer or non-positive values.
+    """
+    if value is None or value == '':
+        return DEFAULT_STREAM_CHUNK_SIZE
+    chunk_size = int(value)
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    return min(chunk_size, MAX_STREAM_CHUNK_SIZE)
+
+def encode_results_cursor(intent, offset):
+    """Builds the opaque cursor for the results of `intent` starting at rank `offset`."""
+    payload = [intent["category"], intent["min_price"], intent["max_price"], list(intent["keywords"]), offset]
+    if intent.get("keyword_filters"):
+        payload.append(intent["keyword_filters"])
+    return base64.urlsafe_b64encode(to_json(payload).encode()).decode().rstrip("=")
+
+def decode_results_cursor(cursor_str):
+    """Parses a results cursor into (intent, offset). Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor_str + "=" * (-len(cursor_str) % 4))
+        category, min_price, max_price, keywords, offset, *rest = json.loads(raw)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    keyword_filters = rest[0] if rest else []  # Only present for refined follow-up results
+
+    def is_price(value):
+        return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value))
+
+    def is_terms(value):
+        return isinstance(value, list) and all(isinstance(term, str) for term in value)
+
+    if (not isinstance(offset, int) or isinstance(offset, bool) or offset < 0 or len(rest) > 1
+            or not (category is None or isinstance(category, str)) or not is_price(min_price) or not is_price(max_price)
+            or not is_terms(keywords) or not isinstance(keyword_filters, list) or not all(is_terms(terms) for terms in keyword_filters)):
+        raise ValueError("Invalid cursor")
+    intent = {"category": category, "min_price": min_price, "max_price": max_price, "keywords": keywords,
+              "keyword_filters": keyword_filters}
+    return intent, offset
+
+
+def encode_product_ids(product_ids):
+    """Packs product ids into the compact comma-separated form stored in chat_history.product_ids."""
+    return ",".join(str(product_id) for product_id in product_ids) or None
+
+def decode_product_ids(value):
+    """Inverse of encode_product_ids; returns a list of ints (empty for NULL)."""
+    return [int(product_id) for product_id in value.split(",")] if value else []
+
+def build_history_entry(data, user_id):
+    """Validates one chat history entry from a request body and converts it into an insert tuple
+    for the authenticated `user_id` (any user_id in the body is ignored).
+    Returns None if required fields are missing or malformed, or the timestamp is before the epoch
+    or more than HISTORY_MAX_CLOCK_SKEW_MS in the future.
+    """
+    # Validate required fields for a chat history entry
+    if not isinstance(data, dict) or 'message' not in data or not isinstance(data.get('is_user_message'), bool):
+        return None
+    # Use timestamp from frontend if provided, otherwise the current time; stored as epoch milliseconds
+    if data.get('timestamp') is None:
+        timestamp_ms = now_ms()
+    else:
+        try:
+            timestamp_ms = parse_timestamp_ms(data['timestamp'])
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if not 0 <= timestamp_ms <= now_ms() + HISTORY_MAX_CLOCK_SKEW_MS:
+            return None
+    return (user_id, data['message'], data['is_user_message'], timestamp_ms, None)
+
+def history_queue_full_response():
+    """503 returned when the write-behind queue is too far behind to accept more entries."""
+    response = jsonify({"status": "error", "message": "Chat history is temporarily unavailable. Please retry shortly."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 
 @app.route('/chat/history', methods=['POST'])
+@login_required
 def save_chat_history():
     """Endpoint for the frontend to save chat messages to the database.
     The frontend is responsible for sending both user messages and bot responses
-    to this endpoint to be logged.
+    to this endpoint to be logged. Entries are written asynchronously by the
+    write-behind queue, so a successful response means the entry was accepted.
+    """
+    with span("validate"):
+        entry = build_history_entry(request.get_json(), g.user_id)
+    if entry is None:
+        return jsonify({"status": "error", "message": "message and is_user_message (boolean) are required; timestamp must be ISO-8601 or epoch milliseconds and not in the future."}), 400
+
+    with span("persist"):
+        accepted = history_writer.submit([entry])
+    if not accepted:
+        return history_queue_full_response()
+    return jsonify({"status": "success", "message": "Chat entry saved."}), 201
+
+
+@app.route('/chat/history/batch', methods=['POST'])
+@login_required
+def save_chat_history_batch():
+    """Saves several chat messages in one request.
+    Expects {"entries": [...]} where each entry has the same fields as POST /chat/history.
+    Entries are stored in the order given; either all of them are accepted or none are.
     """
     data = request.get_json()
-    # Validate required fields for a chat history entry
-    if not all(key in data for key in ['user_id', 'message']) or not isinstance(data.get('is_user_message'), bool):
-        return jsonify({"status": "error", "message": "user_id, message, and is_user_message (boolean) are required."}), 400
+    raw_entries = data.get('entries') if isinstance(data, dict) else None
+    if not isinstance(raw_entries, list) or not raw_entries:
+        return jsonify({"status": "error", "message": "A non-empty 'entries' list is required."}), 400
+    if len(raw_entries) > MAX_HISTORY_BATCH:
+        return jsonify({"status": "error", "message": f"At most {MAX_HISTORY_BATCH} entries can be saved per request."}), 400
 
-    user_id = data['user_id']
-    message_content = data['message']
-    is_user = data['is_user_message']
-    # Use timestamp from frontend if provided, otherwise generate a new UTC timestamp
-    timestamp_str = data.get('timestamp', datetime.datetime.now(timezone.utc).isoformat() + "Z")
+    entries = []
+    with span("validate"):
+        for index, raw_entry in enumerate(raw_entries):
+            entry = build_history_entry(raw_entry, g.user_id)
+            if entry is None:
+                return jsonify({"status": "error", "message": f"Entry {index}: message and is_user_message (boolean) are required; timestamp must be ISO-8601 or epoch milliseconds and not in the future."}), 400
+            entries.append(entry)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with span("persist"):
+        accepted = history_writer.submit(entries)
+    if not accepted:
+        return history_queue_full_response()
+    return jsonify({"status": "success", "message": f"{len(entries)} chat entries saved.", "data": {"count": len(entries)}}), 201
+
+
+@app.route('/metrics/db', methods=['GET'])
+def get_db_metrics():
+    """Reports database metrics for this worker process: connection pool hit rate, wait times,
+    timeouts and size, plus the chat history write-behind queue depth and counters.
+    """
+    return jsonify({
+        "status": "success",
+        "message": "Database metrics.",
+        "data": {"pool": db_pool.stats(), "history_writer": history_writer.stats()}
+    }), 200
+
+
+@app.route('/metrics/auth', methods=['GET'])
+def get_auth_metrics():
+    """Reports password hashing queue depth, counters and latency percentiles for this worker
+    process, how many /register and /login attempts were throttled, and session token counters.
+    """
+    return jsonify({
+        "status": "success",
+        "message": "Auth metrics.",
+        "data": {
+            "password_hasher": password_hasher.stats(),
+            "rate_limits": {"ip": ip_rate_limiter.stats(), "username": username_rate_limiter.stats()},
+            "session_tokens": session_tokens.stats(),
+        }
+    }), 200
+
+
+@app.route('/metrics/cache', methods=['GET'])
+def get_cache_metrics():
+    """Reports result cache hit/miss/eviction counters for this worker process, the catalog
+    version cached results are keyed on, the intent parser's memoization statistics and the
+    conversation state held for follow-up queries.
+    """
+    return jsonify({
+        "status": "success",
+        "message": "Cache metrics.",
+        "data": {
+            "result_cache": result_cache.stats(),
+            "catalog_version": catalog_state["version"],
+            "catalog_source": catalog_state["source"],
+            "intent_parser": intent_cache_info()._asdict(),
+            "compression": response_compressor.stats(),
+            "conversations": conversation_store.stats(),
+        }
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    """Exports this worker process's metrics in the Prometheus text format: latency histograms per
+    route, per route and stage, and per SQL statement, plus pool, result cache, conversation state and
+    history queue counters.
+    """
+    pool = db_pool.stats()
+    cache = result_cache.stats()
+    writer = history_writer.stats()
+    conversations = conversation_store.stats()
+    lines = instrumentation.render()
+    lines += metric_lines("chatbot_db_pool_checkouts_total", "counter", "Connections borrowed from the pool.",
+                          [({}, pool["checkouts"])])
+    lines += metric_lines("chatbot_db_pool_waits_total", "counter", "Checkouts that had to wait for a connection.",
+                          [({}, pool["waits"])])
+    lines += metric_lines("chatbot_db_pool_timeouts_total", "counter", "Checkouts that timed out.",
+                          [({}, pool["timeouts"])])
+    lines += metric_lines("chatbot_db_pool_connections", "gauge", "Open pooled connections.",
+                          [({"state": "idle"}, pool["idle"]), ({"state": "in_use"}, pool["size"] - pool["idle"])])
+    lines += metric_lines("chatbot_result_cache_lookups_total", "counter", "Result cache lookups.",
+                          [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])])
+    lines += metric_lines("chatbot_result_cache_entries", "gauge", "Cached results.", [({}, cache["size"])])
+    lines += metric_lines("chatbot_conversation_users", "gauge", "Users with conversation state for follow-ups.",
+                          [({}, conversations["users"])])
+    lines += metric_lines("chatbot_conversation_result_ids", "gauge", "Result ids kept for follow-ups.",
+                          [({}, conversations["result_ids"])])
+    lines += metric_lines("chatbot_history_queue_pending", "gauge", "Chat history entries waiting to be written.",
+                          [({}, writer["pending"])])
+    lines += metric_lines("chatbot_history_entries_total", "counter", "Chat history entries by outcome.",
+                          [({"outcome": outcome}, writer[outcome]) for outcome in ("written", "rejected", "failed")])
+    return app.response_class("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route('/metrics/profile', methods=['POST'])
+def profile_worker():
+    """Samples every thread of this worker for 'seconds' (default 5, at most MAX_PROFILE_SECONDS) and
+    returns the profile. Requires the 'X-Profile: <PROFILING_TOKEN>' header; add ?format=collapsed
+    for plain collapsed stacks (flame graph input).
+    """
+    if not valid_profiling_token(request.headers.get('X-Profile')):
+        return jsonify({"status": "error", "message": "Profiling is disabled or the token is invalid."}), 403
     try:
-        cursor.execute('''
-            INSERT INTO chat_history (user_id, message, is_user_message, timestamp)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, message_content, is_user, timestamp_str))
-        conn.commit()
-        return jsonify({"status": "success", "message": "Chat entry saved."}), 201
-    except Exception as e:
-        app.logger.error(f"Error saving chat history: {e}")
-        return jsonify({"status": "error", "message": "Failed to save chat history."}), 500
-    finally:
-        conn.close()
+        seconds = min(float((request.get_json(silent=True) or {}).get('seconds', 5)), MAX_PROFILE_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid seconds."}), 400
+    profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000).start()
+    time.sleep(max(0.0, seconds))
+    return profile_response(profiler.stop())
+
+
+@app.route('/metrics/profiles/<profile_id>', methods=['GET'])
+def get_request_profile(profile_id):
+    """Returns the profile of a request sent with a valid 'X-Profile' header; its id is in the
+    request's 'X-Profile-Id' response header. Requires the same header; supports ?format=collapsed.
+    """
+    if not valid_profiling_token(request.headers.get('X-Profile')):
+        return jsonify({"status": "error", "message": "Profiling is disabled or the token is invalid."}), 403
+    with profiles_lock:
+        report = recent_profiles.get(profile_id)
+    if report is None:
+        return jsonify({"status": "error", "message": "Profile not found."}), 404
+    return profile_response(report)
+
+
+def profile_response(report):
+    if request.args.get('format') == 'collapsed':
+        return app.response_class(report["collapsed"] + "\n", mimetype="text/plain")
+    return jsonify({"status": "success", "message": "Profile collected.", "data": report}), 200
+
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(error):
+    """Returns a JSON 503 when all database connections stay busy for longer than DB_POOL_TIMEOUT."""
+    app.logger.warning(f"Database pool exhausted: {error}")
+    return jsonify({"status": "error", "message": "Server is busy. Please try again shortly."}), 503
+
+
+@app.errorhandler(HasherBusy)
+def handle_hasher_busy(error):
+    """Returns a JSON 503 when the password hashing queue is full, so auth spikes shed load instead of queueing."""
+    app.logger.warning(f"Password hashing busy: {error}")
+    response = jsonify({"status": "error", "message": "Server is busy. Please try again shortly."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@app.before_request
+def start_request_instrumentation():
+    """Starts timing the request, and profiling it when it carries a valid 'X-Profile' header."""
+    g.request_started = time.perf_counter()
+    instrumentation.start_request()
+    if not request.path.startswith('/metrics') and valid_profiling_token(request.headers.get('X-Profile')):
+        g.profile_id = secrets.token_hex(6)
+        g.profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000).start([threading.get_ident()])
+
+
+@app.teardown_request
+def finish_request_instrumentation(error=None):
+    """Records the request's latency and stage timings. For streamed responses this runs once the
+    whole body has been sent, so the timings cover the stream."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = 500 if error is not None else g.get('response_status', 500)
+    stages = instrumentation.finish_request(request.method, route, status, elapsed)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        report = profiler.stop()
+        report.update({
+            "id": g.profile_id, "method": request.method, "route": route, "status": status,
+            "stages_ms": {stage: seconds * 1000 for stage, seconds in stages.items()},
+        })
+        with profiles_lock:
+            recent_profiles[g.profile_id] = report
+            while len(recent_profiles) > RECENT_PROFILES:
+                recent_profiles.popitem(last=False)
+
+
+def valid_profiling_token(value):
+    """True if profiling is enabled (PROFILING_TOKEN is set) and `value` matches the token."""
+    return bool(PROFILING_TOKEN) and value is not None and hmac.compare_digest(value.encode(), PROFILING_TOKEN.encode())
+
+
+@app.after_request
+def finalize_response(response):
+    """Adds a weak ETag to successful GET responses (answering a matching If-None-Match with an
+    empty 304) and compresses JSON bodies for clients that send Accept-Encoding.
+    """
+    g.response_status = response.status_code  # For finish_request_instrumentation
+    if 'profile_id' in g:
+        response.headers['X-Profile-Id'] = g.profile_id
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+
+    if response.is_streamed:
+        encoding = response_compressor.choose(request.accept_encodings, response.mimetype)
+        if encoding:
+            response.response = response_compressor.compress_stream(response.response, encoding)
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+        return response
+
+    data = response.get_data()
+    etag = None
+    if request.method in ('GET', 'HEAD'):
+        etag, _ = response.get_etag()
+        if etag is None:
+            etag = body_etag(data)
+            response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True  # Clients may keep the body but must revalidate it
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    encoding = response_compressor.choose(request.accept_encodings, response.mimetype, len(data))
+    if encoding:
+        response.set_data(response_compressor.compress(data, encoding, etag))
+        response.headers['Content-Encoding'] = encoding
+    if response.mimetype in COMPRESSIBLE_MIMETYPES:
+        response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/chat/history', methods=['GET'])
+@login_required
 def get_chat_history():
     """Endpoint to retrieve chat history for a specific user.
     Typically called when the user logs in or opens the chat interface
     to load previous conversation.
+    Always returns the authenticated user's history (a 'user_id' parameter is ignored).
+    Supports keyset pagination over (timestamp, id):
+    - no cursor: the most recent page of messages;
+    - 'before': the page of messages older than the cursor (scrolling back);
+    - 'after': messages newer than the cursor, oldest first (fetching only what's new since last seen).
+    'limit' sets the page size (default 50). Messages are always returned in chronological order,
+    together with the cursors of the oldest and newest message on the page.
     """
-    user_id_str = request.args.get('user_id')
-    if not user_id_str:
-        return jsonify({"status": "error", "message": "user_id parameter is required."}), 400
+    user_id = g.user_id
 
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({"status": "error", "message": "Use either 'before' or 'after', not both."}), 400
     try:
-        user_id = int(user_id_str)
+        page_size = parse_history_page_size(request.args.get('limit'))
+        cursor_key = decode_history_cursor(before or after) if (before or after) else None
     except ValueError:
-        return jsonify({"status": "error", "message": "user_id must be an integer."}), 400
+        return jsonify({"status": "error", "message": "Invalid limit or cursor."}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Fetch the last 50 messages for the user, ordered by when they were recorded.
-    # This provides a reasonable amount of recent history.
-    cursor.execute('''
-        SELECT user_id, message, is_user_message, timestamp
-        FROM chat_history
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 50
-    ''', (user_id,)) # Ensure user_id is passed as a tuple for the query
-    history_rows = cursor.fetchall()
-    conn.close()
+    # Make sure this user's queued messages are written before reading them back
+    with span("flush"):
+        history_writer.flush(user_id)
+
+    # All three queries are answered from idx_chat_history_user_ts without sorting.
+    # One extra row is fetched to tell whether another page exists.
+    query = "SELECT id, user_id, message, is_user_message, timestamp, product_ids FROM chat_history WHERE user_id = ?"
+    params = [user_id]
+    if after:
+        query += " AND (timestamp, id) > (?, ?) ORDER BY timestamp ASC, id ASC LIMIT ?"
+    elif before:
+        query += " AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?"
+    else:
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    if cursor_key:
+        params.extend(cursor_key)
+    params.append(page_size + 1)
+
+    with span("query"), db_connection() as conn:
+        history_rows = conn.execute(query, tuple(params)).fetchall()
 
-    history = [
-        {"user_id": row["user_id"], "message": row["message"], "is_user_message": bool(row["is_user_message"]), "timestamp": row["timestamp"]}
-        for row in history_rows
-    ]
-    history.reverse() # Reverse to display in chronological order (oldest first)
+    has_more = len(history_rows) > page_size
+    history_rows = history_rows[:page_size]
+    if not after:
+        history_rows.reverse() # Reverse to display in chronological order (oldest first)
 
-    return jsonify({"status": "success", "message": "Chat history retrieved.", "data": {"history": history}}), 200
+    with span("rows"):
+        history = [
+            {"id": row["id"], "user_id": row["user_id"], "message": row["message"], "is_user_message": bool(row["is_user_message"]),
+             "timestamp": format_timestamp_ms(row["timestamp"]), "product_ids": decode_product_ids(row["product_ids"])}
+            for row in history_rows
+        ]
+    cursors = {
+        # Pass as 'before' to load older messages / as 'after' to load newer ones.
+        # When nothing new was found, the 'after' cursor the client already had stays valid.
+        "before": encode_history_cursor(history_rows[0]) if history_rows else before,
+        "after": encode_history_cursor(history_rows[-1]) if history_rows else after,
+    }
+
+    with span("serialize"):
+        return jsonify({"status": "success", "message": "Chat history retrieved.", "data": {"history": history, "cursors": cursors, "has_more": has_more}}), 200
+
+
+def parse_history_page_size(value):
+    """Converts a client-supplied history 'limit' into a page size capped at MAX_HISTORY_PAGE_SIZE."""
+    if value is None or value == '':
+        return DEFAULT_HISTORY_PAGE_SIZE
+    page_size = int(value)
+    if page_size <= 0:
+        raise ValueError("limit must be positive")
+    return min(page_size, MAX_HISTORY_PAGE_SIZE)
+
+def encode_history_cursor(row):
+    """Builds the opaque pagination cursor ("<timestamp_ms>_<id>") for a chat_history row."""
+    return f"{row['timestamp']}_{row['id']}"
+
+def decode_history_cursor(cursor_str):
+    """Parses a pagination cursor into a (timestamp_ms, id) tuple. Raises ValueError if malformed."""
+    timestamp_part, separator, id_part = cursor_str.partition("_")
+    # Plain ASCII digits only: int() would also accept '+', whitespace and '_' separators ("1_2_3")
+    digits = timestamp_part[1:] if timestamp_part.startswith("-") else timestamp_part  # Legacy rows may be < 0
+    if not (separator and digits.isascii() and digits.isdigit() and id_part.isascii() and id_part.isdigit()):
+        raise ValueError(f"Invalid cursor: {cursor_str!r}")
+    timestamp_ms, row_id = int(timestamp_part), int(id_part)
+    if abs(timestamp_ms) >= 2 ** 63 or row_id >= 2 ** 63:  # Beyond SQLite's 64-bit integers
+        raise ValueError(f"Invalid cursor: {cursor_str!r}")
+    return timestamp_ms, row_id
 
 
 # --- Application Initialization ---
-# This code will run once when the application starts, even when using Gunicorn.
-with app.app_context():
+# Schema setup is a separate step (`flask --app app migrate`, run once per deployment), so importing
+# the app does no database work: each worker maps the catalog snapshot when it first needs the
+# catalog, and loads the session token keys on the first authenticated request.
+def run_migrations():
+    """Creates or upgrades the tables and adds mock products if the products table is empty."""
     app.logger.info(f"Database will be created/connected at: {DATABASE_NAME}")
     create_tables()      # Create tables if they don't exist
     populate_products()  # Add mock products if the table is empty
 
+@app.cli.command('migrate')
+@click.option('--no-snapshot', is_flag=True, help="Skip (re)building the catalog snapshot.")
+def migrate_command(no_snapshot):
+    """Create or upgrade the database schema and build the catalog snapshot."""
+    run_migrations()
+    click.echo(f"Database {DATABASE_NAME} is up to date.")
+    if not no_snapshot and CATALOG_SNAPSHOT:
+        write_catalog_snapshot()
+
+@app.cli.command('build-catalog')
+def build_catalog_command():
+    """Rebuild the catalog snapshot from the products table (e.g. after bulk product changes)."""
+    if not CATALOG_SNAPSHOT:
+        raise click.UsageError("CATALOG_SNAPSHOT is empty, so the snapshot is disabled.")
+    write_catalog_snapshot()
+
+def write_catalog_snapshot():
+    start = time.perf_counter()
+    version, products, size = build_catalog_snapshot()
+    click.echo(f"Wrote {CATALOG_SNAPSHOT}: {products} products, catalog version {version}, "
+               f"{size / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s.")
+
 # --- Application Entry Point for Local Development ---
 if __name__ == '__main__':
+    # The development server sets up its own database and snapshot
+    run_migrations()
+    if CATALOG_SNAPSHOT:
+        build_catalog_snapshot()
     # Run the Flask development server
     # host='0.0.0.0' makes it accessible from any IP address on the network
     # debug=True enables debugger and auto-reloader (DO NOT use in production)
@@ -0,0 +1,173 @@
+"""ASGI entry point for the chatbot API.
+
+Serves the same Flask routes and JSON envelope as the WSGI app, but from an asyncio
+event loop: requests are accepted and read on the loop, and each Flask handler (and
+with it all blocking SQLite work) runs on a bounded thread pool. A slow write then
+ties up one pool thread instead of a whole worker process, and requests beyond the
+pool's capacity wait on the loop rather than in the listen backlog.
+
+Run it with any ASGI server, e.g. from the backend directory:
+
+    gunicorn --workers 4 --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:5000 asgi:application
+
+or `python asgi.py` for a single local process.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app
+
+# Threads running Flask handlers per process; defaults to the DB pool size so a handler never waits for a connection
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', flask_app.DB_POOL_SIZE))
+# Requests allowed to wait for a free thread before new ones are rejected with a 503
+ASGI_MAX_QUEUED = int(os.environ.get('ASGI_MAX_QUEUED', 256))
+
+BUSY_BODY = b'{"message":"Server is busy. Please retry shortly.","status":"error"}\n'
+
+
+class WSGIBridge:
+    """Minimal ASGI -> WSGI adapter that runs the wrapped WSGI app on a bounded thread pool.
+
+    Responses with a Content-Length (every regular Flask response) are buffered in the
+    worker thread and sent from the event loop; responses without one (streamed) are
+    forwarded chunk by chunk as the WSGI iterator produces them.
+    """
+
+    def __init__(self, wsgi_app, max_threads=8, max_queued=256):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.max_queued = max_queued
+        self._executor = None
+        self._in_flight = 0  # requests running or waiting for a thread (only touched on the event loop)
+
+    @property
+    def executor(self):
+        # Created lazily so each forked server worker gets its own threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="asgi-handler")
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+                flask_app.history_writer.close()
+                flask_app.db_pool.close_all()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        if self._in_flight >= self.max_threads + self.max_queued:
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BUSY_BODY)).encode()),
+                (b"retry-after", b"1"),
+            ]})
+            await send({"type": "http.response.body", "body": BUSY_BODY})
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = self._build_environ(scope, bytes(body))
+        self._in_flight += 1
+        try:
+            buffered = await loop.run_in_executor(self.executor, self._run_app, environ, send, loop)
+        finally:
+            self._in_flight -= 1
+        if buffered is not None:
+            start, chunks = buffered
+            await send(start)
+            await send({"type": "http.response.body", "body": b"".join(chunks)})
+
+    def _run_app(self, environ, send, loop):
+        """Calls the WSGI app on a pool thread. Returns (start message, body chunks) for buffered
+        responses; streamed responses are sent from here and None is returned."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["start"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+            }
+            response["streamed"] = not any(name.lower() == "content-length" for name, _ in headers)
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            if not response["streamed"]:
+                return response["start"], list(result)
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            send_from_thread(response["start"])
+            for chunk in result:
+                if chunk:
+                    send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+            send_from_thread({"type": "http.response.body", "body": b""})
+            return None
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    @staticmethod
+    def _build_environ(scope, body):
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+            "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+            "QUERY_STRING": scope["query_string"].decode("latin1"),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+            "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+            "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            "CONTENT_LENGTH": str(len(body)),
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin1")
+            if name == "content-length":
+                continue
+            key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+            value = value.decode("latin1")
+            environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+
+application = WSGIBridge(flask_app.app, max_threads=ASGI_THREADS, max_queued=ASGI_MAX_QUEUED)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    # Like `python app.py`, a local process sets up its own database and catalog snapshot
+    flask_app.run_migrations()
+    if flask_app.CATALOG_SNAPSHOT:
+        flask_app.build_catalog_snapshot()
+    uvicorn.run(application, host="127.0.0.1", port=int(os.environ.get('PORT', 5000)))
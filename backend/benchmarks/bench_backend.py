@@ -0,0 +1,283 @@
+"""Benchmark suite: replays a realistic request mix against a large synthetic database through the Flask test client.
+
+Run from the backend directory:
+
+    python benchmarks/bench_backend.py [--products 100000] [--users 10000] [--messages 1000000]
+                                       [--requests 5000] [--seed 42] [--output results.json]
+
+Builds a database with generate_data.py (or copies an existing one given with `--db`, e.g. a
+10M-message database generated once up front), then sends `--requests` requests drawn from a
+weighted mix of chat queries (the bench_intent_parser corpus), product searches and detail views,
+and chat history reads and writes for `--active-users` users. Reports per endpoint: requests,
+errors, throughput, p50/p95/p99 latency and the time spent inside SQLite calls. `--json` /
+`--output` emit the results, plus the data sizes, seed and git revision, as JSON to diff across builds.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_intent_parser import QUERY_CORPUS  # noqa: E402
+
+PRODUCT_SEARCHES = ["laptop", "headphones", "yoga", "novel", "jacket", "blender", "wireless", "pro", "board game"]
+PRODUCT_CATEGORIES = ["electronics", "books", "clothing", "home & kitchen", "sports", "toys"]
+
+# Thread-local accumulator for seconds spent inside SQLite calls during the current request
+db_time = threading.local()
+
+
+def _timed(method):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            db_time.seconds = getattr(db_time, "seconds", 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+class TimedCursor:
+    """Cursor proxy that adds the time of every execute/fetch to `db_time`."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ("execute", "executemany", "fetchone", "fetchmany", "fetchall"):
+            return _timed(attr)
+        return attr
+
+    def __iter__(self):
+        next_row = _timed(self._cursor.__next__)
+        while True:
+            try:
+                yield next_row()
+            except StopIteration:
+                return
+
+
+class TimedConnection:
+    """Connection proxy returning TimedCursors, so SQLite time can be attributed to requests."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name in ("commit", "rollback"):
+            return _timed(attr)
+        return attr
+
+    def execute(self, *args):
+        return TimedCursor(_timed(self._conn.execute)(*args))
+
+    def executemany(self, *args):
+        return TimedCursor(_timed(self._conn.executemany)(*args))
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor())
+
+
+def build_mix(rng, tokens, product_count):
+    """Returns [(endpoint label, weight, request function)]; each function takes the test client
+    and returns a response whose body has been fully read."""
+    def auth(user_id):
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    user_ids = list(tokens)
+    cursors = {}  # user id -> 'before' cursor of the last history page read
+
+    def chat(client):
+        return client.post("/chat", json={"message": rng.choice(QUERY_CORPUS), "persist": True},
+                           headers=auth(rng.choice(user_ids)))
+
+    def chat_stream(client):
+        response = client.post("/chat", json={"message": rng.choice(QUERY_CORPUS), "stream": True, "view": "compact"},
+                               headers=auth(rng.choice(user_ids)))
+        response.get_data()
+        return response
+
+    def products(client):
+        params = {"limit": rng.choice([20, 50])}
+        roll = rng.random()
+        if roll < 0.4:
+            params["search"] = rng.choice(PRODUCT_SEARCHES)
+        if roll > 0.3:
+            params["category"] = rng.choice(PRODUCT_CATEGORIES)
+        if rng.random() < 0.5:
+            params["max_price"] = rng.choice([500, 2000, 10000, 50000])
+        return client.get("/products", query_string=params)
+
+    def product_detail(client):
+        return client.get(f"/products/{rng.randint(1, max(1, product_count))}")
+
+    def history_read(client):
+        user_id = rng.choice(user_ids)
+        params = {"limit": 50}
+        if user_id in cursors and rng.random() < 0.5:
+            params["before"] = cursors[user_id]  # Scroll back a page
+        response = client.get("/chat/history", query_string=params, headers=auth(user_id))
+        body = response.get_json() or {}
+        cursors[user_id] = ((body.get("data") or {}).get("cursors") or {}).get("before")
+        if not cursors[user_id]:
+            cursors.pop(user_id)
+        return response
+
+    def history_write(client):
+        entries = [{"message": rng.choice(QUERY_CORPUS), "is_user_message": True},
+                   {"message": "Found 3 products matching your query.", "is_user_message": False}]
+        return client.post("/chat/history/batch", json={"entries": entries}, headers=auth(rng.choice(user_ids)))
+
+    return [
+        ("POST /chat", 30, chat),
+        ("POST /chat (stream)", 5, chat_stream),
+        ("GET /products", 25, products),
+        ("GET /products/<id>", 10, product_detail),
+        ("GET /chat/history", 20, history_read),
+        ("POST /chat/history/batch", 10, history_write),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(samples):
+    """samples: [(latency seconds, db seconds, status)] -> result dict for one endpoint."""
+    latencies = sorted(s[0] for s in samples)
+    total = sum(latencies)
+    db_total = sum(s[1] for s in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s[2] >= 400),
+        "throughput_rps": len(samples) / total if total else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": total / len(samples) * 1000 if samples else 0.0,
+        "db_mean_ms": db_total / len(samples) * 1000 if samples else 0.0,
+        "db_share": db_total / total if total else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="existing generated database to copy instead of generating one")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=1000000, help="chat_history rows")
+    parser.add_argument("--requests", type=int, default=5000, help="measured requests")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured requests sent first")
+    parser.add_argument("--active-users", type=int, default=200, help="users sending chat/history requests")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-result-cache", action="store_true", help="run with RESULT_CACHE_SIZE=0")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    import generate_data
+
+    workdir = tempfile.mkdtemp(prefix="bench_backend_")
+    db_path = os.path.join(workdir, "bench.db")
+    try:
+        if args.no_result_cache:
+            os.environ["RESULT_CACHE_SIZE"] = "0"
+        if args.db:
+            shutil.copy(args.db, db_path)
+            chat_app = generate_data.create_schema(db_path)
+        else:
+            chat_app = generate_data.create_schema(db_path)
+            generate_data.generate(db_path, args.products, args.users, args.messages, args.seed,
+                                   log=lambda line: print(line, file=sys.stderr))
+        chat_app.build_catalog_snapshot()  # Workers map the catalog from it, as after `flask migrate`
+        chat_app.refresh_product_catalog()
+        chat_app.result_cache.clear()
+
+        # Route all app queries through timed connections
+        chat_app.db_pool.close_all()
+        chat_app.db_pool = chat_app.ConnectionPool(
+            lambda: TimedConnection(chat_app.get_db_connection()),
+            max_size=chat_app.DB_POOL_SIZE, timeout=chat_app.DB_POOL_TIMEOUT,
+        )
+        with chat_app.db_connection() as conn:
+            sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                     for table in ("products", "users", "chat_history")}
+            bench_users = [row[0] for row in conn.execute(
+                "SELECT id FROM users WHERE username LIKE 'bench_user_%' ORDER BY id LIMIT ?", (args.active_users,))]
+        if not bench_users:
+            parser.error("the database has no bench_user_* users; generate it with generate_data.py")
+        # Tokens are issued directly: logging in would only benchmark password hashing
+        chat_app.sync_auth_state(force=True)  # Loads the signing keys, as the first request of a worker would
+        tokens = {user_id: chat_app.session_tokens.issue(user_id)[0] for user_id in bench_users}
+
+        rng = random.Random(args.seed)
+        mix = build_mix(rng, tokens, sizes["products"])
+        labels, weights = [m[0] for m in mix], [m[1] for m in mix]
+        handlers = {m[0]: m[2] for m in mix}
+        client = chat_app.app.test_client()
+
+        samples = {label: [] for label in labels}
+        started = time.perf_counter()
+        for i in range(args.warmup + args.requests):
+            label = rng.choices(labels, weights)[0]
+            db_time.seconds = 0.0
+            start = time.perf_counter()
+            response = handlers[label](client)
+            latency = time.perf_counter() - start
+            if i == args.warmup - 1:
+                started = time.perf_counter()
+            if i >= args.warmup:
+                samples[label].append((latency, db_time.seconds, response.status_code))
+        elapsed = time.perf_counter() - started
+        chat_app.history_writer.flush()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "revision": git_revision(),
+        "seed": args.seed,
+        "sizes": sizes,
+        "result_cache": not args.no_result_cache,
+        "requests": args.requests,
+        "elapsed_s": elapsed,
+        "throughput_rps": args.requests / elapsed if elapsed else 0.0,
+        "endpoints": {label: summarize(s) for label, s in samples.items() if s},
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{sizes['products']} products, {sizes['users']} users, {sizes['chat_history']} messages; "
+          f"{args.requests} requests in {elapsed:.1f}s ({results['throughput_rps']:.0f} req/s)")
+    print(f"{'endpoint':<26}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db ms':>8}{'db %':>6}")
+    for label, r in results["endpoints"].items():
+        print(f"{label:<26}{r['requests']:>7}{r['errors']:>5}{r['throughput_rps']:>9.0f}{r['p50_ms']:>9.2f}"
+              f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['db_mean_ms']:>8.2f}{r['db_share'] * 100:>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
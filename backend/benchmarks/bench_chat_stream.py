@@ -0,0 +1,110 @@
+"""Benchmark: time to first byte and peak memory of buffered versus streamed /chat responses.
+
+Run from the backend directory:
+
+    python benchmarks/bench_chat_stream.py [--products 20000] [--limit 200] [--chunk-size 10] [--rounds 20]
+
+Builds a copy of ecommerce.db padded with `--products` synthetic Electronics products (with
+long descriptions), then sends a broad query ("electronics") through the Flask test client with
+and without "stream": true. Reports the mean time until the first body chunk, the mean time
+until the full body, and the peak memory (tracemalloc) allocated while handling one request.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_database(workdir, product_count):
+    path = os.path.join(workdir, "ecommerce.db")
+    shutil.copy(os.path.join(BACKEND_DIR, "ecommerce.db"), path)
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO products (name, category, price, stock, description, image_url) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (f"Bench Gadget {i}", "Electronics", round(rng.uniform(10, 2000), 2), rng.randint(0, 200),
+             "A long product description for benchmarking. " * 20, f"https://picsum.photos/seed/bench_{i}/600/400")
+            for i in range(product_count)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def consume(client, headers, body):
+    """Returns (seconds to first chunk, seconds to last chunk) for one request."""
+    start = time.perf_counter()
+    response = client.post("/chat", json=body, headers=headers, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    first = time.perf_counter() - start
+    for _ in chunks:
+        pass
+    total = time.perf_counter() - start
+    response.close()
+    return first, total
+
+
+def measure(client, headers, body):
+    """Returns (seconds to first chunk, seconds to last chunk, peak bytes allocated). Timing and
+    memory come from separate requests, since tracing allocations slows the handler down."""
+    first, total = consume(client, headers, body)
+    tracemalloc.start()
+    consume(client, headers, body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, total, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000, help="synthetic products added to the catalog")
+    parser.add_argument("--limit", type=int, default=200, help="page size requested from /chat")
+    parser.add_argument("--chunk-size", type=int, default=10, help="products per streamed event")
+    parser.add_argument("--rounds", type=int, default=20, help="requests per mode")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_chat_stream_")
+    try:
+        build_database(workdir, args.products)
+        os.chdir(workdir)
+        os.environ.setdefault("RESULT_CACHE_SIZE", "0")  # Measure the lookup itself, not cache hits
+        sys.path.insert(0, BACKEND_DIR)
+        import app as chat_app
+        chat_app.run_migrations()
+        chat_app.build_catalog_snapshot()
+
+        client = chat_app.app.test_client()
+        client.post("/register", json={"username": "bench", "password": "bench-password"})
+        token = client.post("/login", json={"username": "bench", "password": "bench-password"}).get_json()["data"]["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        modes = {
+            "buffered": {"message": "electronics", "limit": args.limit},
+            "streamed": {"message": "electronics", "limit": args.limit, "stream": True, "chunk_size": args.chunk_size},
+        }
+        results = {}
+        for label, body in modes.items():
+            measure(client, headers, body)  # Warm-up
+            runs = [measure(client, headers, body) for _ in range(args.rounds)]
+            results[label] = [sum(run[i] for run in runs) / len(runs) for i in range(3)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'mode':<12}{'first byte ms':>15}{'full body ms':>15}{'peak KiB':>12}")
+    for label, (first, total, peak) in results.items():
+        print(f"{label:<12}{first * 1000:>15.2f}{total * 1000:>15.2f}{peak / 1024:>12.0f}")
+    print(json.dumps({"products": args.products, "limit": args.limit, "chunk_size": args.chunk_size}))
+
+
+if __name__ == "__main__":
+    main()
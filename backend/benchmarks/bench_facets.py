@@ -0,0 +1,153 @@
+"""Benchmark: GET /products/facets counts from the catalog's sorted price arrays versus GROUP BY queries.
+
+Run from the backend directory:
+
+    python benchmarks/bench_facets.py [--products 100000 1000000] [--rounds 20] [--seed 42] [--json]
+
+For each catalog size, generates a products table with generate_data.py and builds the catalog
+snapshot, then computes the facets (category counts, a 10-bucket price histogram and in/out of
+stock counts) for several filter sets in two ways:
+- "group by": the SQL a client or report would run, one GROUP BY scan per facet
+  (categories, price buckets, and count/min/max/stock totals);
+- "catalog": find_facets(), i.e. bisects of the per-category sorted price arrays, or one pass over
+  the keyword matches for the search case.
+Reports the mean and p95 milliseconds per facet set. Both give the same counts (the script checks);
+the GROUP BY queries find keyword matches through the products_fts full-text index. Each size runs
+in its own process.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# label -> (category, min_price, max_price, search term)
+CASES = {
+    "all products": (None, None, None, None),
+    "category": ("electronics", None, None, None),
+    "price range": (None, 1000, 20000, None),
+    "category + price": ("clothing", 500, 5000, None),
+    "search": (None, None, None, "wireless"),
+}
+
+
+def group_by_facets(conn, category, min_price, max_price, search, edges):
+    """The facets as GROUP BY queries: category counts (without the category filter), then the
+    price histogram over `edges` and the totals for the full filter set."""
+    where, params = " WHERE 1=1", []
+    if min_price is not None:
+        where += " AND price >= ?"
+        params.append(min_price)
+    if max_price is not None:
+        where += " AND price <= ?"
+        params.append(max_price)
+    if search:
+        where += " AND id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+        params.append(f'"{search}"*')  # A token prefix, as the keyword index matches it
+    categories = dict(conn.execute(f"SELECT category, COUNT(*) FROM products{where} GROUP BY category", params))
+    if category:
+        where += " AND LOWER(category) = ?"
+        params.append(category)
+
+    buckets = [0] * max(0, len(edges) - 1)
+    if buckets:
+        # Evenly spaced edges: the bucket is computed from the price; the last one includes its upper edge
+        step = edges[1] - edges[0]
+        for bucket, count in conn.execute(
+            f"SELECT MIN(CAST((price - ?) / ? AS INTEGER), ?) AS bucket, COUNT(*) FROM products{where} "
+            "AND price >= ? AND price <= ? GROUP BY bucket",
+            [edges[0], step, len(buckets) - 1] + params + [edges[0], edges[-1]],
+        ):
+            buckets[bucket] += count
+    total, in_stock, low, high = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(stock > 0), 0), MIN(price), MAX(price) FROM products{where}", params
+    ).fetchone()
+    return {"categories": categories, "buckets": buckets, "total": total, "in_stock": in_stock, "min": low, "max": high}
+
+
+def timed(function, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return result, {"mean_ms": sum(samples) / len(samples) * 1000,
+                    "p95_ms": samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000}
+
+
+def run_size(products, rounds, seed):
+    """Benchmarks one catalog size in this process; returns {case: {"group by": ..., "catalog": ...}}."""
+    import generate_data
+
+    workdir = tempfile.mkdtemp(prefix="bench_facets_")
+    try:
+        db_path = os.path.join(workdir, "bench.db")
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+        chat_app = generate_data.create_schema(db_path)
+        generate_data.generate(db_path, products, 1, 0, seed, log=lambda line: print(line, file=sys.stderr))
+        chat_app.build_catalog_snapshot()
+        chat_app.refresh_product_catalog()
+
+        results = {}
+        with chat_app.db_connection() as conn:
+            for label, (category, min_price, max_price, search) in CASES.items():
+                terms = [search] if search else None
+                facets, catalog_timing = timed(
+                    lambda: chat_app.find_facets(category, min_price, max_price, terms), rounds)
+                edges = [facets["price"]["buckets"][0]["min"]] + [b["max"] for b in facets["price"]["buckets"]]
+                counts, group_by_timing = timed(
+                    lambda: group_by_facets(conn, category, min_price, max_price, search, edges), rounds)
+                assert counts["categories"] == {c["category"]: c["count"] for c in facets["categories"]}, label
+                assert counts["total"] == facets["total"] and counts["in_stock"] == facets["stock"]["in_stock"], label
+                assert counts["buckets"] == [b["count"] for b in facets["price"]["buckets"]], label
+                results[label] = {"matches": facets["total"], "group by": group_by_timing, "catalog": catalog_timing}
+        chat_app.history_writer.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, nargs="+", default=[100000, 1000000], help="catalog sizes")
+    parser.add_argument("--rounds", type=int, default=20, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--single-size", action="store_true", help=argparse.SUPPRESS)  # Child process mode
+    args = parser.parse_args()
+
+    if args.single_size:
+        print(json.dumps(run_size(args.products[0], args.rounds, args.seed)))
+        return
+
+    results = {}
+    for products in args.products:
+        # The app binds its database at import, so every size gets a fresh interpreter
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single-size", "--products", str(products),
+             "--rounds", str(args.rounds), "--seed", str(args.seed)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[products] = json.loads(output)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'products':>9}  {'filters':<18}{'matches':>9}{'group by ms':>13}{'p95':>9}{'catalog ms':>12}{'p95':>9}{'speedup':>9}")
+    for products, cases in results.items():
+        for label, r in cases.items():
+            speedup = r["group by"]["mean_ms"] / r["catalog"]["mean_ms"] if r["catalog"]["mean_ms"] else 0.0
+            print(f"{products:>9}  {label:<18}{r['matches']:>9}{r['group by']['mean_ms']:>13.2f}{r['group by']['p95_ms']:>9.2f}"
+                  f"{r['catalog']['mean_ms']:>12.3f}{r['catalog']['p95_ms']:>9.3f}{speedup:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
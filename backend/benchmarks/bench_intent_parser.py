@@ -0,0 +1,145 @@
+"""Microbenchmark: per-call cost of parse_chat_intent versus the original word-list implementation.
+
+Run from the backend directory:
+
+    python benchmarks/bench_intent_parser.py [--rounds N]
+
+Reports microseconds per call for the legacy parser, the new parser with its memoization
+cache disabled (cold: every call tokenizes), and the new parser with the cache warm. The three
+are timed in alternating repeats, so drift in machine load affects them alike; the cold and warm
+speedups are separate figures, and only the warm one reflects the cache.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_parser import _parse_normalized, parse_chat_intent  # noqa: E402
+
+# Representative chat queries, including repeated phrasings and price grammar variants
+QUERY_CORPUS = [
+    "show me laptops under 50000",
+    "Show me laptops under 50k",
+    "laptops under ₹50,000",
+    "phones 50k-80k",
+    "books under 1.5 lakh",
+    "Are there any headphones?",
+    "I'm looking for books",
+    "I need a new laptop for work",
+    "Find cotton shirts",
+    "yoga mats",
+    "show me electronics between 1000 and 2000",
+    "any toys over 500",
+    "eco-friendly yoga mat",
+    "smart speaker above 300",
+    "cheap kitchen blender below 1500",
+    "premium headphones between 10k and 20k",
+    "what is the weather",
+    "display some sports dumbbells",
+    "clothing jacket under 2000 rupees",
+    "can you find a compact keyboard please",
+]
+
+
+def legacy_parse_chat_intent(message):
+    """The original parse_chat_intent from app.py (logging removed), kept for comparison."""
+    message_lower = message.lower()
+    intent = {"category": None, "min_price": None, "max_price": None, "keywords": []}
+    words = message_lower.split()
+
+    categories_db = ["electronics", "laptop", "laptops", "mobile", "mobiles", "phone", "phones", "book", "books", "clothing", "clothes", "home", "kitchen", "sports", "toys", "headphones"]
+    for word in words:
+        if word in categories_db:
+            if word in ["laptop", "laptops", "mobile", "mobiles", "phone", "phones", "headphones"]:
+                intent["category"] = "Electronics"
+            else:
+                intent["category"] = word.capitalize()
+            break
+
+    try:
+        if "under" in message_lower or "below" in message_lower:
+            for i, word_val in enumerate(words):
+                if word_val in ["under", "below"] and i + 1 < len(words):
+                    price_str = words[i+1].replace('k', '000').replace(',', '')
+                    intent["max_price"] = float(price_str)
+                    break
+        elif "over" in message_lower or "above" in message_lower:
+            for i, word_val in enumerate(words):
+                if word_val in ["over", "above"] and i + 1 < len(words):
+                    price_str = words[i+1].replace('k', '000').replace(',', '')
+                    intent["min_price"] = float(price_str)
+                    break
+        elif "between" in message_lower and "and" in message_lower:
+            idx_between = words.index("between")
+            idx_and = words.index("and")
+            if idx_between < idx_and and idx_between + 1 < len(words) and idx_and + 1 < len(words):
+                min_p_str = words[idx_between+1].replace('k', '000').replace(',', '')
+                max_p_str = words[idx_and+1].replace('k', '000').replace(',', '')
+                intent["min_price"] = float(min_p_str)
+                intent["max_price"] = float(max_p_str)
+    except (ValueError, IndexError):
+        pass
+
+    stopwords = [
+        "show", "me", "find", "i'm", "looking", "for", "a", "an", "the", "is", "are", "of", "in", "on", "at",
+        "under", "over", "below", "above", "between", "and", "can", "you", "please", "display", "what", "whats",
+        "any", "some", "about"
+    ]
+    price_related_words = ["price", "cost", "budget", "range", "k", "thousand", "dollar", "dollars", "rupee", "rupees"]
+    base_potential_keywords = [
+        word for word in words
+        if word not in stopwords
+        and word not in categories_db
+        and not word.isdigit()
+        and word not in price_related_words
+    ]
+    final_keywords = []
+    identified_category_lower_words = []
+    if intent.get("category"):
+        identified_category_lower_words = intent["category"].lower().split()
+    for pk_word in base_potential_keywords:
+        if not (identified_category_lower_words and pk_word in identified_category_lower_words):
+            final_keywords.append(pk_word)
+    intent["keywords"] = list(set(final_keywords))
+    return intent
+
+
+def uncached_parse_chat_intent(message):
+    """The new parser with memoization bypassed, to measure the tokenizer itself."""
+    normalized = " ".join(message.lower().split())
+    category, min_price, max_price, keywords, refinement = _parse_normalized.__wrapped__(normalized)
+    return {"category": category, "min_price": min_price, "max_price": max_price, "keywords": list(keywords),
+            "refinement": refinement}
+
+
+def per_call_us(funcs, rounds, repeat=7):
+    """Best-of-`repeat` average cost of one call of each function, in microseconds, over the whole
+    corpus. The functions take turns within each repeat."""
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeat):
+        for i, func in enumerate(funcs):
+            def run():
+                for query in QUERY_CORPUS:
+                    func(query)
+            best[i] = min(best[i], timeit.timeit(run, number=rounds))
+    return [seconds / (rounds * len(QUERY_CORPUS)) * 1e6 for seconds in best]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000, help="passes over the query corpus per timing run")
+    args = parser.parse_args()
+
+    # Cache entries for the corpus are filled by the first timing pass
+    legacy, cold, warm = per_call_us([legacy_parse_chat_intent, uncached_parse_chat_intent, parse_chat_intent],
+                                     args.rounds)
+
+    print(f"{'parser':<28}{'us/call':>10}{'speedup':>10}")
+    for label, cost in (("legacy (word lists)", legacy), ("compiled, cache disabled", cold), ("compiled, cache warm", warm)):
+        print(f"{label:<28}{cost:>10.2f}{legacy / cost:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
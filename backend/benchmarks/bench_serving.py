@@ -0,0 +1,185 @@
+"""Load test: the WSGI app under gunicorn sync workers versus the ASGI entry point under uvicorn workers.
+
+Run from the backend directory (needs gunicorn, uvicorn and uvicorn-worker installed):
+
+    python benchmarks/bench_serving.py [--workers 2] [--concurrency 32] [--duration 10] [--lock-ms 200]
+
+Each server is started against its own copy of ecommerce.db with the same number of worker
+processes, then hammered with a mixed workload (/products, /chat with persist, and chat history
+reads and writes) from `--concurrency` client threads. With `--lock-ms`, a separate connection
+repeatedly holds the database write lock for that long to simulate slow SQLite writes.
+Reports throughput, latency percentiles and errors per server.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "wsgi (gunicorn sync)": ["gunicorn", "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "app:app"],
+    "asgi (uvicorn workers)": ["gunicorn", "--workers", "{workers}", "--worker-class", "uvicorn_worker.UvicornWorker",
+                               "--bind", "127.0.0.1:{port}", "asgi:application"],
+}
+
+CHAT_MESSAGES = [
+    "laptops under 1000", "show me books", "headphones between 100 and 500", "yoga mat",
+    "kitchen blender below 1500", "any toys over 500", "smart speaker", "clothing jacket under 2000",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(conn, method, path, body=None, token=None):
+    """Sends one request on a keep-alive connection; returns (status, parsed JSON body)."""
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read() or b"null")
+
+
+def wait_until_up(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            request(conn, "GET", "/products?limit=1")
+            conn.close()
+            return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def client_loop(port, token, stop_at, latencies, errors):
+    rng = random.Random()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.monotonic() < stop_at:
+        roll = rng.random()
+        if roll < 0.4:
+            args = ("GET", f"/products?category={rng.choice(['books', 'electronics', 'toys'])}&max_price={rng.randint(100, 2000)}")
+        elif roll < 0.8:
+            args = ("POST", "/chat", {"message": rng.choice(CHAT_MESSAGES), "persist": True})
+        elif roll < 0.9:
+            args = ("GET", "/chat/history?limit=20")
+        else:
+            args = ("POST", "/chat/history", {"message": "hello", "is_user_message": True})
+        start = time.perf_counter()
+        try:
+            status, _ = request(conn, *args, token=token)
+            if status >= 500:
+                errors.append(status)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def lock_holder(db_path, lock_ms, stop_at):
+    """Periodically takes the database write lock and holds it, like a slow write would."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    while time.monotonic() < stop_at:
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(lock_ms / 1000)
+        conn.rollback()
+        time.sleep(lock_ms / 1000)
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_server(label, command, args):
+    workdir = tempfile.mkdtemp(prefix="bench_serving_")
+    shutil.copy(os.path.join(BACKEND_DIR, "ecommerce.db"), workdir)
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    # Build the catalog snapshot the workers map, as a deployment would before starting them
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "migrate"], cwd=workdir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [part.format(workers=args.workers, port=port) for part in command],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(port)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        request(conn, "POST", "/register", {"username": "bench", "password": "bench-password"})
+        _, login = request(conn, "POST", "/login", {"username": "bench", "password": "bench-password"})
+        conn.close()
+        token = login["data"]["token"]
+
+        latencies, errors = [], []
+        stop_at = time.monotonic() + args.duration
+        threads = [threading.Thread(target=client_loop, args=(port, token, stop_at, latencies, errors))
+                   for _ in range(args.concurrency)]
+        if args.lock_ms:
+            threads.append(threading.Thread(target=lock_holder, args=(os.path.join(workdir, "ecommerce.db"), args.lock_ms, stop_at)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    return {
+        "server": label,
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="server worker processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per server")
+    parser.add_argument("--lock-ms", type=int, default=0, help="periodically hold the DB write lock this long")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for label, command in SERVERS.items():
+        if shutil.which(command[0]) is None:
+            print(f"Skipping {label}: {command[0]} is not installed", file=sys.stderr)
+            continue
+        results.append(run_server(label, command, args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'server':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['server']:<24}{r['throughput_rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
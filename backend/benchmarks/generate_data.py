@@ -0,0 +1,175 @@
+"""Seeded generator for large synthetic products, users and chat_history tables.
+
+Run from the backend directory:
+
+    python benchmarks/generate_data.py --db /tmp/bench.db [--products 100000] [--users 10000]
+                                       [--messages 10000000] [--seed 42]
+
+Creates a new database at `--db` with the app's schema (by running the app's migrations with
+DATABASE_NAME pointing at it) and fills it deterministically: the same seed and sizes always produce the same
+rows, and each table has its own random stream, so growing one table leaves the others unchanged.
+- products: names, categories and price ranges that the intent parser's phrases actually hit;
+- users: "bench_user_<n>", all with the password "bench-password";
+- chat_history: alternating user questions and bot replies (with product ids) spread over the
+  90 days before 2026-01-01, skewed so a minority of users own most of the messages.
+The catalog snapshot the server maps is written next to it (e.g. /tmp/bench.catalog).
+bench_backend.py uses `generate()` to build its database.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_intent_parser import QUERY_CORPUS  # noqa: E402
+
+BENCH_PASSWORD = "bench-password"
+INSERT_BATCH = 50000
+HISTORY_DAYS = 90
+HISTORY_END_MS = 1767225600000  # 2026-01-01 UTC; fixed so the same seed gives the same timestamps on any day
+
+# category -> (product nouns, (min price, max price)); prices are drawn log-uniformly within the range
+CATEGORIES = {
+    "Electronics": (["Laptop", "Smartphone", "Headphones", "Keyboard", "Mouse", "Monitor", "Charger",
+                     "Speaker", "Tablet", "Smartwatch", "Camera", "Router"], (300, 150000)),
+    "Books": (["Novel", "Textbook", "Cookbook", "Biography", "Comic", "Guide", "Anthology"], (99, 4000)),
+    "Clothing": (["T-Shirt", "Jeans", "Jacket", "Sweater", "Shirt", "Dress", "Sneakers", "Hoodie"], (199, 12000)),
+    "Home & Kitchen": (["Blender", "Toaster", "Coffee Maker", "Kettle", "Cookware Set", "Mixer",
+                        "Air Fryer", "Lamp"], (299, 40000)),
+    "Sports": (["Dumbbells", "Yoga Mat", "Football", "Cricket Bat", "Racket", "Bicycle", "Treadmill"], (199, 90000)),
+    "Toys": (["Action Figure", "Board Game", "Puzzle", "Building Blocks", "Doll", "RC Car"], (149, 8000)),
+}
+ADJECTIVES = ["Premium", "Budget", "High-Performance", "Eco-Friendly", "Compact", "Durable", "Smart",
+              "Wireless", "Classic", "Pro", "Lightweight", "Deluxe"]
+FEATURES = ["long battery life", "a two-year warranty", "fast charging", "water resistance", "a slim design",
+            "premium materials", "easy cleaning", "a lightweight build", "noise cancellation", "energy efficiency"]
+
+
+def create_schema(db_path):
+    """Creates the app's tables (and a handful of mock products) in a new or existing database file
+    by importing app with DATABASE_NAME set to it and running its migrations. Returns the app module."""
+    os.environ["DATABASE_NAME"] = db_path
+    import app as chat_app
+    if os.path.abspath(chat_app.DATABASE_NAME) != os.path.abspath(db_path):
+        raise RuntimeError(f"app is already using {chat_app.DATABASE_NAME}; generate in a fresh process")
+    chat_app.run_migrations()
+    return chat_app
+
+
+def generate_products(rng, count):
+    categories = list(CATEGORIES)
+    for i in range(count):
+        category = rng.choice(categories)
+        nouns, (low, high) = CATEGORIES[category]
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(nouns)} Model {rng.randint(100, 9999)}"
+        price = round(low * (high / low) ** rng.random(), 2)
+        stock = 0 if rng.random() < 0.1 else rng.randint(1, 500)
+        description = (f"A high-quality {name} from the {category} category, with {rng.choice(FEATURES)} "
+                       f"and {rng.choice(FEATURES)}. Only {stock} left in stock!")
+        image_url = f"https://picsum.photos/seed/{name.replace(' ', '_')}_{i}/600/400"
+        yield name, category, price, stock, description, image_url
+
+
+def generate_messages(rng, user_ids, product_count, count):
+    """Yields chat_history rows as (user_id, message, is_user_message, timestamp_ms, product_ids),
+    two per turn, in timestamp order."""
+    start_ms = HISTORY_END_MS - HISTORY_DAYS * 24 * 60 * 60 * 1000
+    step_ms = HISTORY_DAYS * 24 * 60 * 60 * 1000 / max(1, count)
+    for i in range(0, count, 2):
+        user_id = user_ids[int(len(user_ids) * rng.random() ** 3)]  # Heavily skewed towards the first users
+        timestamp = start_ms + int(i * step_ms)
+        yield user_id, rng.choice(QUERY_CORPUS), True, timestamp, None
+        if i + 1 < count:
+            shown = rng.randint(0, 5)
+            product_ids = ",".join(str(rng.randint(1, product_count)) for _ in range(shown)) if product_count else ""
+            reply = f"Found {shown} products matching your query." if shown else \
+                "I couldn't find any products matching your description."
+            yield user_id, reply, False, timestamp + rng.randint(50, 2000), product_ids or None
+
+
+def insert_batches(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+
+
+def generate(db_path, products, users, messages, seed=42, log=print):
+    """Fills the (already created) database at `db_path`: replaces the products and adds `users` users
+    and `messages` chat_history rows. Returns the elapsed seconds per table."""
+    timings = {}
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")  # Bulk load; the file is thrown away if generation fails
+    try:
+        start = time.perf_counter()
+        import app as chat_app
+        # The full-text index is rebuilt once after the load instead of row by row by its triggers
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS products_fts_after_{event}")
+        conn.execute("DROP TABLE IF EXISTS products_fts")
+        conn.execute("DELETE FROM products")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'products'")
+        insert_batches(conn, "INSERT INTO products (name, category, price, stock, description, image_url) VALUES (?, ?, ?, ?, ?, ?)",
+                       generate_products(random.Random(f"{seed}-products"), products))
+        chat_app.create_product_search_index(conn)
+        conn.commit()
+        timings["products"] = time.perf_counter() - start
+        log(f"{products} products in {timings['products']:.1f}s")
+
+        start = time.perf_counter()
+        password_hash = generate_password_hash(BENCH_PASSWORD, chat_app.PASSWORD_HASH_METHOD)  # Shared; hashing once is enough
+        insert_batches(conn, "INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)",
+                       ((f"bench_user_{n}", password_hash) for n in range(users)))
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'bench_user_%' ORDER BY id")]
+        timings["users"] = time.perf_counter() - start
+        log(f"{users} users in {timings['users']:.1f}s")
+
+        start = time.perf_counter()
+        if messages and user_ids:
+            # Building the index once after the load is much faster than maintaining it row by row
+            conn.execute("DROP INDEX IF EXISTS idx_chat_history_user_ts")
+            insert_batches(conn, "INSERT INTO chat_history (user_id, message, is_user_message, timestamp, product_ids) VALUES (?, ?, ?, ?, ?)",
+                           generate_messages(random.Random(f"{seed}-messages"), user_ids, products, messages))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp)")
+            conn.commit()
+        timings["chat_history"] = time.perf_counter() - start
+        log(f"{messages} chat messages in {timings['chat_history']:.1f}s")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="path of the database to create (must not exist)")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=1000000, help="chat_history rows")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists; generate into a new file")
+    chat_app = create_schema(args.db)
+    chat_app.history_writer.close()
+    chat_app.db_pool.close_all()
+    generate(args.db, args.products, args.users, args.messages, args.seed)
+    size = chat_app.build_catalog_snapshot()[2]
+    print(f"Catalog snapshot {chat_app.CATALOG_SNAPSHOT} ({size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
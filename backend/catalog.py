@@ -0,0 +1,363 @@
+import bisect
+import math
+from array import array
+
+from catalog_snapshot import StringTable
+
+# Translation table that lowercases ASCII letters only, mirroring SQLite's
+# built-in LOWER() (which leaves non-ASCII characters untouched).
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def ascii_lower(text):
+    """Lowercases a string the same way SQLite's LOWER() does."""
+    return text.translate(_ASCII_LOWER) if text else ""
+
+
+def price_histogram_edges(low, high, buckets):
+    """Returns evenly spaced bucket edges on a rounded step (1, 2, 2.5 or 5 times a power of ten)
+    covering [low, high] with at most `buckets` buckets, e.g. (0, 500, 1000, 1500) for 20..1499."""
+    if high <= low:
+        return [low, high]
+    magnitude = 10 ** math.floor(math.log10((high - low) / buckets))
+    for multiple in (1, 2, 2.5, 5, 10):
+        step = multiple * magnitude
+        if math.ceil(high / step) - math.floor(low / step) <= buckets:
+            break
+    start = math.floor(low / step)
+    count = max(1, math.ceil(high / step) - start)
+    return [round((start + i) * step, 6) for i in range(count + 1)]
+
+
+def _price_bounds(sorted_prices, min_price, max_price):
+    """Returns the (lo, hi) slice of a sorted price array holding prices within [min_price, max_price]."""
+    lo = 0 if min_price is None else bisect.bisect_left(sorted_prices, min_price)
+    hi = len(sorted_prices) if max_price is None else bisect.bisect_right(sorted_prices, max_price)
+    return lo, max(lo, hi)
+
+
+def _facet_result(category_counts, price_ranges, in_stock, price_edges, price_buckets):
+    """Assembles the facets dict. price_ranges: (sorted prices, lo, hi) slices holding the matched prices."""
+    total = sum(hi - lo for _, lo, hi in price_ranges)
+    low = min((prices[lo] for prices, lo, hi in price_ranges if hi > lo), default=None)
+    high = max((prices[hi - 1] for prices, lo, hi in price_ranges if hi > lo), default=None)
+    edges = price_edges
+    if edges is None:
+        edges = price_histogram_edges(low, high, price_buckets) if total else []
+
+    # Bucket i holds prices in [edges[i], edges[i + 1]); the last bucket also includes its upper edge
+    counts = [0] * max(0, len(edges) - 1)
+    for prices, lo, hi in price_ranges:
+        start = bisect.bisect_left(prices, edges[0], lo, hi) if edges else hi
+        for i in range(len(counts)):
+            cut = bisect.bisect_right if i == len(counts) - 1 else bisect.bisect_left
+            end = cut(prices, edges[i + 1], lo, hi)
+            counts[i] += end - start
+            start = end
+
+    return {
+        "total": total,
+        "categories": [{"category": name, "count": count} for name, count in
+                       sorted(category_counts.items(), key=lambda item: (-item[1], item[0])) if count],
+        "price": {
+            "min": low,
+            "max": high,
+            "buckets": [{"min": edges[i], "max": edges[i + 1], "count": count} for i, count in enumerate(counts)],
+        },
+        "stock": {"in_stock": in_stock, "out_of_stock": total - in_stock},
+    }
+
+
+def count_facets(rows, category=None, price_edges=None, price_buckets=10):
+    """Facet counts (see ProductCatalog.facets) in a single pass over (category, price, stock) rows
+    that already passed the price and keyword filters but not the category filter."""
+    category_key = ascii_lower(category) if category else None
+    categories = {}  # lowercased name -> [first spelling seen, count]
+    prices = []
+    in_stock = 0
+    for name, price, stock in rows:
+        key = ascii_lower(name)
+        entry = categories.get(key)
+        if entry is None:
+            entry = categories[key] = [name, 0]
+        entry[1] += 1
+        if category_key is None or key == category_key:
+            prices.append(price)
+            in_stock += stock > 0
+    prices.sort()
+    return _facet_result(dict(categories.values()), [(prices, 0, len(prices))], in_stock, price_edges, price_buckets)
+
+
+class ProductCatalog:
+    """Read-optimized, in-process copy of the `products` table.
+
+    Rows are loaded once (ordered by id, i.e. the order SQLite returns them in
+    for our unordered SELECTs) into parallel array-backed columns:
+    - prices are additionally kept as a sorted array with a permutation back to
+      row positions, so price ranges are answered with `bisect`;
+    - categories are interned into small integer codes with a per-code list of row positions, and
+      per-code sorted arrays of all and of in-stock prices that answer facet counts with `bisect`.
+    Filtering returns exactly the rows the equivalent SQL query would return, in the same order.
+    Keyword matching is left to the search_index.KeywordIndex built over the same products.
+
+    The same columns can instead be mapped from a catalog snapshot (see catalog_snapshot), in which
+    case they are read-only memoryviews and StringTables shared with every other process mapping it.
+    """
+
+    COLUMNS = ("id", "name", "category", "price", "stock", "description", "image_url")
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.ids = array("q")
+        self.prices = array("d")
+        self.stocks = array("q")
+        self.category_codes = array("H")
+        self.category_names = []       # code -> original category string
+        self._category_lookup = {}     # lowercased category -> code
+        self._category_positions = []  # code -> array of row positions
+        self._category_prices = []     # code -> sorted prices of its products
+        self._category_in_stock_prices = []  # code -> sorted prices of its products with stock > 0
+        self.names = []
+        self.descriptions = []
+        self.image_urls = []
+        self._sorted_prices = array("d")
+        self._price_order = array("I")  # sorted price index -> row position
+        self._columns = self._column_map()
+        self.loaded = False
+
+    def _column_map(self):
+        """Returns {column name: values by row position}; category is decoded separately."""
+        return {
+            "id": self.ids, "name": self.names, "price": self.prices, "stock": self.stocks,
+            "description": self.descriptions, "image_url": self.image_urls,
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, conn):
+        """(Re)builds all columns from the `products` table using the given connection."""
+        self._reset()
+        cursor = conn.execute(
+            "SELECT id, name, category, price, stock, description, image_url FROM products ORDER BY id"
+        )
+        for position, (product_id, name, category, price, stock, description, image_url) in enumerate(cursor):
+            self.ids.append(product_id)
+            self.prices.append(price)
+            self.stocks.append(stock)
+
+            category_key = ascii_lower(category)
+            code = self._category_lookup.get(category_key)
+            if code is None:
+                code = len(self.category_names)
+                self._category_lookup[category_key] = code
+                self.category_names.append(category)
+                self._category_positions.append(array("I"))
+            self.category_codes.append(code)
+            self._category_positions[code].append(position)
+
+            self.names.append(name)
+            self.descriptions.append(description)
+            self.image_urls.append(image_url)
+
+        order = sorted(range(len(self.prices)), key=self.prices.__getitem__)
+        self._price_order = array("I", order)
+        self._sorted_prices = array("d", (self.prices[i] for i in order))
+        for positions in self._category_positions:
+            self._category_prices.append(array("d", sorted(self.prices[p] for p in positions)))
+            in_stock = sorted(self.prices[p] for p in positions if self.stocks[p] > 0)
+            self._category_in_stock_prices.append(array("d", in_stock))
+        self.loaded = True
+
+    def snapshot_sections(self):
+        """Returns the columns and derived indexes as snapshot sections (see catalog_snapshot.write_snapshot)."""
+        category_positions, category_prices = array("I"), array("d")
+        category_offsets = array("Q", [0])  # code -> start of its positions (and prices) in the arrays above
+        for positions, prices in zip(self._category_positions, self._category_prices):
+            category_positions.extend(positions)
+            category_prices.extend(prices)
+            category_offsets.append(len(category_positions))
+        in_stock_prices = array("d")
+        in_stock_offsets = array("Q", [0])
+        for prices in self._category_in_stock_prices:
+            in_stock_prices.extend(prices)
+            in_stock_offsets.append(len(in_stock_prices))
+        sections = {
+            "catalog.ids": self.ids,
+            "catalog.prices": self.prices,
+            "catalog.stocks": self.stocks,
+            "catalog.category_codes": self.category_codes,
+            "catalog.category_positions": category_positions,
+            "catalog.category_offsets": category_offsets,
+            "catalog.category_prices": category_prices,
+            "catalog.category_in_stock_prices": in_stock_prices,
+            "catalog.category_in_stock_offsets": in_stock_offsets,
+            "catalog.sorted_prices": self._sorted_prices,
+            "catalog.price_order": self._price_order,
+        }
+        for name, column in (("names", self.names), ("descriptions", self.descriptions),
+                             ("image_urls", self.image_urls), ("category_names", self.category_names)):
+            sections.update(StringTable.encode(f"catalog.{name}", column))
+        return sections, {"catalog.products": len(self)}
+
+    def load_snapshot(self, snapshot):
+        """Replaces all columns with views of a mapped CatalogSnapshot. Nothing is copied except
+        the (small) category name table."""
+        self._reset()
+        self.ids = snapshot.section("catalog.ids")
+        self.prices = snapshot.section("catalog.prices")
+        self.stocks = snapshot.section("catalog.stocks")
+        self.category_codes = snapshot.section("catalog.category_codes")
+        self.category_names = list(snapshot.strings("catalog.category_names"))
+        self._category_lookup = {ascii_lower(name): code for code, name in enumerate(self.category_names)}
+        category_positions = snapshot.section("catalog.category_positions")
+        offsets = snapshot.section("catalog.category_offsets")
+        self._category_positions = [category_positions[offsets[code]:offsets[code + 1]]
+                                    for code in range(len(self.category_names))]
+        category_prices = snapshot.section("catalog.category_prices")
+        self._category_prices = [category_prices[offsets[code]:offsets[code + 1]]
+                                 for code in range(len(self.category_names))]
+        in_stock_prices = snapshot.section("catalog.category_in_stock_prices")
+        offsets = snapshot.section("catalog.category_in_stock_offsets")
+        self._category_in_stock_prices = [in_stock_prices[offsets[code]:offsets[code + 1]]
+                                          for code in range(len(self.category_names))]
+        self.names = snapshot.strings("catalog.names")
+        self.descriptions = snapshot.strings("catalog.descriptions")
+        self.image_urls = snapshot.strings("catalog.image_urls")
+        self._sorted_prices = snapshot.section("catalog.sorted_prices")
+        self._price_order = snapshot.section("catalog.price_order")
+        self._columns = self._column_map()
+        self.loaded = True
+
+    def category_code(self, category):
+        """Returns the interned code for a (case-insensitive) category name, or None if unknown."""
+        return self._category_lookup.get(ascii_lower(category))
+
+    def position_of(self, product_id):
+        """Returns the row position of a product id, or None if it isn't in the catalog."""
+        # Rows are kept in id order, so a binary search needs no separate id -> position map.
+        # Ids are usually dense, in which case the id's offset from the first one is its position.
+        ids = self.ids
+        if ids:
+            guess = product_id - ids[0]
+            if 0 <= guess < len(ids) and ids[guess] == product_id:
+                return guess
+        position = bisect.bisect_left(ids, product_id)
+        if position < len(ids) and ids[position] == product_id:
+            return position
+        return None
+
+    def _price_range(self, min_price, max_price):
+        """Returns the row positions whose price lies within [min_price, max_price], in id order."""
+        lo, hi = _price_bounds(self._sorted_prices, min_price, max_price)
+        if lo >= hi:
+            return []
+        return sorted(self._price_order[lo:hi])
+
+    def filter(self, category=None, min_price=None, max_price=None):
+        """Returns the row positions matching all of the given filters, in id order.
+        - category: case-insensitive exact match on the category name.
+        - min_price / max_price: inclusive price bounds.
+        """
+        positions = None
+
+        if category:
+            code = self.category_code(category)
+            if code is None:
+                return []
+            positions = self._category_positions[code]
+
+        if min_price is not None or max_price is not None:
+            if positions is None:
+                positions = self._price_range(min_price, max_price)
+            else:
+                # Category lists are usually small; check bounds row by row instead of intersecting.
+                prices = self.prices
+                positions = [
+                    p for p in positions
+                    if (min_price is None or prices[p] >= min_price)
+                    and (max_price is None or prices[p] <= max_price)
+                ]
+
+        if positions is None:
+            positions = range(len(self.ids))
+
+        return list(positions)
+
+    def narrow(self, product_ids, category=None, min_price=None, max_price=None):
+        """Returns the given product ids, in their order, that match the category and inclusive price
+        bounds (as in filter()). Ids no longer in the catalog are dropped."""
+        code = self.category_code(category) if category else None
+        if category and code is None:
+            return []
+        codes, prices = self.category_codes, self.prices
+        kept = []
+        for product_id in product_ids:
+            p = self.position_of(product_id)
+            if p is None or (category and codes[p] != code):
+                continue
+            if (min_price is None or prices[p] >= min_price) and (max_price is None or prices[p] <= max_price):
+                kept.append(product_id)
+        return kept
+
+    def facets(self, category=None, min_price=None, max_price=None, positions=None, price_edges=None,
+               price_buckets=10):
+        """Counts the products matching the filters per category, per price bucket and by stock:
+        {"total", "categories": [{"category", "count"}], "price": {"min", "max", "buckets": [{"min",
+        "max", "count"}]}, "stock": {"in_stock", "out_of_stock"}}.
+        Category counts apply every filter except `category`, so they show how many products each
+        category offers under the others; the total, price histogram and stock counts apply all of them.
+        - positions: rows already matched by a keyword search (within the price bounds); they are
+          counted in one pass. Without it, every count is a few bisects of the per-category price arrays.
+        - price_edges: ascending bucket edges; by default up to `price_buckets` rounded buckets
+          spanning the matched prices.
+        """
+        selected = self.category_code(category) if category else None
+        if positions is not None:
+            codes, prices, stocks = self.category_codes, self.prices, self.stocks
+            code_counts = [0] * len(self.category_names)
+            matched_prices = []
+            in_stock = 0
+            for p in positions:
+                code = codes[p]
+                code_counts[code] += 1
+                if not category or code == selected:
+                    matched_prices.append(prices[p])
+                    in_stock += stocks[p] > 0
+            matched_prices.sort()
+            return _facet_result(dict(zip(self.category_names, code_counts)), [(matched_prices, 0, len(matched_prices))],
+                                 in_stock, price_edges, price_buckets)
+
+        category_counts, price_ranges, in_stock = {}, [], 0
+        for code, name in enumerate(self.category_names):
+            prices = self._category_prices[code]
+            lo, hi = _price_bounds(prices, min_price, max_price)
+            category_counts[name] = hi - lo
+            if hi > lo and (not category or code == selected):
+                price_ranges.append((prices, lo, hi))
+                in_stock_lo, in_stock_hi = _price_bounds(self._category_in_stock_prices[code], min_price, max_price)
+                in_stock += in_stock_hi - in_stock_lo
+        return _facet_result(category_counts, price_ranges, in_stock, price_edges, price_buckets)
+
+    def row(self, position, fields=None):
+        """Materializes a single row position as a product dictionary, limited to `fields`
+        (column names, in the order given) when they are passed."""
+        if fields is not None:
+            return {field: self.value(field, position) for field in fields}
+        return {
+            "id": self.ids[position],
+            "name": self.names[position],
+            "category": self.category_names[self.category_codes[position]],
+            "price": self.prices[position],
+            "stock": self.stocks[position],
+            "description": self.descriptions[position],
+            "image_url": self.image_urls[position],
+        }
+
+    def value(self, column, position):
+        """Returns one column of a row position, e.g. value("price", 3)."""
+        if column == "category":
+            return self.category_names[self.category_codes[position]]
+        return self._columns[column][position]
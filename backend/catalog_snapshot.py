@@ -0,0 +1,158 @@
+import json
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+
+# File layout: MAGIC, an 8-byte little-endian header length, a JSON header, then the sections it
+# describes, each starting on an 8-byte boundary. Bump SNAPSHOT_FORMAT whenever the layout or the
+# meaning of a section changes; workers ignore snapshots written in another format.
+MAGIC = b"CATSNAP\0"
+SNAPSHOT_FORMAT = 2
+_ALIGNMENT = 8
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is missing, truncated or written in an incompatible format."""
+
+
+class StringTable:
+    """Read-only sequence of strings (or None) stored as one UTF-8 blob plus an offsets array.
+
+    Strings are decoded on access, so a table backed by a memory-mapped snapshot adds no
+    per-process Python objects until its rows are actually read.
+    """
+
+    def __init__(self, offsets, blob, nulls=None):
+        self._offsets = offsets  # len(table) + 1 byte offsets into blob
+        self._blob = blob
+        self._nulls = nulls      # 1 for None entries; omitted when there are none
+
+    @staticmethod
+    def encode(name, strings):
+        """Returns the snapshot sections ({name.offsets, name.blob[, name.nulls]}) for a list of strings."""
+        offsets = array("Q", [0])
+        nulls = array("B")
+        blob = bytearray()
+        for text in strings:
+            nulls.append(text is None)
+            blob += (text or "").encode("utf-8")
+            offsets.append(len(blob))
+        sections = {f"{name}.offsets": offsets, f"{name}.blob": bytes(blob)}
+        if any(nulls):
+            sections[f"{name}.nulls"] = nulls
+        return sections
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if self._nulls is not None and self._nulls[index]:
+            return None
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+def write_snapshot(path, catalog_version, parts):
+    """Writes a snapshot of the given parts (objects with a snapshot_sections() method returning
+    ({name: array or bytes}, {name: JSON-serializable value})) for `catalog_version`.
+    The file is written next to `path` and renamed over it, so processes that already mapped the
+    previous snapshot keep reading it undisturbed. Returns the size of the file in bytes.
+    """
+    sections, meta = {}, {}
+    for part in parts:
+        part_sections, part_meta = part.snapshot_sections()
+        sections.update(part_sections)
+        meta.update(part_meta)
+
+    layout, offset = {}, 0
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else "B"
+        itemsize = data.itemsize if isinstance(data, array) else 1
+        length = len(data) * itemsize
+        layout[name] = {"offset": offset, "length": length, "typecode": typecode, "itemsize": itemsize}
+        offset += length + (-length % _ALIGNMENT)
+
+    header = json.dumps({
+        "format": SNAPSHOT_FORMAT,
+        "catalog_version": catalog_version,
+        "byteorder": sys.byteorder,
+        "meta": meta,
+        "sections": layout,
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % _ALIGNMENT)
+    data_start = len(MAGIC) + 8 + len(header)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".catalog-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+            for name, data in sections.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(data.tobytes() if isinstance(data, array) else data)
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)  # mkstemp creates the file readable by its owner only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return data_start + offset
+
+
+class CatalogSnapshot:
+    """A snapshot file mapped read-only into memory.
+
+    Sections are exposed as typed memoryviews over the mapping, so every worker process that opens
+    the same file shares its pages through the OS page cache instead of holding a private copy.
+    The mapping stays open for as long as any of its views is referenced.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # Empty file
+                raise SnapshotError(f"{path} is not a catalog snapshot") from e
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise SnapshotError(f"{path} is not a catalog snapshot")
+        header_length = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+        data_start = len(MAGIC) + 8 + header_length
+        try:
+            header = json.loads(bytes(buffer[len(MAGIC) + 8:data_start]))
+        except ValueError as e:
+            raise SnapshotError(f"{path} has a corrupt header") from e
+        if header.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError(f"{path} is in snapshot format {header.get('format')}, expected {SNAPSHOT_FORMAT}")
+        if header.get("byteorder") != sys.byteorder:
+            raise SnapshotError(f"{path} was written on a {header.get('byteorder')}-endian machine")
+
+        self.path = path
+        self.catalog_version = header["catalog_version"]
+        self.meta = header["meta"]
+        self.size = len(self._mmap)
+        self._sections = {}
+        for name, section in header["sections"].items():
+            start = data_start + section["offset"]
+            if start + section["length"] > self.size:
+                raise SnapshotError(f"{path} is truncated")
+            if array(section["typecode"]).itemsize != section["itemsize"]:
+                raise SnapshotError(f"{path} section {name} has an incompatible item size")
+            self._sections[name] = buffer[start:start + section["length"]].cast(section["typecode"])
+
+    def section(self, name):
+        """Returns a section as a read-only memoryview of its element type (e.g. "d" for floats)."""
+        try:
+            return self._sections[name]
+        except KeyError:
+            raise SnapshotError(f"{self.path} has no section {name!r}") from None
+
+    def strings(self, name):
+        """Returns the StringTable written to the snapshot with StringTable.encode(name, ...)."""
+        return StringTable(self.section(f"{name}.offsets"), self.section(f"{name}.blob"),
+                           self._sections.get(f"{name}.nulls"))
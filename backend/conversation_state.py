@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class ConversationState:
+    """One user's last /chat query: its parsed intent and, once known, the ids of all its results in
+    rank order (None until a follow-up needed them, or when there were too many to keep)."""
+
+    __slots__ = ("turn", "intent", "product_ids", "catalog_version")
+
+    def __init__(self, turn, intent, product_ids, catalog_version):
+        self.turn = turn                        # Epoch milliseconds of the turn; identifies it in cursors
+        self.intent = intent
+        self.product_ids = product_ids          # array("q") or None
+        self.catalog_version = catalog_version  # The catalog the ids were computed against
+
+
+class ConversationStore:
+    """Per-user conversation state for follow-up queries, held in an LRU with a per-entry TTL.
+
+    Memory is bounded by `max_users` entries and `max_total_ids` stored result ids over all of them
+    (8 bytes each); beyond either limit the least recently used users are dropped. A result set with
+    more than `max_result_ids` ids is not kept at all, only its intent. A `max_users` of 0 disables
+    the store.
+
+    With a `connection` (a zero-argument callable returning a context manager that yields a database
+    connection, as for ChatHistoryWriter), every state is also written to the conversation_state
+    table. A worker then picks up turns taken in other workers (or before a restart): get() compares
+    the stored turn with its own copy, a primary key lookup, and reloads it when they differ.
+    """
+
+    UPSERT_SQL = '''
+        INSERT INTO conversation_state (user_id, turn, intent, product_ids, catalog_version)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            turn = excluded.turn, intent = excluded.intent,
+            product_ids = excluded.product_ids, catalog_version = excluded.catalog_version
+    '''
+
+    def __init__(self, max_users=10000, ttl=1800.0, max_result_ids=5000, max_total_ids=1000000, connection=None):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_result_ids = max_result_ids
+        self.max_total_ids = max_total_ids
+        self._connection = connection
+        self._states = OrderedDict()  # user_id -> ConversationState
+        self._total_ids = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, user_id):
+        """Returns the user's ConversationState, or None if there is none or it has expired."""
+        if not self.max_users:
+            return None
+        oldest_turn = _now_ms() - self.ttl * 1000
+        with self._lock:
+            state = self._states.get(user_id)
+        if self._connection is not None:
+            stored_turn = self._stored_turn(user_id)
+            if stored_turn is None:  # Cleared by another worker (or taken before persistence was enabled)
+                state = None
+            elif state is None or state.turn != stored_turn:
+                state = self._load(user_id)
+                if state is not None:
+                    with self._lock:
+                        self._stats["loads"] += 1
+                        self._insert(user_id, state)
+
+        with self._lock:
+            if state is None:
+                if self._connection is not None and user_id in self._states:
+                    self._remove(user_id)
+                self._stats["misses"] += 1
+                return None
+            if state.turn <= oldest_turn:
+                if self._states.get(user_id) is state:
+                    self._remove(user_id)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            if user_id in self._states:
+                self._states.move_to_end(user_id)
+            self._stats["hits"] += 1
+            return state
+
+    def put(self, user_id, intent, product_ids, catalog_version):
+        """Records a new turn for the user and returns its ConversationState. `product_ids` (an
+        iterable of ints, or None) is dropped if it holds more than max_result_ids ids."""
+        if not self.max_users:
+            return None
+        if product_ids is not None:
+            product_ids = array("q", product_ids)
+            if len(product_ids) > self.max_result_ids:
+                product_ids = None
+        with self._lock:
+            previous = self._states.get(user_id)
+            # Turns are ordered even if two land within the same millisecond
+            turn = max(_now_ms(), previous.turn + 1) if previous is not None else _now_ms()
+            state = ConversationState(turn, dict(intent), product_ids, catalog_version)
+            self._insert(user_id, state)
+        if self._connection is not None:
+            with self._connection() as conn:
+                conn.execute(self.UPSERT_SQL, (
+                    user_id, state.turn, json.dumps(state.intent),
+                    product_ids.tobytes() if product_ids is not None else None, catalog_version,
+                ))
+                conn.commit()
+        return state
+
+    def clear(self, user_id):
+        """Forgets the user's conversation (e.g. on logout)."""
+        with self._lock:
+            if user_id in self._states:
+                self._remove(user_id)
+        if self._connection is not None:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+                conn.commit()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the number of users and result ids held."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._states)
+            stats["result_ids"] = self._total_ids
+        stats["max_users"] = self.max_users
+        stats["max_total_ids"] = self.max_total_ids
+        stats["persistent"] = self._connection is not None
+        return stats
+
+    def _insert(self, user_id, state):
+        # Caller holds the lock
+        if user_id in self._states:
+            self._remove(user_id)
+        self._states[user_id] = state
+        self._total_ids += len(state.product_ids) if state.product_ids is not None else 0
+        while len(self._states) > self.max_users or (self._total_ids > self.max_total_ids and len(self._states) > 1):
+            self._remove(next(iter(self._states)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, user_id):
+        # Caller holds the lock
+        state = self._states.pop(user_id)
+        self._total_ids -= len(state.product_ids) if state.product_ids is not None else 0
+
+    def _stored_turn(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute("SELECT turn FROM conversation_state WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _load(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT turn, intent, product_ids, catalog_version FROM conversation_state WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        if row is None:  # Cleared in the meantime
+            return None
+        turn, intent, product_ids, catalog_version = row
+        if product_ids is not None:
+            ids = array("q")
+            ids.frombytes(product_ids)
+            product_ids = ids
+        return ConversationState(turn, json.loads(intent), product_ids, catalog_version)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool's wait timeout."""
+
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections.
+
+    - At most `max_size` connections exist at once; callers beyond that wait (up to `timeout` seconds).
+    - Idle connections are reused most-recently-used first, which keeps their page and statement caches warm.
+    - A thread that already holds a connection gets the same one back for nested checkouts.
+    - Connections idle for longer than `health_check_interval` are pinged before reuse and replaced if broken.
+    - After a fork (e.g. gunicorn workers), the child discards inherited connections and starts fresh.
+    `connect` is a zero-argument factory returning a configured sqlite3.Connection.
+    """
+
+    def __init__(self, connect, max_size=8, timeout=10.0, health_check_interval=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = []      # stack of (connection, last_used_monotonic)
+        self._size = 0       # connections currently open (idle + checked out)
+        self._local = threading.local()
+        self._stats = {
+            "checkouts": 0,
+            "hits": 0,           # served by an idle connection
+            "misses": 0,         # had to open a new connection
+            "waits": 0,          # had to wait for another request to release one
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+        }
+
+    def _check_fork(self):
+        # Connections must not be shared across processes; a forked child starts with an empty pool.
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def _acquire(self):
+        self._check_fork()
+        start = time.monotonic()
+        waited = False
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._stats["hits"] += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    self._stats["misses"] += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                waited = True
+                self._lock.wait(remaining)
+
+            self._stats["checkouts"] += 1
+            if waited:
+                elapsed = time.monotonic() - start
+                self._stats["waits"] += 1
+                self._stats["wait_time_total"] += elapsed
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], elapsed)
+
+        if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+            conn = self._health_check(conn)
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._discard()
+                raise
+        return conn
+
+    def _health_check(self, conn):
+        """Pings a long-idle connection; returns it if healthy, otherwise closes it and returns None."""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return None
+
+    def _discard(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def _release(self, conn):
+        if os.getpid() != self._pid:
+            return
+        try:
+            # Never hand a connection with an open transaction to the next caller
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the duration of a `with` block and returns it to the pool afterwards."""
+        held = getattr(self._local, "held", None)
+        if held is not None and held[0] == os.getpid():
+            # Nested checkout on the same thread: reuse the connection it already holds
+            yield held[1]
+            return
+
+        conn = self._acquire()
+        self._local.held = (os.getpid(), conn)
+        try:
+            yield conn
+        finally:
+            self._local.held = None
+            self._release(conn)
+
+    def close_all(self):
+        """Closes all idle connections, e.g. at shutdown."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        """Returns a snapshot of pool metrics, including hit rate and average wait time."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"]
+        stats["hit_rate"] = stats["hits"] / checkouts if checkouts else 0.0
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
@@ -0,0 +1,185 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ChatHistoryWriter:
+    """Write-behind queue for chat_history inserts.
+
+    Entries are appended to an in-memory FIFO and written by a single background
+    thread, which groups everything pending into one `executemany` transaction as
+    soon as `batch_size` entries are waiting or `flush_interval` seconds have passed.
+    Because there is a single writer draining a FIFO, entries for a user are stored
+    in the order they were submitted. If a batch fails for any reason other than a
+    (retried) OperationalError, its entries are written one at a time so that only
+    the entries that cannot be stored are dropped and logged.
+
+    When more than `max_pending` entries are waiting, `submit` rejects new entries
+    so callers can shed load instead of growing the queue without bound.
+    `connection` is a zero-argument callable returning a context manager that yields
+    a database connection (e.g. `ConnectionPool.connection`).
+    """
+
+    MAX_RETRIES = 3  # Attempts for a batch that keeps failing with a (usually transient) OperationalError
+
+    INSERT_SQL = '''
+        INSERT INTO chat_history (user_id, message, is_user_message, timestamp, product_ids)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+
+    def __init__(self, connection, batch_size=200, flush_interval=0.05, max_pending=10000):
+        self._connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending = deque()       # (sequence, (user_id, message, is_user_message, timestamp, product_ids))
+        self._next_seq = 0            # sequence number of the next submitted entry
+        self._written_seq = 0         # every entry with a lower sequence number has been written
+        self._last_seq_by_user = {}   # user_id -> sequence number of their latest submitted entry
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self._retries = 0
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "rejected": 0, "failed": 0}
+
+    def _ensure_thread(self):
+        # Started lazily (and restarted after a fork) so pre-forking servers don't inherit a dead thread.
+        if os.getpid() != self._pid:
+            self._reset()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, entries):
+        """Queues (user_id, message, is_user_message, timestamp, product_ids) tuples for writing.
+        All entries are accepted together, or none are: returns False (and queues nothing)
+        if the queue is closed or accepting them would exceed `max_pending`.
+        """
+        with self._cond:
+            self._ensure_thread()
+            if self._closed or len(self._pending) + len(entries) > self.max_pending:
+                self._stats["rejected"] += len(entries)
+                return False
+            for entry in entries:
+                self._pending.append((self._next_seq, entry))
+                self._last_seq_by_user[entry[0]] = self._next_seq
+                self._next_seq += 1
+            self._stats["submitted"] += len(entries)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, user_id=None, timeout=5.0):
+        """Blocks until everything submitted so far (or only `user_id`'s entries) has been written.
+        Returns False if the timeout expired first.
+        """
+        with self._cond:
+            if os.getpid() != self._pid:
+                return True
+            if user_id is None:
+                target = self._next_seq
+            else:
+                target = self._last_seq_by_user.get(user_id, -1) + 1
+            if self._written_seq >= target:
+                return True
+            self._ensure_thread()
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written_seq >= target, timeout)
+
+    def close(self, timeout=10.0):
+        """Stops accepting entries, writes everything still pending and stops the writer thread."""
+        with self._cond:
+            if os.getpid() != self._pid or self._thread is None:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        """Returns queue depth and write counters."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and not self._flush_requested and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._flush_requested = False
+                batch = list(self._pending)
+                self._pending.clear()
+                if not batch and self._closed:
+                    return
+
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        rows = [entry for _, entry in batch]
+        try:
+            with self._connection() as conn:
+                conn.executemany(self.INSERT_SQL, rows)
+                conn.commit()
+        except sqlite3.OperationalError as e:
+            if self._retries < self.MAX_RETRIES:
+                # Usually a transient lock; put the batch back at the front (keeping its order) and retry
+                self._retries += 1
+                logger.warning(f"Retrying chat history batch of {len(rows)} entries: {e}")
+                with self._cond:
+                    self._pending.extendleft(reversed(batch))
+                time.sleep(self.flush_interval)
+                return
+            logger.exception(f"Dropping chat history batch of {len(rows)} entries")
+            with self._cond:
+                self._stats["failed"] += len(rows)
+        except Exception:
+            # Most likely one bad entry (e.g. a value SQLite cannot bind); don't lose the rest of the batch
+            logger.warning(f"Chat history batch of {len(rows)} entries failed; writing its entries one by one")
+            self._write_individually(rows)
+        else:
+            with self._cond:
+                self._stats["written"] += len(rows)
+                self._stats["batches"] += 1
+
+        self._retries = 0
+        with self._cond:
+            self._written_seq = batch[-1][0] + 1
+            self._cond.notify_all()
+
+    def _write_individually(self, rows):
+        written = failed = 0
+        try:
+            with self._connection() as conn:
+                for row in rows:
+                    try:
+                        conn.execute(self.INSERT_SQL, row)
+                    except Exception:
+                        logger.exception(f"Dropping chat history entry for user {row[0]}")
+                        failed += 1
+                    else:
+                        written += 1
+                conn.commit()
+        except Exception:
+            logger.exception(f"Dropping chat history batch of {len(rows)} entries")
+            written, failed = 0, len(rows)
+        with self._cond:
+            self._stats["written"] += written
+            self._stats["failed"] += failed
+            self._stats["batches"] += 1 if written else 0
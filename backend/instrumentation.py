@@ -0,0 +1,185 @@
+import bisect
+import contextvars
+import functools
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_STATEMENT_VERB = re.compile(r"\s*(\w+)")
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql):
+    """Reduces an SQL statement to a low-cardinality label such as "SELECT chat_history"."""
+    verb = _STATEMENT_VERB.match(sql)
+    verb = verb.group(1).upper() if verb else "?"
+    table = _STATEMENT_TABLE.search(sql)
+    return f"{verb} {table.group(1)}" if table and verb != "PRAGMA" else verb
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def metric_lines(name, metric_type, help_text, samples):
+    """Renders one metric family in the Prometheus text format from (labels dict, value) pairs."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+
+class Histogram:
+    """Latency histogram per label set, with cumulative buckets as in the Prometheus data model."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (last one is +Inf), sum of observations]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = ",".join(f'{key}="{_escape_label(val)}"' for key, val in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Instrumentation:
+    """Per-request stage timings and latency histograms for routes, stages and SQL statements.
+
+    A request is bracketed by start_request() / finish_request(). In between, `span(stage)`
+    blocks add their elapsed time to the request's total for that stage (a stage may be entered
+    several times). SQL run through connections of `connection_class` is timed as well and
+    counted in the "sql" stage, which therefore overlaps the stages that issue the queries.
+    The hot path is a perf_counter() pair and a dict update per span, plus a short lock per
+    histogram observation when the request finishes.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, slow_sql_seconds=0.1):
+        self.enabled = enabled
+        self.slow_sql_seconds = slow_sql_seconds
+        self.request_duration = Histogram(
+            "chatbot_request_duration_seconds", "Request latency by route.", ("method", "route", "status"), buckets)
+        self.stage_duration = Histogram(
+            "chatbot_stage_duration_seconds", "Time per request spent in each stage.", ("route", "stage"), buckets)
+        self.sql_duration = Histogram(
+            "chatbot_sql_duration_seconds", "SQLite call latency by statement.", ("statement", "phase"), buckets)
+        self._stages = contextvars.ContextVar("request_stages", default=None)
+        self.connection_class = _traced_connection_class(self) if enabled else sqlite3.Connection
+
+    def start_request(self):
+        if self.enabled:
+            self._stages.set({})
+
+    def finish_request(self, method, route, status, seconds):
+        """Records the finished request and returns its {stage: seconds} totals."""
+        stages = self._stages.get()
+        self._stages.set(None)
+        if stages is None:
+            return {}
+        self.request_duration.observe((method, route, f"{status // 100}xx"), seconds)
+        for stage, stage_seconds in stages.items():
+            self.stage_duration.observe((route, stage), stage_seconds)
+        return stages
+
+    @contextmanager
+    def span(self, stage):
+        """Times the enclosed block as part of `stage` of the current request (no-op outside a request)."""
+        stages = self._stages.get()
+        if stages is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+
+    def observe_sql(self, sql, phase, seconds):
+        self.sql_duration.observe((statement_label(sql), phase), seconds)
+        stages = self._stages.get()
+        if stages is not None:
+            stages["sql"] = stages.get("sql", 0.0) + seconds
+        if phase == "execute" and seconds >= self.slow_sql_seconds:
+            logger.warning("Slow SQL (%.1f ms): %s", seconds * 1000, " ".join(sql.split())[:300])
+
+    def render(self):
+        """Returns the histograms in the Prometheus text format, as a list of lines."""
+        return self.request_duration.render() + self.stage_duration.render() + self.sql_duration.render()
+
+
+def _traced_connection_class(instrumentation):
+    """Builds sqlite3.Connection/Cursor subclasses that report the time of every execute and fetch
+    to `instrumentation` (sqlite3's own trace callback reports statements but not their duration).
+    Row-by-row iteration over a cursor is left untimed to keep it at C speed."""
+
+    def timed(method, phase):
+        def wrapper(self, *args):
+            start = time.perf_counter()
+            try:
+                return method(self, *args)
+            finally:
+                instrumentation.observe_sql(self.traced_sql, phase, time.perf_counter() - start)
+        return wrapper
+
+    class TracedCursor(sqlite3.Cursor):
+        traced_sql = ""
+        _execute = timed(sqlite3.Cursor.execute, "execute")
+        _executemany = timed(sqlite3.Cursor.executemany, "execute")
+
+        def execute(self, sql, parameters=()):
+            self.traced_sql = sql
+            return self._execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            self.traced_sql = sql
+            return self._executemany(sql, seq_of_parameters)
+
+        fetchone = timed(sqlite3.Cursor.fetchone, "fetch")
+        fetchmany = timed(sqlite3.Cursor.fetchmany, "fetch")
+        fetchall = timed(sqlite3.Cursor.fetchall, "fetch")
+
+    class TracedConnection(sqlite3.Connection):
+        def cursor(self, factory=TracedCursor):
+            return super().cursor(factory)
+
+        # Connection.execute doesn't go through cursor(), so these create a traced cursor themselves
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+    return TracedConnection
@@ -0,0 +1,217 @@
+import logging
+import math
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Category terms mapped to the canonical category names used in the products table
+CATEGORY_TERMS = {
+    "electronics": "Electronics",
+    "laptop": "Electronics", "laptops": "Electronics",
+    "mobile": "Electronics", "mobiles": "Electronics",
+    "phone": "Electronics", "phones": "Electronics",
+    "headphones": "Electronics",
+    "book": "Books", "books": "Books",
+    "clothing": "Clothing", "clothes": "Clothing",
+    "home": "Home & Kitchen", "kitchen": "Home & Kitchen",
+    "sports": "Sports",
+    "toys": "Toys",
+}
+
+STOPWORDS = frozenset([
+    "show", "me", "find", "i'm", "looking", "for", "a", "an", "the", "is", "are", "of", "in", "on", "at",
+    "under", "over", "below", "above", "between", "and", "can", "you", "please", "display", "what", "whats",
+    "any", "some", "about",
+    # Connectives of the price grammar below, which are meaningless as search keywords
+    "to", "from", "than", "up", "within", "less", "more", "least", "most", "max", "min", "with",
+    "i", "want", "need", "there",
+    # Pronouns and fillers of follow-ups ("cheaper ones", "just those") that don't make one on their own
+    "just", "those", "these", "them", "ones", "one",
+])
+
+PRICE_WORDS = frozenset([
+    "price", "cost", "budget", "range", "k", "thousand", "dollar", "dollars", "rupee", "rupees",
+    "rs", "rs.", "inr", "lakh", "lakhs", "lac", "lacs", "crore", "crores",
+])
+
+# Multipliers for amount suffixes ("50k", "1.5 lakh", "2cr")
+_UNIT_MULTIPLIERS = {
+    "k": 1_000, "thousand": 1_000,
+    "l": 100_000, "lac": 100_000, "lacs": 100_000, "lakh": 100_000, "lakhs": 100_000,
+    "cr": 10_000_000, "crore": 10_000_000, "crores": 10_000_000,
+}
+# Units that may also appear as a separate word after the number ("1.5 lakh", "50 k")
+_SEPARATE_UNITS = frozenset(["k", "thousand", "lac", "lacs", "lakh", "lakhs", "crore", "crores"])
+
+# Price operators; two-word forms ("less than") are matched as (first word, second word)
+_MAX_OPERATORS = frozenset(["under", "below", "upto", "within", "max", "maximum", "<", "<="])
+_MIN_OPERATORS = frozenset(["over", "above", "min", "minimum", ">", ">="])
+_TWO_WORD_OPERATORS = {
+    ("less", "than"): "max", ("cheaper", "than"): "max", ("lower", "than"): "max",
+    ("up", "to"): "max", ("at", "most"): "max",
+    ("more", "than"): "min", ("greater", "than"): "min", ("at", "least"): "min",
+    ("starting", "at"): "min", ("starting", "from"): "min",
+}
+_RANGE_CONNECTORS = frozenset(["to", "and", "-", "–"])
+
+# Words that make a message a follow-up to the previous one ("only under 20k", "cheaper ones"):
+# "narrow" restricts the previous results, "cheaper" / "pricier" keep the lower / upper half of their prices
+REFINEMENT_TERMS = {"only": "narrow", "cheaper": "cheaper", "pricier": "pricier", "costlier": "pricier"}
+_TWO_WORD_REFINEMENTS = {
+    ("less", "expensive"): "cheaper", ("lower", "priced"): "cheaper",
+    ("more", "expensive"): "pricier", ("higher", "priced"): "pricier",
+}
+
+# Every word the parser treats specially, resolved with a single dict lookup per word
+_WORD_KINDS = {}
+_WORD_KINDS.update((word, "stop") for word in STOPWORDS)
+_WORD_KINDS.update((word, "price") for word in PRICE_WORDS)
+_WORD_KINDS.update((word, "max") for word in _MAX_OPERATORS)
+_WORD_KINDS.update((word, "min") for word in _MIN_OPERATORS)
+_WORD_KINDS.update((word, "category") for word in CATEGORY_TERMS)
+_WORD_KINDS.update((word, "refine") for word in REFINEMENT_TERMS)
+# First words of the two-word forms, so other words skip building a (word, next word) key
+_TWO_WORD_STARTS = frozenset(first for first, _ in list(_TWO_WORD_OPERATORS) + list(_TWO_WORD_REFINEMENTS))
+
+_AMOUNT = r"(?:₹|rs\.?|inr|\$)?(\d[\d,]*(?:\.\d+)?)(k|l|lacs?|lakhs?|cr|crores?|thousand)?"
+_AMOUNT_RE = re.compile(_AMOUNT)
+_RANGE_RE = re.compile(_AMOUNT + r"[-–]" + _AMOUNT)
+
+# Punctuation stripped from the ends of words ("headphones?" -> "headphones"); inner hyphens/apostrophes stay
+_WORD_EDGE_PUNCTUATION = "?!.,;:\"'()[]{}"
+
+# Words that can start an amount: a digit or a currency sign/prefix
+_AMOUNT_START = frozenset("0123456789₹$ri")
+
+INTENT_CACHE_SIZE = 4096
+
+
+def _amount(word, next_word):
+    """Parses an amount word ("₹50,000", "50k", "1.5") into a float, applying a unit given as the
+    following word ("1.5 lakh"). Returns (value, consumed_next_word), or (None, False) if not an amount
+    (including numbers too large to be finite, which would serialize as invalid JSON).
+    """
+    match = _AMOUNT_RE.fullmatch(word)
+    if match is None:
+        return None, False
+    number, unit = match.groups()
+    consumed = not unit and next_word in _SEPARATE_UNITS
+    value = _number(number, unit or (next_word if consumed else None))
+    if value is None:
+        return None, False
+    return value, consumed
+
+
+def _number(number, unit):
+    """Converts a matched number and optional unit to a float, or None if it isn't finite."""
+    value = float(number.replace(",", "")) * _UNIT_MULTIPLIERS.get(unit, 1)
+    return value if math.isfinite(value) else None
+
+
+@lru_cache(maxsize=INTENT_CACHE_SIZE)
+def _parse_normalized(message):
+    """Parses an already lowercased, whitespace-normalized message in one left-to-right pass.
+    Returns an immutable (category, min_price, max_price, keywords, refinement) tuple so cached results
+    can't be mutated.
+    """
+    category = None
+    min_price = max_price = None
+    refinement = None
+    pending = None  # "min" or "max" after a price operator, until an amount (or a real keyword) follows
+    keywords = []
+
+    words = [word.strip(_WORD_EDGE_PUNCTUATION) for word in message.split(" ")]
+    count = len(words)
+    i = 0
+    while i < count:
+        word = words[i]
+        i += 1
+        if not word:
+            continue
+        next_word = words[i] if i < count else None
+
+        if next_word and word in _TWO_WORD_STARTS:
+            operator = _TWO_WORD_OPERATORS.get((word, next_word))
+            if operator:
+                pending = operator
+                i += 1
+                continue
+            two_word_refinement = _TWO_WORD_REFINEMENTS.get((word, next_word))
+            if two_word_refinement:
+                refinement = two_word_refinement
+                i += 1
+                continue
+
+        kind = _WORD_KINDS.get(word)
+        if kind is None and word[0] in _AMOUNT_START:
+            value, consumed = _amount(word, next_word)
+            if value is not None:
+                i += consumed
+                # "10k to 20k" / "between 10k and 20k": a range spread over three words
+                if i + 1 < count and words[i] in _RANGE_CONNECTORS:
+                    high, high_consumed = _amount(words[i + 1], words[i + 2] if i + 2 < count else None)
+                    if high is not None:
+                        i += 2 + high_consumed
+                        if min_price is None and max_price is None:
+                            min_price, max_price = min(value, high), max(value, high)
+                        pending = None
+                        continue
+                # A bare number (e.g. "model 559") isn't a price and isn't a useful keyword either
+                if pending == "max" and max_price is None:
+                    max_price = value
+                elif pending == "min" and min_price is None:
+                    min_price = value
+                pending = None
+                continue
+            match = _RANGE_RE.fullmatch(word)  # "50k-80k"
+            if match is not None:
+                low_number, low_unit, high_number, high_unit = match.groups()
+                low, high = _number(low_number, low_unit), _number(high_number, high_unit)
+                if low is not None and high is not None and min_price is None and max_price is None:
+                    min_price, max_price = min(low, high), max(low, high)
+                pending = None
+                continue
+
+        if kind == "max" or kind == "min":
+            pending = kind
+        elif kind == "category":
+            if category is None:
+                category = CATEGORY_TERMS[word] # Use the first recognized category term
+        elif kind == "refine":
+            # A price direction ("cheaper") wins over a plain "only"
+            if refinement is None or refinement == "narrow":
+                refinement = REFINEMENT_TERMS[word]
+        elif kind is None and not word.isdigit() and word not in keywords:
+            keywords.append(word)
+            pending = None
+
+    return category, min_price, max_price, tuple(keywords), refinement
+
+
+@lru_cache(maxsize=INTENT_CACHE_SIZE)
+def _parse_message(message):
+    """Memoizes on the raw message, so exact repeats skip even the normalization step;
+    differently cased/spaced variants still share the normalized cache entry."""
+    return _parse_normalized(" ".join(message.lower().split()))
+
+
+def parse_chat_intent(message):
+    """
+    Analyzes the user's message to extract a product category, price constraints
+    and general keywords, in a single pass driven by precompiled lookup tables.
+    Understands price phrases such as "under 50k", "above ₹1,500", "between 10k and 20k",
+    "50k-80k" and "under 1.5 lakh". Results are memoized per message.
+    Returns {"category", "min_price", "max_price", "keywords", "refinement"}, where "refinement" is
+    None, or "narrow", "cheaper" or "pricier" for follow-ups such as "only blue ones" or "cheaper ones".
+    """
+    category, min_price, max_price, keywords, refinement = _parse_message(message)
+    intent = {"category": category, "min_price": min_price, "max_price": max_price, "keywords": list(keywords),
+              "refinement": refinement}
+    logger.debug("Parsed intent: %s from message: '%s'", intent, message)
+    return intent
+
+
+def intent_cache_info():
+    """Exposes the memoization cache statistics (hits, misses, maxsize, currsize) for raw messages."""
+    return _parse_message.cache_info()
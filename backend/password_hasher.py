@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full, a hash doesn't finish within the timeout, or the
+    worker processes keep dying."""
+
+
+class PasswordHasher:
+    """Runs Werkzeug password hashing and verification in a dedicated process pool.
+
+    Hashing is deliberately CPU-heavy; doing it in separate processes keeps a burst of
+    logins from starving request threads of the GIL. At most `max_pending` operations may
+    be queued or running at once; beyond that `hash`/`verify` raise HasherBusy immediately
+    instead of letting the backlog (and every caller's latency) grow. If a worker process dies
+    (e.g. killed by the OOM killer) the pool is replaced and the operation retried once.
+    `method` is a Werkzeug hash method string such as "scrypt:32768:8:1" or "pbkdf2:sha256:600000";
+    stored hashes made with a different method are reported by `needs_rehash`.
+    """
+
+    LATENCY_SAMPLES = 1024  # Recent operations kept for latency percentiles
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, max_pending=32, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._method_prefix = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._stats = {"hashed": 0, "verified": 0, "rejected": 0, "timeouts": 0, "pool_restarts": 0, "max_pending_seen": 0}
+
+    def _get_executor(self):
+        # Created on first use (and again in a forked child, after _run resets the state it inherited).
+        # Workers are spawned rather than forked so they never inherit locks held by this process's threads.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _run(self, stat, fn, *args):
+        if os.getpid() != self._pid:
+            self._reset()  # A parent's process pool can't be used after fork
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise HasherBusy(f"{self._pending} password hashing operations already queued")
+            self._pending += 1
+            self._stats["max_pending_seen"] = max(self._stats["max_pending_seen"], self._pending)
+        start = time.perf_counter()
+        try:
+            for _ in range(2):  # A crashed pool is replaced and the operation retried once
+                try:
+                    future = executor.submit(fn, *args)
+                    return future.result(timeout=self.timeout)
+                except FutureTimeout:
+                    future.cancel()
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise HasherBusy(f"Password hashing took longer than {self.timeout}s")
+                except BrokenProcessPool:
+                    executor = self._replace_executor(executor)
+            raise HasherBusy("Password hashing worker processes crashed")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._stats[stat] += 1
+                self._latencies.append(time.perf_counter() - start)
+
+    def _replace_executor(self, broken):
+        # A broken pool rejects every later submit; swap in a new one unless another thread already has
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._stats["pool_restarts"] += 1
+            return self._get_executor()
+
+    def hash(self, password):
+        """Returns a new hash of `password` using the configured method."""
+        return self._run("hashed", generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Checks `password` against a stored hash (of any method Werkzeug understands)."""
+        return self._run("verified", check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if `password_hash` was made with a different method or cost than the configured one."""
+        if self._method_prefix is None:
+            # Werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"); hash once to learn the full form
+            self._method_prefix = self.hash("").split("$", 1)[0]
+        return password_hash.split("$", 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        """Stops the worker processes, e.g. at exit."""
+        if self._executor is not None and os.getpid() == self._pid:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Returns queue depth, operation counters and latency (queue wait + hashing) percentiles in ms."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+            stats["max_pending"] = self.max_pending
+            latencies = sorted(self._latencies)
+        for label, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            value = latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0.0
+            stats[f"latency_{label}_ms"] = value * 1000
+        stats["latency_max_ms"] = latencies[-1] * 1000 if latencies else 0.0
+        return stats
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Per-key token bucket: each key may make `burst` attempts at once, refilled at `per_minute` a minute.
+
+    Buckets are kept in memory per worker process. Only the `max_keys` most recently used
+    keys are tracked; an evicted key simply starts again with a full bucket.
+    """
+
+    def __init__(self, per_minute=10, burst=5, max_keys=100000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last_refill_monotonic)
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "throttled": 0}
+
+    def hit(self, key):
+        """Takes one token for `key`. Returns 0 if the attempt is allowed, otherwise the number
+        of seconds until a token becomes available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+                self._stats["allowed"] += 1
+            else:
+                retry_after = (1 - tokens) / self.rate
+                self._stats["throttled"] += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def stats(self):
+        """Returns allowed/throttled counters and the number of tracked keys."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked_keys"] = len(self._buckets)
+        return stats
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # Optional: without the brotli package responses are only gzip-compressed
+    brotli = None
+
+# Content types worth compressing (JSON API responses, the streamed chat formats and /metrics)
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/event-stream", "text/plain"}
+
+
+def body_etag(data):
+    """Returns an ETag value for a response body (a short content hash)."""
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+class ResponseCompressor:
+    """Compresses response bodies with brotli (when installed) or gzip, whichever the client prefers.
+
+    Bodies smaller than `min_size` bytes are sent as they are. Compressed copies of bodies that
+    have an ETag are kept in a small LRU cache (`cache_size` entries), so repeated GETs for the
+    same cached result don't compress it again. Streamed bodies are compressed chunk by chunk,
+    flushing after each chunk so the client still receives every event as soon as it is sent.
+    """
+
+    def __init__(self, min_size=500, gzip_level=6, brotli_quality=5, cache_size=256):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_size = cache_size
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+        self._cache = OrderedDict()  # (etag, encoding) -> compressed bytes
+        self._lock = threading.Lock()
+        self._stats = {"compressed": 0, "streamed": 0, "cache_hits": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def choose(self, accept_encodings, mimetype, size=None):
+        """Returns the encoding to use ("br" or "gzip") for a response, or None to send it uncompressed.
+        `accept_encodings` is the request's parsed Accept-Encoding header; `size` is None for streamed bodies.
+        """
+        if mimetype not in COMPRESSIBLE_MIMETYPES or (size is not None and size < self.min_size):
+            return None
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data, encoding, etag=None):
+        """Returns `data` compressed with `encoding`, reusing the cached copy for a known `etag`."""
+        key = (etag, encoding)
+        if etag is not None:
+            with self._lock:
+                compressed = self._cache.get(key)
+                if compressed is not None:
+                    self._cache.move_to_end(key)
+                    self._stats["cache_hits"] += 1
+                    return compressed
+
+        if encoding == "br":
+            compressed = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+            compressed = compressor.compress(data) + compressor.flush()
+
+        with self._lock:
+            self._stats["compressed"] += 1
+            self._stats["bytes_in"] += len(data)
+            self._stats["bytes_out"] += len(compressed)
+            if etag is not None and self.cache_size > 0:
+                self._cache[key] = compressed
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return compressed
+
+    def compress_stream(self, chunks, encoding):
+        """Wraps an iterable of body chunks (str or bytes) in a generator of compressed chunks."""
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            process, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            process, finish = compressor.compress, compressor.flush
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        with self._lock:
+            self._stats["streamed"] += 1
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if chunk:
+                    yield process(chunk) + flush()
+            yield finish()
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def stats(self):
+        """Returns compression counters, the overall compression ratio and the compressed-copy cache size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cache_size"] = len(self._cache)
+        stats["encodings"] = list(self.encodings)
+        stats["ratio"] = stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else None
+        return stats
@@ -0,0 +1,232 @@
+import bisect
+import math
+import re
+from array import array
+from collections import defaultdict
+
+from catalog_snapshot import StringTable
+
+# Tokens are runs of ASCII letters/digits; everything else (spaces, punctuation, hyphens) separates them.
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Splits text into lowercase alphanumeric tokens."""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+class KeywordIndex:
+    """Token-level inverted index over product names and descriptions with BM25 ranking.
+
+    Each product is indexed as a single document in which name tokens count
+    NAME_WEIGHT times as much as description tokens. A sorted vocabulary allows
+    query terms to match as prefixes ("lap" -> "laptop"); prefix expansions score
+    slightly below exact token matches. Products can be added, updated or removed
+    individually so the index stays in sync with writes to the products table.
+
+    An index can also be mapped from a catalog snapshot (load_snapshot), in which case its postings
+    are read straight from the shared mapping; the first add/update/remove copies them into
+    process memory. Modifying an index others are reading isn't safe; modify a copy() instead.
+    """
+
+    NAME_WEIGHT = 2.0
+    PREFIX_PENALTY = 0.8  # Score multiplier for tokens matched by prefix rather than exactly
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._postings = defaultdict(dict)  # token -> {product_id: weighted term frequency}
+        self._doc_terms = {}                # product_id -> {token: weighted term frequency}
+        self._doc_lengths = {}              # product_id -> weighted document length
+        self._vocabulary = []               # sorted list of tokens, for prefix lookups
+        self._total_length = 0.0
+        self._mapped = None                 # snapshot sections while the index is snapshot-backed
+
+    def __len__(self):
+        return len(self._doc_terms) if self._mapped is None else len(self._mapped["doc_ids"])
+
+    def build(self, conn):
+        """Rebuilds the whole index from the `products` table using the given connection."""
+        self.__init__()
+        for product_id, name, description in conn.execute("SELECT id, name, description FROM products"):
+            self._index(product_id, name, description)
+        self._vocabulary = sorted(self._postings)
+
+    def snapshot_sections(self):
+        """Returns the index as snapshot sections (see catalog_snapshot.write_snapshot): the sorted
+        vocabulary, and per token a slice of the posting arrays (product id, weighted term frequency
+        and the product's document length, stored with each posting so scoring needs no lookups)."""
+        posting_offsets = array("Q", [0])
+        posting_ids, posting_frequencies, posting_lengths = array("q"), array("d"), array("d")
+        for token in self._vocabulary:
+            for product_id, frequency in self._postings[token].items():
+                posting_ids.append(product_id)
+                posting_frequencies.append(frequency)
+                posting_lengths.append(self._doc_lengths[product_id])
+            posting_offsets.append(len(posting_ids))
+        sections = StringTable.encode("index.vocabulary", self._vocabulary)
+        sections.update({
+            "index.posting_offsets": posting_offsets,
+            "index.posting_ids": posting_ids,
+            "index.posting_frequencies": posting_frequencies,
+            "index.posting_lengths": posting_lengths,
+            "index.doc_ids": array("q", self._doc_lengths),
+            "index.doc_lengths": array("d", self._doc_lengths.values()),
+        })
+        return sections, {"index.total_length": self._total_length}
+
+    def load_snapshot(self, snapshot):
+        """Replaces the index with the one stored in a mapped CatalogSnapshot."""
+        self.__init__()
+        self._vocabulary = snapshot.strings("index.vocabulary")
+        self._total_length = snapshot.meta["index.total_length"]
+        self._mapped = {name: snapshot.section(f"index.{name}") for name in (
+            "posting_offsets", "posting_ids", "posting_frequencies", "posting_lengths", "doc_ids", "doc_lengths")}
+
+    def _unmap(self):
+        """Copies a snapshot-backed index into the in-memory dicts so it can be modified."""
+        mapped, vocabulary = self._mapped, self._vocabulary
+        self.__init__()
+        for product_id, length in zip(mapped["doc_ids"], mapped["doc_lengths"]):
+            self._doc_terms[product_id] = {}
+            self._doc_lengths[product_id] = length
+            self._total_length += length
+        offsets = mapped["posting_offsets"]
+        for i in range(len(vocabulary)):
+            token = vocabulary[i]
+            postings = self._postings[token]
+            for position in range(offsets[i], offsets[i + 1]):
+                product_id, frequency = mapped["posting_ids"][position], mapped["posting_frequencies"][position]
+                postings[product_id] = frequency
+                self._doc_terms[product_id][token] = frequency
+        self._vocabulary = list(vocabulary)
+
+    def copy(self):
+        """Returns an independent copy that can be modified while this index keeps being read.
+        A snapshot-backed index shares the (read-only) mapping until the copy is first modified."""
+        index = KeywordIndex()
+        if self._mapped is not None:
+            index._mapped, index._vocabulary = self._mapped, self._vocabulary
+        else:
+            for token, postings in self._postings.items():
+                index._postings[token] = dict(postings)
+            index._doc_terms = dict(self._doc_terms)  # Per-document dicts are replaced, never changed
+            index._doc_lengths = dict(self._doc_lengths)
+            index._vocabulary = list(self._vocabulary)
+        index._total_length = self._total_length
+        return index
+
+    def add_or_update(self, product_id, name, description):
+        """Indexes a newly inserted product, or re-indexes an updated one."""
+        self.remove(product_id)
+        for token in self._index(product_id, name, description):
+            if len(self._postings[token]) == 1:  # First document containing this token
+                bisect.insort(self._vocabulary, token)
+
+    def remove(self, product_id):
+        """Drops a product from the index (no-op if it isn't indexed)."""
+        if self._mapped is not None:
+            self._unmap()  # add_or_update() starts here too
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(product_id)
+        for token in terms:
+            postings = self._postings[token]
+            del postings[product_id]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+    def _index(self, product_id, name, description):
+        terms = defaultdict(float)
+        for token in tokenize(name):
+            terms[token] += self.NAME_WEIGHT
+        for token in tokenize(description):
+            terms[token] += 1.0
+        for token, frequency in terms.items():
+            self._postings[token][product_id] = frequency
+        length = sum(terms.values())
+        self._doc_terms[product_id] = dict(terms)
+        self._doc_lengths[product_id] = length
+        self._total_length += length
+        return terms
+
+    def _has_token(self, token):
+        if self._mapped is None:
+            return token in self._postings
+        i = bisect.bisect_left(self._vocabulary, token)
+        return i < len(self._vocabulary) and self._vocabulary[i] == token
+
+    def _postings_of(self, token):
+        """Returns (document frequency, iterable of (product_id, frequency, document length)) for a token."""
+        if self._mapped is None:
+            postings, lengths = self._postings[token], self._doc_lengths
+            return len(postings), ((product_id, frequency, lengths[product_id])
+                                   for product_id, frequency in postings.items())
+        mapped = self._mapped
+        i = bisect.bisect_left(self._vocabulary, token)
+        start, end = mapped["posting_offsets"][i], mapped["posting_offsets"][i + 1]
+        return end - start, zip(mapped["posting_ids"][start:end], mapped["posting_frequencies"][start:end],
+                                mapped["posting_lengths"][start:end])
+
+    def _expand(self, term, prefix):
+        """Yields (token, multiplier) pairs for the vocabulary tokens a query term matches."""
+        if self._has_token(term):
+            yield term, 1.0
+        if not prefix:
+            return
+        i = bisect.bisect_right(self._vocabulary, term)
+        while i < len(self._vocabulary) and self._vocabulary[i].startswith(term):
+            yield self._vocabulary[i], self.PREFIX_PENALTY
+            i += 1
+
+    def matches(self, query_terms, candidates=None, prefix=True):
+        """Returns the set of product ids that search() would rank, without scoring them."""
+        matched = set()
+        for raw in query_terms:
+            for term in tokenize(raw):
+                for token, _ in self._expand(term, prefix):
+                    if self._mapped is None:
+                        matched.update(self._postings[token])
+                    else:
+                        i = bisect.bisect_left(self._vocabulary, token)
+                        offsets = self._mapped["posting_offsets"]
+                        matched.update(self._mapped["posting_ids"][offsets[i]:offsets[i + 1]])
+        return matched if candidates is None else matched & candidates
+
+    def search(self, query_terms, candidates=None, limit=None, prefix=True):
+        """Ranks products matching ANY of the query terms by BM25 relevance.
+
+        query_terms: raw strings; each is tokenized, so "eco-friendly" searches "eco" and "friendly".
+        candidates: optional set of product ids to restrict results to (e.g. category/price matches).
+        limit: maximum number of results to return (None for all).
+        Returns a list of (product_id, score) ordered by descending score, then ascending id.
+        """
+        tokens = []
+        for raw in query_terms:
+            tokens.extend(tokenize(raw))
+        doc_count = len(self)
+        if not tokens or not doc_count:
+            return []
+
+        average_length = self._total_length / doc_count
+        scores = defaultdict(float)
+        for term in dict.fromkeys(tokens):  # De-duplicate while keeping order
+            # A document matched by several expansions of the same term only counts its best one.
+            best = {}
+            for token, multiplier in self._expand(term, prefix):
+                document_frequency, postings = self._postings_of(token)
+                idf = math.log(1.0 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+                for product_id, frequency, length in postings:
+                    if candidates is not None and product_id not in candidates:
+                        continue
+                    norm = self.K1 * (1.0 - self.B + self.B * length / average_length)
+                    score = multiplier * idf * frequency * (self.K1 + 1.0) / (frequency + norm)
+                    if score > best.get(product_id, 0.0):
+                        best[product_id] = score
+            for product_id, score in best.items():
+                scores[product_id] += score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if limit is None else ranked[:limit]
@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+TokenClaims = namedtuple("TokenClaims", ["user_id", "token_id", "expires_at"])
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class SessionTokens:
+    """Stateless HMAC-SHA256 session tokens: "<key id>.<user id>.<expires at>.<token id>.<signature>".
+
+    Any process holding the signing keys can verify a token without a database lookup.
+    Several keys may be configured at once for rotation: new tokens are signed with
+    `signing_kid` while tokens signed with the other keys stay valid until they expire.
+    Revoked token ids are kept in memory until their tokens would have expired anyway.
+    Successfully verified tokens are remembered in a small LRU cache, so repeat requests
+    skip the HMAC computation; expiry and revocation are still checked on every call.
+    """
+
+    def __init__(self, ttl=86400, cache_size=10000):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._keys = {}             # key id -> secret bytes
+        self._signing_kid = None
+        self._revoked = {}          # token id -> expires_at (epoch seconds)
+        self._cache = OrderedDict()  # token -> TokenClaims
+        self._lock = threading.Lock()
+        self._stats = {"issued": 0, "verified": 0, "cache_hits": 0, "rejected": 0}
+
+    def set_keys(self, keys, signing_kid):
+        """Replaces the key set ({key id: secret bytes}); `signing_kid` signs new tokens."""
+        if signing_kid not in keys:
+            raise ValueError(f"Signing key {signing_kid!r} is not among the configured keys")
+        with self._lock:
+            if keys != self._keys:
+                self._cache.clear()  # A removed key must stop validating cached tokens
+            self._keys = dict(keys)
+            self._signing_kid = signing_kid
+
+    def _sign(self, key, payload):
+        return _b64(hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, user_id):
+        """Returns a new (token, expires_at) pair for `user_id`; expires_at is in epoch seconds."""
+        with self._lock:
+            kid, key = self._signing_kid, self._keys[self._signing_kid]
+            self._stats["issued"] += 1
+        expires_at = int(time.time()) + self.ttl
+        payload = f"{kid}.{int(user_id)}.{expires_at}.{secrets.token_urlsafe(9)}"
+        return f"{payload}.{self._sign(key, payload)}", expires_at
+
+    def verify(self, token):
+        """Returns the token's TokenClaims if it is authentic, unexpired and not revoked, else None."""
+        now = time.time()
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                self._cache.move_to_end(token)
+                self._stats["cache_hits"] += 1
+            key = None
+            if claims is None:
+                kid = token.split(".", 1)[0]
+                key = self._keys.get(kid)
+
+        if claims is None:
+            parts = token.split(".")
+            # Tokens are pure ASCII; anything else can't be signed for comparison and isn't ours anyway
+            if key is None or len(parts) != 5 or not token.isascii():
+                return self._reject()
+            payload, signature = token.rsplit(".", 1)
+            if not hmac.compare_digest(signature, self._sign(key, payload)):
+                return self._reject()
+            try:
+                claims = TokenClaims(int(parts[1]), parts[3], int(parts[2]))
+            except ValueError:
+                return self._reject()
+
+        with self._lock:
+            if claims.expires_at <= now or claims.token_id in self._revoked:
+                self._cache.pop(token, None)
+                self._stats["rejected"] += 1
+                return None
+            self._stats["verified"] += 1
+            if token not in self._cache:
+                self._cache[token] = claims
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+    def _reject(self):
+        with self._lock:
+            self._stats["rejected"] += 1
+        return None
+
+    def revoke(self, token_id, expires_at):
+        """Marks a token id as revoked until `expires_at`."""
+        with self._lock:
+            self._revoked[token_id] = expires_at
+
+    def prune_revoked(self):
+        """Forgets revocations of tokens that have expired anyway."""
+        now = time.time()
+        with self._lock:
+            self._revoked = {token_id: exp for token_id, exp in self._revoked.items() if exp > now}
+
+    def stats(self):
+        """Returns issue/verify counters plus key, revocation and cache sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._keys)
+            stats["signing_kid"] = self._signing_kid
+            stats["revoked"] = len(self._revoked)
+            stats["cache_size"] = len(self._cache)
+        return stats
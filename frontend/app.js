@@ -43,7 +43,7 @@ document.addEventListener('DOMContentLoaded', () => {
     function switchToChatPage(userData) {
         currentUserId = userData.user_id;
         currentUsername = userData.username;
-        sessionToken = userData.token; // Assuming token is returned on login
+        sessionToken = userData.token; // Sent as a Bearer token on every authenticated request
 
         localStorage.setItem('chatbot_user_id', currentUserId);
         localStorage.setItem('chatbot_username', currentUsername);
@@ -111,13 +111,17 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    async function saveChatMessage(userId, messageText, isUserMessage, timestamp) {
+    // The backend identifies the user from the session token, not from a user_id in the request
+    function authHeaders(headers = {}) {
+        return { ...headers, 'Authorization': `Bearer ${sessionToken}` };
+    }
+
+    async function saveChatMessage(messageText, isUserMessage, timestamp) {
         try {
             const response = await fetch(`${apiUrl}/chat/history`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({
-                    user_id: userId,
                     message: messageText,
                     is_user_message: isUserMessage,
                     timestamp: timestamp || new Date().toISOString()
@@ -219,38 +223,36 @@ document.addEventListener('DOMContentLoaded', () => {
 
         const userTimestamp = new Date().toISOString();
         addMessageToChat(messageText, 'user', userTimestamp);
-        saveChatMessage(currentUserId, messageText, true, userTimestamp);
+        saveChatMessage(messageText, true, userTimestamp);
         chatInput.value = '';
         productDisplayArea.innerHTML = ''; // Clear previous products
 
         try {
             const response = await fetch(`${apiUrl}/chat`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                // Send token if backend requires authentication for this route
-                // 'Authorization': `Bearer ${sessionToken}` 
-                body: JSON.stringify({ user_id: currentUserId, message: messageText })
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
+                body: JSON.stringify({ message: messageText })
             });
             const data = await response.json();
             const botTimestamp = new Date().toISOString();
 
             if (response.ok && data.status === 'success') {
                 addMessageToChat(data.message, 'bot', botTimestamp);
-                saveChatMessage(currentUserId, data.message, false, botTimestamp);
+                saveChatMessage(data.message, false, botTimestamp);
                 if (data.data && data.data.products) {
                     displayProducts(data.data.products);
                 }
             } else {
                 const errorMessage = data.message || 'Error processing your request.';
                 addMessageToChat(errorMessage, 'bot', botTimestamp);
-                saveChatMessage(currentUserId, errorMessage, false, botTimestamp);
+                saveChatMessage(errorMessage, false, botTimestamp);
                 displayChatMessage(errorMessage);
             }
         } catch (error) {
             const errorTimestamp = new Date().toISOString();
             const netError = 'Network error or server unavailable.';
             addMessageToChat(netError, 'bot', errorTimestamp);
-            saveChatMessage(currentUserId, netError, false, errorTimestamp);
+            saveChatMessage(netError, false, errorTimestamp);
             displayChatMessage(netError);
             console.error('Chat send error:', error);
         }
@@ -274,15 +276,14 @@ document.addEventListener('DOMContentLoaded', () => {
         const resetMsg = "Chat was reset by user.";
         const timestamp = new Date().toISOString();
         addMessageToChat(resetMsg, 'bot', timestamp); // Add to UI
-        saveChatMessage(currentUserId, resetMsg, false, timestamp); // Save to history
+        saveChatMessage(resetMsg, false, timestamp); // Save to history
     });
 
     // Load Chat History
     async function loadChatHistory() {
         if (!currentUserId) return;
         try {
-            const response = await fetch(`${apiUrl}/chat/history?user_id=${currentUserId}`);
-            // Add token if backend requires: headers: {'Authorization': `Bearer ${sessionToken}`}
+            const response = await fetch(`${apiUrl}/chat/history`, { headers: authHeaders() });
             const data = await response.json();
 
             if (response.ok && data.status === 'success' && data.data.history) {
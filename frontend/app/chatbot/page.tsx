@@ -14,9 +14,11 @@ interface Message {
   sender: "user" | "bot"
   timestamp: string
   products?: Product[]
+  nextCursor?: string | null // Cursor for POST /chat/more when the query had more results
 }
 
 interface ChatHistoryMessage {
+  id: number
   message: string
   is_user_message: boolean
   timestamp: string
@@ -25,7 +27,17 @@ interface ChatHistoryMessage {
 interface ChatHistoryResponse {
   status: string
   message: string
-  data?: { history: ChatHistoryMessage[] }
+  data?: {
+    history: ChatHistoryMessage[]
+    cursors?: { before: string | null; after: string | null }
+    has_more?: boolean
+  }
+}
+
+// Chat history already loaded from the backend, cached so a reload only fetches newer messages
+interface ChatHistoryCache {
+  cursor: string
+  messages: Message[]
 }
 
 interface Product {
@@ -33,19 +45,62 @@ interface Product {
   name: string
   price: number
   category: string
-  description: string
+  description?: string // Not included in the compact results the chat requests
   image_url?: string // Optional URL for the product image
 }
 
 interface ChatResponse {
   status: string
   message: string
-  data?: { products: Product[] }
+  data?: { products: Product[]; history_saved?: boolean }
+}
+
+// One line of a streamed /chat or /chat/more response (NDJSON)
+interface ChatStreamEvent {
+  event: "meta" | "products" | "end" | "error"
+  data: {
+    message?: string
+    products?: Product[]
+    has_more?: boolean
+    next_cursor?: string | null
+    history_saved?: boolean
+  }
 }
 
 // Use an environment variable for the API URL
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:5000";
 
+// Headers for authenticated requests: the backend identifies the user from the session token
+const authHeaders = (extra: Record<string, string> = {}) => ({
+  ...extra,
+  Authorization: `Bearer ${localStorage.getItem("userToken") || ""}`,
+});
+
+// History page size requested from the backend, and how many messages are kept in the local cache
+const HISTORY_PAGE_SIZE = 50;
+const HISTORY_CACHE_LIMIT = 200;
+const HISTORY_CACHE_PREFIX = "chatHistoryCache:";
+
+// Products per streamed event; the first cards render as soon as the first chunk arrives
+const STREAM_CHUNK_SIZE = 4;
+
+// Reads a streamed (NDJSON) response body, calling onEvent for each event as its line arrives
+const readChatStream = async (response: Response, onEvent: (event: ChatStreamEvent) => void) => {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffered += decoder.decode(value, { stream: !done });
+    const lines = buffered.split("\n");
+    buffered = lines.pop() || ""; // Keep a partial last line for the next read
+    for (const line of lines) {
+      if (line.trim()) onEvent(JSON.parse(line));
+    }
+    if (done) return;
+  }
+};
+
 // Main component for the chatbot page
 export default function ChatbotPage() {
   const [messages, setMessages] = useState<Message[]>([])
@@ -57,25 +112,76 @@ export default function ChatbotPage() {
   const messagesEndRef = useRef<HTMLDivElement>(null)
   const router = useRouter()
 
-  // Fetches the user's chat history from the backend
+  // Clears the stored session (and this user's cached history) and returns to the login page.
+  // Also used when the backend rejects the session token (expired or revoked).
+  const endSession = useCallback(() => {
+    const userId = localStorage.getItem("userId");
+    if (userId) {
+      localStorage.removeItem(`${HISTORY_CACHE_PREFIX}${userId}`); // Don't leave cached messages behind
+    }
+    localStorage.removeItem("userToken");
+    localStorage.removeItem("userId");
+    localStorage.removeItem("username");
+    router.push("/login");
+  }, [router]);
+
+  // Fetches the user's chat history from the backend.
+  // Messages already seen are kept in localStorage together with the newest history cursor,
+  // so on reload only messages newer than that cursor are requested.
   const loadChatHistory = useCallback(async () => {
     try {
       const userId = localStorage.getItem("userId");
       if (!userId) return; // Should not happen if auth check passed, but good for safety
 
-      const response = await fetch(`${API_URL}/chat/history?user_id=${userId}`);
+      const cacheKey = `${HISTORY_CACHE_PREFIX}${userId}`;
+      let cached: ChatHistoryCache | null = null;
+      try {
+        cached = JSON.parse(localStorage.getItem(cacheKey) || "null");
+      } catch {
+        cached = null; // Ignore a corrupt cache and fall back to a full load
+      }
+
+      const latestPageUrl = `${API_URL}/chat/history?limit=${HISTORY_PAGE_SIZE}`;
+      let response = await fetch(
+        cached?.cursor
+          ? `${API_URL}/chat/history?after=${encodeURIComponent(cached.cursor)}&limit=${HISTORY_PAGE_SIZE}`
+          : latestPageUrl,
+        { headers: authHeaders() }
+      );
+      if (response.status === 401) {
+        endSession();
+        return;
+      }
+      if (response.ok && cached?.cursor) {
+        const peek: ChatHistoryResponse = await response.clone().json();
+        if (peek.data?.has_more) {
+          // More than a page arrived since the cache was written; it's too stale to extend, so start over
+          cached = null;
+          response = await fetch(latestPageUrl, { headers: authHeaders() });
+        }
+      }
 
       if (response.ok) {
         const responseData: ChatHistoryResponse = await response.json();
         if (responseData.status === "success" && responseData.data?.history) {
           // Map backend history format to frontend Message interface
-          const formattedMessages = responseData.data.history.map((msg) => ({
-            id: msg.timestamp + Math.random().toString(36).substring(7), // Create a somewhat unique ID
+          const newMessages = responseData.data.history.map((msg) => ({
+            id: `history-${msg.id}`,
             text: msg.message,
             sender: (msg.is_user_message ? "user" : "bot") as "user" | "bot",
             timestamp: new Date(msg.timestamp).toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" }),
             // Note: products are not typically stored with individual history messages from backend
           }));
+          const previousMessages = cached?.messages || [];
+          const formattedMessages = [...previousMessages, ...newMessages].slice(-HISTORY_CACHE_LIMIT);
+
+          if (responseData.data.cursors?.after) {
+            localStorage.setItem(cacheKey, JSON.stringify({
+              cursor: responseData.data.cursors.after,
+              messages: formattedMessages,
+            }));
+          }
+
           if (formattedMessages.length > 0) {
             setMessages(formattedMessages);
           } else {
@@ -100,7 +206,7 @@ export default function ChatbotPage() {
       console.error("Error loading chat history:", err);
       setError("An error occurred while loading chat history.");
     }
-  }, []);
+  }, [endSession]);
   // Effect hook to run on component mount
   useEffect(() => {
     // Retrieve user authentication details from local storage
@@ -119,8 +225,9 @@ export default function ChatbotPage() {
     loadChatHistory();
   }, [router, loadChatHistory]);
 
-  // Sends a chat message (user or bot) to the backend to be saved in history
-  const saveChatHistory = async (messageText: string, senderType: "user" | "bot") => {
+  // Sends one or more chat messages (user or bot) to the backend to be saved in history,
+  // using a single request to the batch endpoint
+  const saveChatHistory = async (entries: { text: string; sender: "user" | "bot"; timestamp?: string }[]) => {
     try {
       const userId = localStorage.getItem("userId");
       if (!userId) {
@@ -128,19 +235,20 @@ export default function ChatbotPage() {
         return;
       }
 
-      await fetch(`${API_URL}/chat/history`, {
+      await fetch(`${API_URL}/chat/history/batch`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: authHeaders({ "Content-Type": "application/json" }),
         body: JSON.stringify({
-          user_id: parseInt(userId), // Backend expects an integer
-          message: messageText,
-          is_user_message: senderType === "user",
-          timestamp: new Date().toISOString(), // ISO format for backend
+          entries: entries.map((entry) => ({
+            message: entry.text,
+            is_user_message: entry.sender === "user",
+            timestamp: entry.timestamp || new Date().toISOString(), // ISO format for backend
+          })),
         }),
       });
       // Not handling response here for brevity, but in a real app, you might check for success
     } catch (err) {
-      console.error("Error saving chat message to history:", err);
+      console.error("Error saving chat messages to history:", err);
       // Optionally, notify the user or implement a retry mechanism
     }
   };
@@ -161,7 +269,6 @@ export default function ChatbotPage() {
     if (!inputMessage.trim() || isLoading) return; // Don't send empty or while already loading
 
     const userMessageText = inputMessage.trim();
-    const currentUserId = localStorage.getItem("userId");
 
     // Optimistically add user's message to the UI
     const newUserMsg: Message = {
@@ -177,44 +284,66 @@ export default function ChatbotPage() {
     setIsTyping(true);    // Show bot typing indicator
     setError("");         // Clear previous errors
 
-    // Persist user's message to backend history
-    await saveChatHistory(userMessageText, "user");
+    // The backend records the turn itself (persist: true); if it couldn't, the user's message is
+    // saved from here together with the bot's reply (or alone if the request fails)
+    const userMessageTimestamp = new Date().toISOString();
 
     try {
-      // Send message to the main /chat endpoint
+      // Send message to the main /chat endpoint; results are streamed back so the reply and
+      // the first product cards show up before the whole result page has been read
       const response = await fetch(`${API_URL}/chat`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: authHeaders({ "Content-Type": "application/json" }),
         body: JSON.stringify({
           message: userMessageText,
-          user_id: currentUserId ? parseInt(currentUserId) : null, // Backend expects integer
+          persist: true, // Ask the backend to save this turn to history
+          stream: true,
+          chunk_size: STREAM_CHUNK_SIZE,
+          view: "compact", // Cards load a product's description only when asked
         }),
       });
-
-      const responseData: ChatResponse = await response.json();
-
-      if (!response.ok || responseData.status !== "success") {
-        const errorDetail = responseData.message || "Chatbot API request failed";
-        throw new Error(errorDetail);
+      if (response.status === 401) {
+        endSession(); // Session expired or revoked; log in again
+        return;
+      }
+      if (!response.ok) {
+        // Errors are not streamed: they come back as the usual JSON envelope
+        const responseData: ChatResponse = await response.json().catch(() => ({}));
+        throw new Error(responseData.message || "Chatbot API request failed");
       }
 
-      // Construct bot's response message for UI
-      const botResponseMsg: Message = {
-        id: `bot-${Date.now()}`, // More descriptive ID
-        text: responseData.message || "Thanks for your message!", // Fallback text
-        sender: "bot",
-        timestamp: new Date().toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" }),
-        products: responseData.data?.products || [], // Safely access products
-      };
-
-      // Simulate bot "thinking" time then display and save response
-      setTimeout(() => {
-        setIsTyping(false); // Hide typing indicator
-        setMessages((prevMessages) => [...prevMessages, botResponseMsg]);
-        if (botResponseMsg.text) {
-          saveChatHistory(botResponseMsg.text, "bot"); // Persist bot's response
+      const botMessageId = `bot-${Date.now()}`; // More descriptive ID
+      let botText = "";
+      let historySaved = false;
+      await readChatStream(response, ({ event, data }) => {
+        if (event === "meta") {
+          // Construct bot's response message for UI; products are appended as they arrive
+          botText = data.message || "Thanks for your message!"; // Fallback text
+          setIsTyping(false); // Hide typing indicator
+          setMessages((prevMessages) => [...prevMessages, {
+            id: botMessageId,
+            text: botText,
+            sender: "bot",
+            timestamp: new Date().toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" }),
+            products: [],
+          }]);
+        } else if (event === "products") {
+          appendProducts(botMessageId, data.products || []);
+        } else if (event === "end") {
+          historySaved = Boolean(data.history_saved);
+          setNextCursor(botMessageId, data.has_more ? data.next_cursor : null);
+        } else if (event === "error") {
+          throw new Error(data.message || "Chatbot API request failed");
         }
-      }, 800); // Adjust delay as needed
+      });
+
+      // Persist the user's message and the bot's response in one request, unless the backend already did
+      if (!historySaved) {
+        saveChatHistory([
+          { text: userMessageText, sender: "user", timestamp: userMessageTimestamp },
+          ...(botText ? [{ text: botText, sender: "bot" as const }] : []),
+        ]);
+      }
 
     } catch (err) {
       // Handle errors from the /chat API call or other issues
@@ -230,11 +359,61 @@ export default function ChatbotPage() {
         timestamp: new Date().toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" }),
       };
       setMessages((prevMessages) => [...prevMessages, errorUiMsg]);
+      saveChatHistory([{ text: userMessageText, sender: "user", timestamp: userMessageTimestamp }]);
     } finally {
       setIsLoading(false); // Reset loading state
     }
   };
 
+  // Appends streamed product cards to the bot message they belong to
+  const appendProducts = (messageId: string, products: Product[]) => {
+    setMessages((prevMessages) => prevMessages.map((message) =>
+      message.id === messageId ? { ...message, products: [...(message.products || []), ...products] } : message
+    ));
+  };
+
+  const setNextCursor = (messageId: string, nextCursor: string | null | undefined) => {
+    setMessages((prevMessages) => prevMessages.map((message) =>
+      message.id === messageId ? { ...message, nextCursor: nextCursor || null } : message
+    ));
+  };
+
+  // Fetches the next page of results for a bot message and streams it into the same message
+  const handleShowMore = async (messageId: string, cursor: string) => {
+    if (isLoading) return;
+    setIsLoading(true);
+    setNextCursor(messageId, null); // Hide the button while the page loads
+    try {
+      const response = await fetch(`${API_URL}/chat/more`, {
+        method: "POST",
+        headers: authHeaders({ "Content-Type": "application/json" }),
+        body: JSON.stringify({ cursor, stream: true, chunk_size: STREAM_CHUNK_SIZE, view: "compact" }),
+      });
+      if (response.status === 401) {
+        endSession();
+        return;
+      }
+      if (!response.ok) {
+        const responseData: ChatResponse = await response.json().catch(() => ({}));
+        throw new Error(responseData.message || "Could not load more products");
+      }
+      await readChatStream(response, ({ event, data }) => {
+        if (event === "products") {
+          appendProducts(messageId, data.products || []);
+        } else if (event === "end") {
+          setNextCursor(messageId, data.has_more ? data.next_cursor : null);
+        } else if (event === "error") {
+          throw new Error(data.message || "Could not load more products");
+        }
+      });
+    } catch (err) {
+      setError((err as Error).message || "Could not load more products");
+      setNextCursor(messageId, cursor); // Let the user retry
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
   // Clears the chat messages from the UI (client-side reset)
   const handleReset = () => {
     setMessages([{ // Reset to initial welcome message
@@ -248,17 +427,16 @@ export default function ChatbotPage() {
     // A "Chat Reset" event could be logged to history if desired.
     const userId = localStorage.getItem("userId");
     if (userId) {
-      saveChatHistory("User reset the chat.", "user"); // Log reset action
+      saveChatHistory([{ text: "User reset the chat.", sender: "user" }]); // Log reset action
     }
     console.log("Chat UI reset. Server-side history remains.");
   };
 
-  // Handles user logout: clears local storage and redirects to login page
+  // Handles user logout: revokes the session token, clears local storage and redirects to login page
   const handleLogout = () => {
-    localStorage.removeItem("userToken");
-    localStorage.removeItem("userId");
-    localStorage.removeItem("username");
-    router.push("/login");
+    // Revoke the token on the backend; the local session is cleared whatever the outcome
+    fetch(`${API_URL}/logout`, { method: "POST", headers: authHeaders() }).catch(() => {});
+    endSession();
   };
 
   // Allows sending message by pressing Enter key in the input field
@@ -360,6 +538,15 @@ export default function ChatbotPage() {
                     <ProductCard key={product.id} product={product} />
                   ))}
                 </div>
+                {message.nextCursor && (
+                  <button
+                    onClick={() => handleShowMore(message.id, message.nextCursor!)}
+                    disabled={isLoading}
+                    className="mt-3 px-4 py-2 text-sm font-medium text-indigo-600 bg-white border border-indigo-200 rounded-full hover:bg-indigo-50 disabled:opacity-60 disabled:cursor-not-allowed transition-all duration-150 ease-in-out shadow-sm"
+                  >
+                    Show more
+                  </button>
+                )}
               </div>
             )}
           </div>
@@ -1,5 +1,6 @@
 "use client"
 
+import { useState } from "react"
 import Image from "next/image"
 import { ShoppingCart, Star } from "lucide-react"
 
@@ -9,10 +10,12 @@ interface Product {
   name: string;
   price: number;
   category: string;
-  description: string;
+  description?: string; // Left out of compact list results; loaded from GET /products/<id> on demand
   image_url?: string; // URL for the product image, optional
 }
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:5000";
+
 // Defines the props expected by the ProductCard component
 interface ProductCardProps {
   product: Product; // The product data to display
@@ -20,7 +23,25 @@ interface ProductCardProps {
 
 // ProductCard component: Renders a single product item in a card layout
 export default function ProductCard({ product }: ProductCardProps) {
-  
+  const [description, setDescription] = useState(product.description);
+  const [loadingDetails, setLoadingDetails] = useState(false);
+
+  // Fetches the full product (including its description) for cards built from compact results
+  const handleShowDetails = async () => {
+    setLoadingDetails(true);
+    try {
+      const response = await fetch(`${API_URL}/products/${product.id}`);
+      const responseData = await response.json();
+      if (response.ok && responseData.status === "success") {
+        setDescription(responseData.data.description || "");
+      }
+    } catch (err) {
+      console.error("Error loading product details:", err);
+    } finally {
+      setLoadingDetails(false);
+    }
+  };
+
   // Placeholder function for "Add to Cart" button click
   const handleAddToCart = () => {
     // In a real application, this would dispatch an action to update cart state
@@ -57,7 +78,19 @@ export default function ProductCard({ product }: ProductCardProps) {
           </span>
         </div>
 
-        <p className="text-gray-500 text-xs sm:text-sm mb-3 line-clamp-2 flex-grow">{product.description}</p>
+        {description !== undefined ? (
+          <p className="text-gray-500 text-xs sm:text-sm mb-3 line-clamp-2 flex-grow">{description}</p>
+        ) : (
+          <div className="mb-3 flex-grow">
+            <button
+              onClick={handleShowDetails}
+              disabled={loadingDetails}
+              className="text-xs sm:text-sm text-indigo-600 hover:text-indigo-800 hover:underline disabled:opacity-60"
+            >
+              {loadingDetails ? "Loading details..." : "Show details"}
+            </button>
+          </div>
+        )}
 
         <div className="flex items-center mb-2">
           <div className="flex items-center">